@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""Бенчмарки монолита hotel_booking_system.py
+
+    python bench_monolith.py inventory [--processes 8] [--threads 8] [--rooms 2000] [--attempts 1000]
+    python bench_monolith.py clone [--group 1000] [--repeat 20]
+    python bench_monolith.py pricing [--group 1000] [--repeat 20]
+    python bench_monolith.py storage [--threads 8] [--groups 50] [--group 10]
+    python bench_monolith.py notify [--requests 200] [--group 3] [--delay-ms 2]
+"""
+import argparse
+import copy
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import hotel_booking_system
+from hotel_booking_system import (BookingBuilder, BookingObserver, BookingPrototype, BookingSubject,
+                                   FlexibleTariff, HotelComplexFactory, LateCheckoutDecorator, MiniBarDecorator,
+                                   NotificationDispatcher, PricingPipeline, RoomFactory, SharedInventory,
+                                   fetch_bookings, insert_bookings)
+
+
+def run_threads(threads, target):
+    workers = [threading.Thread(target=target) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def shared_inventory_worker(name, lock_path, rooms, threads, attempts, results):
+    inventory = SharedInventory({'Standard': rooms}, name=name, lock_path=lock_path)
+    booked = []
+
+    def reserve():
+        booked.append(sum(inventory.reserve('Standard', 1) for _ in range(attempts)))
+
+    run_threads(threads, reserve)
+    inventory.close()
+    results.put(sum(booked))
+
+
+def dict_inventory_worker(rooms, threads, attempts, results):
+    # Прежняя реализация: словарь в каждом процессе, проверка и списание без блокировки
+    available_rooms = {'Standard': rooms}
+    booked = []
+
+    def reserve():
+        count = 0
+        for _ in range(attempts):
+            if available_rooms['Standard'] >= 1:
+                available_rooms['Standard'] -= 1
+                count += 1
+        booked.append(count)
+
+    run_threads(threads, reserve)
+    results.put(sum(booked))
+
+
+def run_processes(target, args, processes):
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=target, args=args + (results,)) for _ in range(processes)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    booked = sum(results.get() for _ in workers)
+    for worker in workers:
+        worker.join()
+    return booked, time.perf_counter() - started
+
+
+def bench_inventory(options):
+    attempts_total = options.processes * options.threads * options.attempts
+    print(f"{options.processes} процессов x {options.threads} потоков x {options.attempts} попыток, "
+          f"номеров: {options.rooms}")
+
+    booked, elapsed = run_processes(dict_inventory_worker,
+                                    (options.rooms, options.threads, options.attempts), options.processes)
+    print(f"dict в процессе:  забронировано {booked}, перебронирование {max(booked - options.rooms, 0)}, "
+          f"{attempts_total / elapsed:,.0f} попыток/с")
+
+    name = f'hotel_inventory_bench_{uuid.uuid4().hex[:8]}'
+    lock_path = os.path.join(tempfile.gettempdir(), f'{name}.lock')
+    inventory = SharedInventory({'Standard': options.rooms}, name=name, lock_path=lock_path)
+    try:
+        booked, elapsed = run_processes(shared_inventory_worker,
+                                        (name, lock_path, options.rooms, options.threads, options.attempts),
+                                        options.processes)
+        remaining = inventory.available('Standard')
+    finally:
+        inventory.close()
+        inventory.unlink()
+        os.remove(lock_path)
+    print(f"общая память:     забронировано {booked}, осталось {remaining}, "
+          f"перебронирование {max(booked - options.rooms, 0)}, {attempts_total / elapsed:,.0f} попыток/с")
+
+    expected = min(options.rooms, attempts_total)
+    if booked != expected or remaining != options.rooms - expected:
+        print("ОШИБКА: общий учёт номеров нарушен")
+        return 1
+    return 0
+
+
+class LegacyPackage:
+    # Прежний изменяемый пакет, который копировался целиком
+    def __init__(self, room, services, breakfast, transfer):
+        self.room = room
+        self.services = list(services)
+        self.breakfast = breakfast
+        self.transfer = transfer
+
+
+class LegacyBooking:
+    # Прежний прототип: clone() через deepcopy
+    def __init__(self, package, check_in, check_out, price):
+        self.package = package
+        self.check_in = check_in
+        self.check_out = check_out
+        self.price = price
+        self.id = str(uuid.uuid4())
+
+    def clone(self):
+        return copy.deepcopy(self)
+
+
+def time_group(make_group, group, repeat):
+    """Лучшее время создания группы из group копий, в секундах"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        clones = make_group(group)
+        best = min(best, time.perf_counter() - started)
+    assert len(clones) == group
+    return best
+
+
+def bench_clone(options):
+    room = RoomFactory.create_room('Luxury')
+    hotel = HotelComplexFactory.create_hotel('Resort')
+    package = BookingBuilder().set_room(room).set_hotel_services(hotel).add_breakfast().add_transfer().build()
+    prototype = BookingPrototype(package, '2025-12-15', '2025-12-20', 1250.0)
+    legacy = LegacyBooking(LegacyPackage(room, hotel.get_services(), True, True), '2025-12-15', '2025-12-20', 1250.0)
+
+    timings = [
+        ('deepcopy', time_group(lambda count: [legacy.clone() for _ in range(count)], options.group, options.repeat)),
+        ('clone()', time_group(lambda count: [prototype.clone() for _ in range(count)], options.group, options.repeat)),
+        ('clone_many()', time_group(prototype.clone_many, options.group, options.repeat)),
+    ]
+    print(f"группа из {options.group} номеров, лучшее из {options.repeat}")
+    for label, elapsed in timings:
+        print(f"{label + ':':<16}{elapsed * 1e6:10,.0f} мкс на группу, {elapsed / options.group * 1e6:6.2f} мкс на копию, "
+              f"ускорение {timings[0][1] / elapsed:5.1f}x")
+
+    clones = prototype.clone_many(options.group)
+    if len({booking.id for booking in clones}) != options.group or any(b.package is not package for b in clones):
+        print("ОШИБКА: копии должны иметь разные id и общий пакет")
+        return 1
+    return 0
+
+
+def legacy_group_price(package, base_price, days, group):
+    # Прежний расчёт: стратегия, клоны и обёртка каждой брони в декораторы
+    strategy = FlexibleTariff()
+    bookings = BookingPrototype(package, '2025-12-15', '2025-12-20',
+                                strategy.calculate_price(base_price, days)).clone_many(group)
+    for i, booking in enumerate(bookings):
+        bookings[i] = LateCheckoutDecorator(MiniBarDecorator(booking))
+    return bookings, sum(b.price for b in bookings)
+
+
+def compiled_group_price(package, base_price, days, group):
+    pricing = PricingPipeline.compile(FlexibleTariff(), (MiniBarDecorator, LateCheckoutDecorator))
+    price, total = pricing.price_group(base_price, days, group)
+    return BookingPrototype(package, '2025-12-15', '2025-12-20', price).clone_many(group), total
+
+
+def bench_pricing(options):
+    room = RoomFactory.create_room('Luxury')
+    package = BookingBuilder().set_room(room).build()
+    base_price, days = room.get_base_price(), 5
+
+    timings = []
+    for label, price_group in (('декораторы', legacy_group_price), ('конвейер', compiled_group_price)):
+        elapsed = time_group(lambda count: price_group(package, base_price, days, count)[0],
+                             options.group, options.repeat)
+        timings.append((label, elapsed))
+    print(f"цена группы из {options.group} номеров, лучшее из {options.repeat}")
+    for label, elapsed in timings:
+        print(f"{label + ':':<16}{elapsed * 1e6:10,.0f} мкс на группу, {elapsed / options.group * 1e6:6.2f} мкс на бронь, "
+              f"ускорение {timings[0][1] / elapsed:5.1f}x")
+
+    legacy_bookings, legacy_total = legacy_group_price(package, base_price, days, options.group)
+    bookings, total = compiled_group_price(package, base_price, days, options.group)
+    if (abs(total - legacy_total) > 1e-6 * legacy_total or
+            any(abs(b.price - l.price) > 1e-9 for b, l in zip(bookings, legacy_bookings))):
+        print("ОШИБКА: конвейер считает цену иначе, чем декораторы")
+        return 1
+    return 0
+
+
+BOOKING_INSERT = ("INSERT INTO bookings (id, hotel_name, room_type, check_in, check_out, services, total_price, status) "
+                  "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+
+
+def booking_rows(group):
+    return [(str(uuid.uuid4()), 'Sunny', 'Standard', '2025-12-15', '2025-12-20', 'Номер: Standard', 600.0, 'Подтверждено')
+            for _ in range(group)]
+
+
+def legacy_storage_worker(path, groups, group, errors):
+    # Прежняя схема: новое соединение на запрос, INSERT и SELECT по одной брони
+    for _ in range(groups):
+        rows = booking_rows(group)
+        try:
+            conn = sqlite3.connect(path)
+            c = conn.cursor()
+            for row in rows:
+                c.execute(BOOKING_INSERT, row)
+            conn.commit()
+            conn.close()
+
+            conn = sqlite3.connect(path)
+            c = conn.cursor()
+            for row in rows:
+                c.execute("SELECT * FROM bookings WHERE id = ?", (row[0],))
+                c.fetchone()
+            conn.close()
+        except sqlite3.OperationalError as e:
+            errors.append(str(e))
+
+
+def storage_worker(path, groups, group, errors):
+    for _ in range(groups):
+        rows = booking_rows(group)
+        try:
+            insert_bookings(rows)
+            if len(fetch_bookings([row[0] for row in rows])) != group:
+                errors.append('не все брони прочитаны')
+        except sqlite3.OperationalError as e:
+            errors.append(str(e))
+
+
+def run_storage(worker, path, options):
+    errors = []
+    started = time.perf_counter()
+    run_threads(options.threads, lambda: worker(path, options.groups, options.group, errors))
+    return errors, time.perf_counter() - started
+
+
+def bench_storage(options):
+    bookings_total = options.threads * options.groups * options.group
+    print(f"{options.threads} потоков x {options.groups} групп x {options.group} броней: запись и чтение подтверждения")
+
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_path = os.path.join(directory, 'legacy.db')
+        conn = sqlite3.connect(legacy_path)
+        conn.execute('''CREATE TABLE bookings
+                        (id TEXT PRIMARY KEY, hotel_name TEXT, room_type TEXT, check_in TEXT, check_out TEXT,
+                         services TEXT, total_price REAL, status TEXT)''')
+        conn.close()
+        legacy_errors, legacy_elapsed = run_storage(legacy_storage_worker, legacy_path, options)
+        print(f"{'соединение на запрос:':<27}{bookings_total / legacy_elapsed:10,.0f} броней/с, ошибок {len(legacy_errors)}")
+
+        hotel_booking_system.DATABASE_PATH = os.path.join(directory, 'wal.db')
+        hotel_booking_system.init_db()
+        errors, elapsed = run_storage(storage_worker, hotel_booking_system.DATABASE_PATH, options)
+        print(f"{'WAL + соединение на поток:':<27}{bookings_total / elapsed:10,.0f} броней/с, ошибок {len(errors)}, "
+              f"ускорение {legacy_elapsed / elapsed:5.1f}x")
+
+    if errors:
+        print(f"ОШИБКА: {errors[0]}")
+        return 1
+    return 0
+
+
+class SlowNotifier(BookingObserver):
+    # Наблюдатель с сетевой задержкой на каждый вызов, пачка отправляется одним вызовом
+    def __init__(self, delay):
+        self.delay = delay
+        self.delivered = []
+
+    def update(self, booking_id, status):
+        time.sleep(self.delay)
+        self.delivered.append(booking_id)
+
+    def update_many(self, events):
+        time.sleep(self.delay)
+        self.delivered.extend(booking_id for booking_id, _ in events)
+
+
+class FailingNotifier(BookingObserver):
+    def update(self, booking_id, status):
+        raise ConnectionError('провайдер недоступен')
+
+
+def bench_notify(options):
+    delay = options.delay_ms / 1000
+    groups = [[(str(uuid.uuid4()), 'Подтверждено') for _ in range(options.group)] for _ in range(options.requests)]
+    expected = [booking_id for events in groups for booking_id, _ in events]
+    print(f"{options.requests} запросов x {options.group} броней, 2 наблюдателя по {options.delay_ms} мс на вызов")
+
+    subject = BookingSubject()
+    notifiers = [SlowNotifier(delay), SlowNotifier(delay)]
+    for notifier in notifiers:
+        subject.attach(notifier)
+    started = time.perf_counter()
+    for events in groups:
+        for booking_id, status in events:
+            subject.notify(booking_id, status)
+    sync_elapsed = time.perf_counter() - started
+    print(f"{'синхронно:':<16}{sync_elapsed / options.requests * 1e3:8.3f} мс на запрос")
+
+    dispatcher = NotificationDispatcher()
+    subject = BookingSubject(dispatcher)
+    notifiers = [SlowNotifier(delay), FailingNotifier(), SlowNotifier(delay)]
+    for notifier in notifiers:
+        subject.attach(notifier)
+    started = time.perf_counter()
+    for events in groups:
+        subject.notify_async(events)
+    async_elapsed = time.perf_counter() - started
+    flushed = dispatcher.flush(timeout=60)
+    delivered_elapsed = time.perf_counter() - started
+    dispatcher.close()
+    print(f"{'в очередь:':<16}{async_elapsed / options.requests * 1e3:8.3f} мс на запрос, "
+          f"ускорение {sync_elapsed / async_elapsed:,.0f}x; все уведомления доставлены за {delivered_elapsed * 1e3:,.0f} мс")
+
+    if not flushed or any(notifier.delivered != expected for notifier in (notifiers[0], notifiers[2])):
+        print("ОШИБКА: уведомления потеряны или доставлены не по порядку")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    inventory = commands.add_parser('inventory', help='параллельное бронирование: перебронирование и пропускная способность')
+    inventory.add_argument('--processes', type=int, default=8)
+    inventory.add_argument('--threads', type=int, default=8)
+    inventory.add_argument('--rooms', type=int, default=2000)
+    inventory.add_argument('--attempts', type=int, default=1000)
+    inventory.set_defaults(run=bench_inventory)
+
+    clone = commands.add_parser('clone', help='клонирование бронирований группы: deepcopy против clone()')
+    clone.add_argument('--group', type=int, default=1000)
+    clone.add_argument('--repeat', type=int, default=20)
+    clone.set_defaults(run=bench_clone)
+
+    pricing = commands.add_parser('pricing', help='цена группы: обёртки-декораторы против скомпилированного конвейера')
+    pricing.add_argument('--group', type=int, default=1000)
+    pricing.add_argument('--repeat', type=int, default=20)
+    pricing.set_defaults(run=bench_pricing)
+
+    storage = commands.add_parser('storage', help='SQLite: параллельная запись и чтение броней')
+    storage.add_argument('--threads', type=int, default=8)
+    storage.add_argument('--groups', type=int, default=50)
+    storage.add_argument('--group', type=int, default=10)
+    storage.set_defaults(run=bench_storage)
+
+    notify = commands.add_parser('notify', help='уведомления: синхронные наблюдатели против фоновой очереди')
+    notify.add_argument('--requests', type=int, default=200)
+    notify.add_argument('--group', type=int, default=3)
+    notify.add_argument('--delay-ms', type=float, default=2)
+    notify.set_defaults(run=bench_notify)
+
+    options = parser.parse_args()
+    return options.run(options)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,52 +1,269 @@
+import atexit
+import hashlib
+import logging
+import os
+import queue
 import sqlite3
+import struct
+import sys
+import tempfile
+import threading
 import uuid
 from abc import ABC, abstractmethod
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import datetime
-from copy import deepcopy
+from multiprocessing import resource_tracker, shared_memory
 from flask import Flask, render_template, request, redirect, url_for, flash
 from typing import List, Dict
 import json
 
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки действуют только внутри процесса
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'
 
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'hotel_bookings.db')
+# Сколько ждать освобождения блокировки записи вместо ошибки "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+# Размер кэша страниц на соединение, КиБ
+SQLITE_CACHE_KIB = int(os.getenv('SQLITE_CACHE_KIB', 16384))
+# Не больше параметров в одном запросе, чем разрешает SQLite
+SQLITE_MAX_PARAMS = 500
+
+def connect_db() -> sqlite3.Connection:
+    conn = sqlite3.connect(DATABASE_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+    # WAL: читатели не блокируют писателя и наоборот; при WAL synchronous=NORMAL
+    # не теряет целостность, а fsync делается только при checkpoint
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_KIB}')
+    conn.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    return conn
+
+# Одно соединение на поток, переиспользуемое между запросами. Соединение,
+# унаследованное через fork (воркеры gunicorn), не используется.
+_db_local = threading.local()
+
+def get_db() -> sqlite3.Connection:
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None or _db_local.pid != os.getpid():
+        conn = connect_db()
+        _db_local.conn = conn
+        _db_local.pid = os.getpid()
+    return conn
+
 # Инициализация базы данных SQLite
 def init_db():
-    conn = sqlite3.connect('hotel_bookings.db')
+    conn = connect_db()
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS bookings
                  (id TEXT PRIMARY KEY, hotel_name TEXT, room_type TEXT, check_in TEXT, check_out TEXT, services TEXT, total_price REAL, status TEXT)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_bookings_hotel_room_check_in
+                 ON bookings (hotel_name, room_type, check_in)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_bookings_status ON bookings (status)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS room_inventory
+                 (room_type TEXT PRIMARY KEY, available INTEGER NOT NULL)''')
     conn.commit()
     conn.close()
 
 init_db()
 
+def insert_bookings(rows: List[tuple]):
+    # Остатки в room_inventory уменьшаются в той же транзакции, что и запись броней,
+    # поэтому после сбоя они восстанавливаются ровно по зафиксированным броням
+    conn = get_db()
+    with conn:
+        conn.executemany("INSERT INTO bookings (id, hotel_name, room_type, check_in, check_out, services, total_price, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         rows)
+        conn.executemany('UPDATE room_inventory SET available = available - ? WHERE room_type = ?',
+                         [(count, room_type) for room_type, count in Counter(row[2] for row in rows).items()])
+
+def fetch_bookings(booking_ids: List[str]) -> List[tuple]:
+    # Один запрос IN (...) на пачку id; порядок строк как в booking_ids
+    conn = get_db()
+    found = {}
+    for start in range(0, len(booking_ids), SQLITE_MAX_PARAMS):
+        chunk = booking_ids[start:start + SQLITE_MAX_PARAMS]
+        placeholders = ', '.join('?' * len(chunk))
+        for row in conn.execute(f"SELECT * FROM bookings WHERE id IN ({placeholders})", chunk):
+            found[row[0]] = row
+    return [found[bid] for bid in booking_ids if bid in found]
+
+# Начальное количество свободных номеров по типам
+ROOM_INVENTORY = {'Standard': 10, 'Luxury': 5, 'Apartment': 3}
+# Блок общей памяти и файл блокировок, общие для всех воркеров
+INVENTORY_SHM_NAME = os.getenv('INVENTORY_SHM_NAME', 'hotel_inventory')
+INVENTORY_LOCK_PATH = os.getenv('INVENTORY_LOCK_PATH',
+                                os.path.join(tempfile.gettempdir(), f'{INVENTORY_SHM_NAME}.lock'))
+
+# Долговременные остатки, из которых заполняется новый блок общей памяти
+def load_inventory() -> Dict[str, int]:
+    conn = get_db()
+    with conn:
+        conn.executemany('INSERT OR IGNORE INTO room_inventory (room_type, available) VALUES (?, ?)',
+                         list(ROOM_INVENTORY.items()))
+    return dict(conn.execute('SELECT room_type, available FROM room_inventory').fetchall())
+
+class InventoryLayoutError(RuntimeError):
+    pass
+
+# Остатки номеров в общей памяти (multiprocessing.shared_memory), видимые всем
+# процессам gunicorn. Каждый тип номера защищён своей блокировкой (lock striping):
+# threading.Lock между потоками процесса и fcntl-блокировкой байта файла между процессами.
+#
+# Блок переживает воркеры, поэтому начинается с заголовка: версия формата, хэш
+# списка типов номеров и их число. Блок другого формата или с другими типами
+# номеров (изменён ROOM_INVENTORY, чужое развёртывание с тем же именем) не
+# используется: его нужно удалить через reset_inventory() при остановленных воркерах.
+class SharedInventory:
+    LAYOUT_VERSION = 0x48494E5600000001  # 'HINV', версия 1
+    HEADER_SLOTS = 3
+
+    def __init__(self, initial: Dict[str, int], loader=None,
+                 name: str = INVENTORY_SHM_NAME, lock_path: str = INVENTORY_LOCK_PATH):
+        self.room_types = list(initial)
+        self._slots = {room_type: self.HEADER_SLOTS + index for index, room_type in enumerate(self.room_types)}
+        size = 8 * (self.HEADER_SLOTS + len(self.room_types))
+        # Блокировка 0 - инициализация блока, далее по блокировке на тип номера
+        self._thread_locks = [threading.Lock() for _ in range(self.HEADER_SLOTS + len(self.room_types))]
+        self._lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        mismatch = None
+        with self._locked(0):
+            try:
+                self._shm = shared_memory.SharedMemory(name=name)
+            except FileNotFoundError:
+                self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            # Блок живёт дольше любого воркера, поэтому resource_tracker не должен удалять его при выходе
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+            header = (self.LAYOUT_VERSION, self.layout_hash(self.room_types), len(self.room_types))
+            if self._shm.size < size:
+                mismatch = 'блок меньше ожидаемого'
+            elif self._get(0) == 0:
+                # Новый блок или инициализация прервалась: версия пишется последней
+                counts = dict(initial)
+                if loader is not None:
+                    counts.update({room_type: count for room_type, count in loader().items()
+                                   if room_type in self._slots})
+                for room_type, slot in self._slots.items():
+                    self._set(slot, counts[room_type])
+                self._set(2, header[2])
+                self._set(1, header[1])
+                self._set(0, header[0])
+            elif (self._get(0), self._get(1), self._get(2)) != header:
+                mismatch = 'другой формат или другие типы номеров'
+        if mismatch:
+            self.close()
+            raise InventoryLayoutError(
+                f"Блок общей памяти {name} не подходит ({mismatch}). Остановите воркеры и выполните "
+                f"`python hotel_booking_system.py --reset-inventory` или задайте другой INVENTORY_SHM_NAME")
+
+    @staticmethod
+    def layout_hash(room_types: List[str]) -> int:
+        digest = hashlib.sha1('\0'.join(room_types).encode()).digest()
+        return int.from_bytes(digest[:8], 'little', signed=True)
+
+
+    def _get(self, slot: int) -> int:
+        return struct.unpack_from('q', self._shm.buf, slot * 8)[0]
+
+    def _set(self, slot: int, value: int):
+        struct.pack_into('q', self._shm.buf, slot * 8, value)
+
+    @contextmanager
+    def _locked(self, slot: int):
+        with self._thread_locks[slot]:
+            if fcntl is not None:
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_EX, 1, slot)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, slot)
+
+    def available(self, room_type: str) -> int:
+        slot = self._slots.get(room_type)
+        return self._get(slot) if slot is not None else 0
+
+    def reserve(self, room_type: str, quantity: int) -> bool:
+        slot = self._slots.get(room_type)
+        if slot is None or quantity < 1:
+            return False
+        with self._locked(slot):
+            available = self._get(slot)
+            if available < quantity:
+                return False
+            self._set(slot, available - quantity)
+            return True
+
+    def release(self, room_type: str, quantity: int):
+        slot = self._slots.get(room_type)
+        if slot is None or quantity < 1:
+            return
+        with self._locked(slot):
+            self._set(slot, self._get(slot) + quantity)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {room_type: self._get(slot) for room_type, slot in self._slots.items()}
+
+    def close(self):
+        self._shm.close()
+        os.close(self._lock_fd)
+
+    def unlink(self):
+        # unlink() снимает регистрацию в resource_tracker, поэтому регистрируем блок обратно
+        resource_tracker.register(self._shm._name, 'shared_memory')
+        self._shm.unlink()
+
+# Удаляет блок остатков; следующий воркер создаст новый и заполнит его из room_inventory
+def reset_inventory(name: str = INVENTORY_SHM_NAME) -> bool:
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    shm.close()
+    shm.unlink()
+    return True
+
 # Паттерн Singleton: Менеджер бронирований
 class BookingManager:
     _instance = None
+    _instance_lock = threading.Lock()
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super(BookingManager, cls).__new__(cls)
-            cls._instance.available_rooms = {
-                'Standard': 10, 'Luxury': 5, 'Apartment': 3
-            }
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super(BookingManager, cls).__new__(cls)
+                    instance.inventory = SharedInventory(ROOM_INVENTORY, load_inventory)
+                    cls._instance = instance
         return cls._instance
 
+    @property
+    def available_rooms(self) -> Dict[str, int]:
+        return self.inventory.snapshot()
+
     def check_availability(self, room_type: str, quantity: int) -> bool:
-        return self.available_rooms.get(room_type, 0) >= quantity
+        return self.inventory.available(room_type) >= quantity
 
     def reserve_room(self, room_type: str, quantity: int) -> bool:
-        if self.check_availability(room_type, quantity):
-            self.available_rooms[room_type] -= quantity
-            return True
-        return False
+        # Проверка и списание выполняются атомарно под блокировкой типа номера
+        return self.inventory.reserve(room_type, quantity)
 
     def release_room(self, room_type: str, quantity: int):
-        self.available_rooms[room_type] = self.available_rooms.get(room_type, 0) + quantity
+        self.inventory.release(room_type, quantity)
 
 # Паттерн Factory Method: Создание номеров
+# Номера не имеют состояния, поэтому один экземпляр можно разделять между бронированиями
 class Room(ABC):
+    __slots__ = ()
+
     @abstractmethod
     def get_description(self) -> str:
         pass
@@ -56,6 +273,8 @@ class Room(ABC):
         pass
 
 class StandardRoom(Room):
+    __slots__ = ()
+
     def get_description(self) -> str:
         return "Стандартный номер: Уютный одноместный номер с базовыми удобствами"
     
@@ -63,6 +282,8 @@ class StandardRoom(Room):
         return 100.0
 
 class LuxuryRoom(Room):
+    __slots__ = ()
+
     def get_description(self) -> str:
         return "Люкс: Просторный номер с премиум-удобствами"
     
@@ -70,6 +291,8 @@ class LuxuryRoom(Room):
         return 250.0
 
 class ApartmentRoom(Room):
+    __slots__ = ()
+
     def get_description(self) -> str:
         return "Апартаменты: Полноценный номер с кухней и гостиной"
     
@@ -111,48 +334,70 @@ class HotelComplexFactory:
         raise ValueError("Неизвестный тип отеля")
 
 # Паттерн Builder: Сборка пакета бронирования
+# Пакет неизменяем после сборки, поэтому все бронирования группы разделяют один экземпляр
 class BookingPackage:
-    def __init__(self):
-        self.room = None
-        self.services = []
-        self.breakfast = False
-        self.transfer = False
+    __slots__ = ('room', 'services', 'breakfast', 'transfer', '_description')
+
+    def __init__(self, room: Room, services=(), breakfast: bool = False, transfer: bool = False):
+        object.__setattr__(self, 'room', room)
+        object.__setattr__(self, 'services', tuple(services))
+        object.__setattr__(self, 'breakfast', breakfast)
+        object.__setattr__(self, 'transfer', transfer)
+        object.__setattr__(self, '_description', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BookingPackage неизменяем")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
     def __str__(self) -> str:
-        services = ", ".join(self.services)
-        extras = []
-        if self.breakfast:
-            extras.append("Завтрак")
-        if self.transfer:
-            extras.append("Трансфер")
-        extras_str = ", ".join(extras) if extras else "Отсутствуют"
-        return f"Номер: {self.room.get_description()}, Услуги: {services}, Дополнительно: {extras_str}"
+        # Описание одинаково для всей группы и вычисляется один раз
+        if self._description is None:
+            services = ", ".join(self.services)
+            extras = []
+            if self.breakfast:
+                extras.append("Завтрак")
+            if self.transfer:
+                extras.append("Трансфер")
+            extras_str = ", ".join(extras) if extras else "Отсутствуют"
+            object.__setattr__(self, '_description',
+                               f"Номер: {self.room.get_description()}, Услуги: {services}, Дополнительно: {extras_str}")
+        return self._description
 
 class BookingBuilder:
     def __init__(self):
-        self.package = BookingPackage()
+        self.room = None
+        self.services = []
+        self.breakfast = False
+        self.transfer = False
 
     def set_room(self, room: Room):
-        self.package.room = room
+        self.room = room
         return self
 
     def set_hotel_services(self, hotel: HotelComplex):
-        self.package.services = hotel.get_services()
+        self.services = hotel.get_services()
         return self
 
     def add_breakfast(self):
-        self.package.breakfast = True
+        self.breakfast = True
         return self
 
     def add_transfer(self):
-        self.package.transfer = True
+        self.transfer = True
         return self
 
     def build(self) -> BookingPackage:
-        return self.package
+        return BookingPackage(self.room, self.services, self.breakfast, self.transfer)
 
 # Паттерн Prototype: Клонирование бронирований
 class BookingPrototype:
+    __slots__ = ('package', 'check_in', 'check_out', 'price', 'id')
+
     def __init__(self, package: BookingPackage, check_in: str, check_out: str, price: float):
         self.package = package
         self.check_in = check_in
@@ -160,8 +405,22 @@ class BookingPrototype:
         self.price = price
         self.id = str(uuid.uuid4())
 
+    def _copy(self) -> 'BookingPrototype':
+        # Неизменяемые пакет и даты разделяются по ссылке; своими у копии
+        # являются только цена и новый id
+        booking = BookingPrototype.__new__(BookingPrototype)
+        booking.package = self.package
+        booking.check_in = self.check_in
+        booking.check_out = self.check_out
+        booking.price = self.price
+        booking.id = str(uuid.uuid4())
+        return booking
+
     def clone(self) -> 'BookingPrototype':
-        return deepcopy(self)
+        return self._copy()
+
+    def clone_many(self, count: int) -> List['BookingPrototype']:
+        return [self._copy() for _ in range(count)]
 
 # Паттерн Adapter: Обработка платежей
 class PaymentProcessor(ABC):
@@ -194,17 +453,113 @@ class BookingObserver(ABC):
     def update(self, booking_id: str, status: str):
         pass
 
+    # Пачка событий (booking_id, status); наблюдатель с пакетной отправкой переопределяет
+    def update_many(self, events: List[tuple]):
+        for booking_id, status in events:
+            self.update(booking_id, status)
+
 class EmailNotifier(BookingObserver):
     def update(self, booking_id: str, status: str):
-        flash(f"Email отправлен: Бронирование {booking_id} {status}")
+        logger.info(f"Email отправлен: Бронирование {booking_id} {status}")
 
 class SMSNotifier(BookingObserver):
     def update(self, booking_id: str, status: str):
-        flash(f"SMS отправлен: Бронирование {booking_id} {status}")
+        logger.info(f"SMS отправлен: Бронирование {booking_id} {status}")
+
+# Очередь уведомлений не длиннее NOTIFICATION_QUEUE_SIZE заданий
+NOTIFICATION_QUEUE_SIZE = int(os.getenv('NOTIFICATION_QUEUE_SIZE', 10000))
+# Сколько заданий фоновый поток забирает из очереди за раз
+NOTIFICATION_BATCH_SIZE = int(os.getenv('NOTIFICATION_BATCH_SIZE', 100))
+
+# Доставка уведомлений в фоновом потоке: запрос только ставит задание в
+# ограниченную очередь, поток забирает задания пачками и передаёт каждому
+# наблюдателю все его события одним update_many. Ошибка одного наблюдателя
+# не мешает остальным; при переполнении очереди уведомления отбрасываются.
+class NotificationDispatcher:
+    _STOP = object()
+
+    def __init__(self, max_queue: int = NOTIFICATION_QUEUE_SIZE, batch_size: int = NOTIFICATION_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+
+    def submit(self, observers: List[BookingObserver], events: List[tuple]) -> bool:
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((tuple(observers), list(events)))
+        except queue.Full:
+            self.dropped += len(events)
+            logger.warning(f"Очередь уведомлений переполнена, отброшено событий: {len(events)}")
+            return False
+        return True
+
+    def flush(self, timeout: float = None) -> bool:
+        # Ждёт доставки всех поставленных уведомлений (для тестов и остановки)
+        if self._worker is None or self._pid != os.getpid():
+            return self._queue.unfinished_tasks == 0
+        with self._queue.all_tasks_done:
+            return self._queue.all_tasks_done.wait_for(lambda: self._queue.unfinished_tasks == 0, timeout)
+
+    def close(self, timeout: float = None):
+        if self._worker is None or self._pid != os.getpid():
+            return
+        try:
+            self._queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning("Очередь уведомлений не разобрана к остановке")
+            return
+        self._worker.join(timeout)
+        self._worker = None
+
+    def _ensure_worker(self):
+        # Поток запускается при первом уведомлении в каждом процессе (после fork потоков нет)
+        if self._worker is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid():
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name='booking-notifications', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._deliver([item for item in batch if item is not self._STOP])
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if self._STOP in batch:
+                return
+
+    def _deliver(self, batch):
+        pending: Dict[BookingObserver, List[tuple]] = {}
+        for observers, events in batch:
+            for observer in observers:
+                pending.setdefault(observer, []).extend(events)
+        for observer, events in pending.items():
+            try:
+                observer.update_many(events)
+            except Exception:
+                logger.exception(f"Наблюдатель {type(observer).__name__} не обработал {len(events)} событий")
+
+notification_dispatcher = NotificationDispatcher()
+atexit.register(notification_dispatcher.close, 5)
 
 class BookingSubject:
-    def __init__(self):
+    def __init__(self, dispatcher: NotificationDispatcher = None):
         self._observers: List[BookingObserver] = []
+        self._dispatcher = dispatcher or notification_dispatcher
 
     def attach(self, observer: BookingObserver):
         self._observers.append(observer)
@@ -213,19 +568,36 @@ class BookingSubject:
         for observer in self._observers:
             observer.update(booking_id, status)
 
+    # Уведомления после фиксации транзакции: в запросе только постановка в очередь
+    def notify_async(self, events: List[tuple]) -> bool:
+        return self._dispatcher.submit(self._observers, events)
+
+# Наблюдатели создаются один раз, чтобы фоновый поток объединял их события из разных запросов
+booking_subject = BookingSubject()
+booking_subject.attach(EmailNotifier())
+booking_subject.attach(SMSNotifier())
+
 # Паттерн Strategy: Тарифные планы
 class PricingStrategy(ABC):
+    # Тарифы вида base_price * days * multiplier задают multiplier,
+    # чтобы PricingPipeline мог свернуть их в коэффициент
+    multiplier = None
+
     @abstractmethod
     def calculate_price(self, base_price: float, days: int) -> float:
         pass
 
 class FlexibleTariff(PricingStrategy):
+    multiplier = 1.2  # 20% наценка за гибкость
+
     def calculate_price(self, base_price: float, days: int) -> float:
-        return base_price * days * 1.2  # 20% наценка за гибкость
+        return base_price * days * self.multiplier
 
 class NonRefundableTariff(PricingStrategy):
+    multiplier = 0.9  # 10% скидка за невозвратность
+
     def calculate_price(self, base_price: float, days: int) -> float:
-        return base_price * days * 0.9  # 10% скидка за невозвратность
+        return base_price * days * self.multiplier
 
 # Паттерн Decorator: Дополнительные услуги
 class BookingDecorator(ABC):
@@ -250,14 +622,49 @@ class BookingDecorator(ABC):
         return self._booking.id
 
 class MiniBarDecorator(BookingDecorator):
+    surcharge = 50.0
+
     def __init__(self, booking: BookingPrototype):
         super().__init__(booking)
-        self._booking.price += 50.0
+        self._booking.price += self.surcharge
 
 class LateCheckoutDecorator(BookingDecorator):
+    surcharge = 30.0
+
     def __init__(self, booking: BookingPrototype):
         super().__init__(booking)
-        self._booking.price += 30.0
+        self._booking.price += self.surcharge
+
+# Стратегия и декораторы остаются декларативным описанием цены, а считает её
+# конвейер: тариф и выбранные услуги один раз сворачиваются в коэффициент и
+# надбавку, после чего цена группы считается без обёрток вокруг каждой брони
+class PricingPipeline:
+    __slots__ = ('strategy', 'multiplier', 'surcharge')
+
+    def __init__(self, strategy: PricingStrategy, multiplier, surcharge: float):
+        self.strategy = strategy
+        self.multiplier = multiplier
+        self.surcharge = surcharge
+
+    @staticmethod
+    def compile(strategy: PricingStrategy, decorators=()) -> 'PricingPipeline':
+        multiplier, surcharge = _compile_pricing(type(strategy), tuple(decorators))
+        return PricingPipeline(strategy, multiplier, surcharge)
+
+    def price(self, base_price: float, days: int) -> float:
+        if self.multiplier is None:
+            # Тариф без коэффициента считается своей стратегией
+            return self.strategy.calculate_price(base_price, days) + self.surcharge
+        return base_price * days * self.multiplier + self.surcharge
+
+    def price_group(self, base_price: float, days: int, group_size: int):
+        # Все брони группы стоят одинаково: цена одной брони и сумма за группу за один проход
+        price = self.price(base_price, days)
+        return price, price * group_size
+
+@lru_cache(maxsize=None)
+def _compile_pricing(strategy_class, decorators):
+    return strategy_class.multiplier, sum(decorator.surcharge for decorator in decorators)
         
 # Маршруты Flask
 @app.route('/')
@@ -291,69 +698,75 @@ def book(hotel_type: str, hotel_name: str):
         add_late_checkout = 'late_checkout' in request.form
         add_breakfast = 'breakfast' in request.form
         add_transfer = 'transfer' in request.form
-        group_size = int(request.form.get('group_size', 1))
+        back = redirect(url_for('book', hotel_type=hotel_type, hotel_name=hotel_name, check_in=check_in, check_out=check_out))
+
+        # Все входные данные проверяются до списания номеров: ошибка после
+        # reserve_room оставила бы их занятыми в общей памяти
+        try:
+            group_size = int(request.form.get('group_size', 1))
+            days = (datetime.strptime(check_out, '%Y-%m-%d') - datetime.strptime(check_in, '%Y-%m-%d')).days
+            # Factory Method: Создание номера
+            room = RoomFactory.create_room(room_type)
+            # Abstract Factory: Создание услуг отеля
+            hotel = HotelComplexFactory.create_hotel(hotel_type)
+        except (TypeError, ValueError):
+            flash("Некорректные параметры бронирования!")
+            return back
+        if group_size < 1 or days < 1:
+            flash("Некорректные параметры бронирования!")
+            return back
 
         # Singleton: Проверка доступности
         booking_manager = BookingManager()
         if not booking_manager.reserve_room(room_type, group_size):
             flash("Выбранные номера недоступны!")
-            return redirect(url_for('book', hotel_type=hotel_type, hotel_name=hotel_name, check_in=check_in, check_out=check_out))
-
-        # Factory Method: Создание номера
-        room = RoomFactory.create_room(room_type)
-
-        # Abstract Factory: Создание услуг отеля
-        hotel = HotelComplexFactory.create_hotel(hotel_type)
-
-        # Builder: Сборка пакета бронирования
-        builder = BookingBuilder()
-        builder.set_room(room).set_hotel_services(hotel)
-        if add_breakfast:
-            builder.add_breakfast()
-        if add_transfer:
-            builder.add_transfer()
-        package = builder.build()
-
-        # Strategy: Расчёт стоимости
-        days = (datetime.strptime(check_out, '%Y-%m-%d') - datetime.strptime(check_in, '%Y-%m-%d')).days
-        strategy = FlexibleTariff() if tariff == "Flexible" else NonRefundableTariff()
-        price = strategy.calculate_price(room.get_base_price(), days)
-
-        # Prototype: Создание и клонирование бронирований
-        base_booking = BookingPrototype(package, check_in, check_out, price)
-        bookings = [base_booking.clone() for _ in range(group_size)]
-
-        # Decorator: Добавление дополнительных услуг
-        for i, booking in enumerate(bookings):
+            return back
+
+        # До фиксации в базе любая ошибка возвращает номера в общий остаток
+        try:
+            # Builder: Сборка пакета бронирования
+            builder = BookingBuilder()
+            builder.set_room(room).set_hotel_services(hotel)
+            if add_breakfast:
+                builder.add_breakfast()
+            if add_transfer:
+                builder.add_transfer()
+            package = builder.build()
+
+            # Strategy + Decorator: Тариф и дополнительные услуги компилируются в конвейер цены
+            strategy = FlexibleTariff() if tariff == "Flexible" else NonRefundableTariff()
+            decorators = []
             if add_minibar:
-                booking = MiniBarDecorator(booking)
+                decorators.append(MiniBarDecorator)
             if add_late_checkout:
-                booking = LateCheckoutDecorator(booking)
-            bookings[i] = booking
-
-        # Adapter: Обработка платежа
-        processor = USDProcessor() if currency == "USD" else EURProcessor()
-        payment_adapter = PaymentAdapter(processor)
-        total_price = sum(b.price for b in bookings)
-        if not payment_adapter.process_payment(total_price, currency):
+                decorators.append(LateCheckoutDecorator)
+            pricing = PricingPipeline.compile(strategy, decorators)
+            price, total_price = pricing.price_group(room.get_base_price(), days, group_size)
+
+            # Prototype: Создание и клонирование бронирований
+            base_booking = BookingPrototype(package, check_in, check_out, price)
+            bookings = base_booking.clone_many(group_size)
+
+            # Adapter: Обработка платежа
+            processor = USDProcessor() if currency == "USD" else EURProcessor()
+            payment_adapter = PaymentAdapter(processor)
+            if not payment_adapter.process_payment(total_price, currency):
+                booking_manager.release_room(room_type, group_size)
+                flash("Оплата не прошла!")
+                return back
+
+            # Сохранение бронирований в базу данных одним executemany
+            insert_bookings([(booking.id, hotel_name, room_type, check_in, check_out, str(booking.package), booking.price, "Подтверждено")
+                             for booking in bookings])
+        except Exception:
             booking_manager.release_room(room_type, group_size)
-            flash("Оплата не прошла!")
-            return redirect(url_for('book', hotel_type=hotel_type, hotel_name=hotel_name, check_in=check_in, check_out=check_out))
-
-        # Observer: Уведомление о подтверждении
-        subject = BookingSubject()
-        subject.attach(EmailNotifier())
-        subject.attach(SMSNotifier())
-
-        # Сохранение бронирований в базу данных
-        conn = sqlite3.connect('hotel_bookings.db')
-        c = conn.cursor()
-        for booking in bookings:
-            c.execute("INSERT INTO bookings (id, hotel_name, room_type, check_in, check_out, services, total_price, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                      (booking.id, hotel_name, room_type, check_in, check_out, str(booking.package), booking.price, "Подтверждено"))
-            subject.notify(booking.id, "Подтверждено")
-        conn.commit()
-        conn.close()
+            raise
+
+        # Observer: Уведомления о подтверждении уходят в фоне после фиксации
+        if booking_subject.notify_async([(booking.id, "Подтверждено") for booking in bookings]):
+            flash(f"Бронирований подтверждено: {len(bookings)}. Уведомления по email и SMS отправляются.")
+        else:
+            flash(f"Бронирований подтверждено: {len(bookings)}. Уведомления не отправлены: очередь переполнена.")
 
         return redirect(url_for('confirmation', booking_ids=[b.id for b in bookings]))
 
@@ -362,14 +775,10 @@ def book(hotel_type: str, hotel_name: str):
 @app.route('/confirmation')
 def confirmation():
     booking_ids = request.args.getlist('booking_ids')
-    conn = sqlite3.connect('hotel_bookings.db')
-    c = conn.cursor()
-    bookings = []
-    for bid in booking_ids:
-        c.execute("SELECT * FROM bookings WHERE id = ?", (bid,))
-        bookings.append(c.fetchone())
-    conn.close()
-    return render_template('confirmation.html', bookings=bookings)
+    return render_template('confirmation.html', bookings=fetch_bookings(booking_ids))
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    if '--reset-inventory' in sys.argv:
+        print("Блок остатков удалён" if reset_inventory() else "Блок остатков не найден")
+    else:
+        app.run(debug=True)
\ No newline at end of file
@@ -1,13 +1,24 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
+import asyncio
 import httpx
 import os
 import logging
+import redis.asyncio as aioredis
+from contextlib import asynccontextmanager
 from datetime import datetime
+from availability_feed import AvailabilityFeed, format_sse
 
-app = FastAPI(title="Hotel Booking API Gateway", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await availability_feed.close()
+    await availability_feed.redis.aclose()
+
+app = FastAPI(title="Hotel Booking API Gateway", version="1.0.0", lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -27,11 +38,26 @@ BOOKING_SERVICE = os.getenv('BOOKING_SERVICE', 'http://booking-service:5002')
 ROOM_SERVICE = os.getenv('ROOM_SERVICE', 'http://room-service:5003')
 NOTIFICATION_SERVICE = os.getenv('NOTIFICATION_SERVICE', 'http://notification-service:5004')
 
+# Redis configuration
+REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
+REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+
+# One Redis subscription per process, shared by all availability streams
+availability_feed = AvailabilityFeed(aioredis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True))
+SSE_KEEPALIVE_SECONDS = 15
+
 # Pydantic models
 class HotelSearchRequest(BaseModel):
     city: str
     check_in: str
     check_out: str
+    enrich: bool = False
+    only_available: bool = False
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+    rank: bool = False
+    experiment: Optional[str] = None
+    weights: Optional[Dict[str, float]] = None
 
 class BookingRequest(BaseModel):
     hotel_id: int
@@ -45,6 +71,7 @@ class BookingRequest(BaseModel):
     guest_email: str
     guest_phone: str
     extras: List[str] = []
+    locale: str = "ru"
 
 class PriceCalculationRequest(BaseModel):
     room_type: str
@@ -72,6 +99,33 @@ async def search_hotels(search_request: HotelSearchRequest):
         logger.error(f"Error searching hotels: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Hotel search service error: {str(e)}")
 
+@app.post("/api/search/stream")
+async def search_hotels_stream(search_request: HotelSearchRequest):
+    """Relay NDJSON search results from hotel-search-service as they arrive"""
+    client = httpx.AsyncClient(timeout=10.0)
+    try:
+        upstream_request = client.build_request(
+            "POST",
+            f"{HOTEL_SEARCH_SERVICE}/api/search/stream",
+            json=search_request.dict()
+        )
+        response = await client.send(upstream_request, stream=True)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        await client.aclose()
+        logger.error(f"Error streaming hotels: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Hotel search service error: {str(e)}")
+
+    async def relay():
+        try:
+            async for chunk in response.aiter_bytes():
+                yield chunk
+        finally:
+            await response.aclose()
+            await client.aclose()
+
+    return StreamingResponse(relay(), media_type="application/x-ndjson")
+
 @app.get("/api/hotels/{hotel_id}")
 async def get_hotel(hotel_id: int):
     """Get hotel details by ID"""
@@ -159,6 +213,35 @@ async def get_room_availability():
         logger.error(f"Error getting room availability: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Booking service error: {str(e)}")
 
+@app.get("/api/rooms/availability/stream")
+async def stream_room_availability(room_type: Optional[str] = None):
+    """Push availability changes of the shared room pool as Server-Sent Events"""
+    subscription = availability_feed.subscribe(room_type)
+
+    async def events():
+        try:
+            # Clients load /api/rooms/availability on resync; changes carry
+            # absolute counts, so they converge with that snapshot
+            yield format_sse("resync", {})
+            while True:
+                try:
+                    change = await asyncio.wait_for(subscription.queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if change.get("event") == "resync":
+                    yield format_sse("resync", {})
+                else:
+                    yield format_sse("availability", change)
+        finally:
+            availability_feed.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/bookings")
 async def create_booking(booking_request: BookingRequest):
     """Create a new booking"""
@@ -201,27 +284,14 @@ async def create_booking(booking_request: BookingRequest):
                     "guest_email": booking_request.guest_email,
                     "guest_phone": booking_request.guest_phone,
                     "total_price": total_price,
-                    "extras": booking_request.extras
+                    "extras": booking_request.extras,
+                    "locale": booking_request.locale
                 }
             )
             booking_response.raise_for_status()
             booking_data = booking_response.json()
 
-            # Send notification
-            try:
-                await client.post(
-                    f"{NOTIFICATION_SERVICE}/api/notifications/send",
-                    json={
-                        "booking_id": booking_data['booking_ids'][0] if booking_data.get('booking_ids') else 'N/A',
-                        "recipient_email": booking_request.guest_email,
-                        "recipient_phone": booking_request.guest_phone,
-                        "notification_type": "booking_confirmation",
-                        "message": f"Бронирование подтверждено! Отель: {booking_request.hotel_name}, Номер: {booking_request.room_type}"
-                    }
-                )
-            except Exception as e:
-                logger.warning(f"Failed to send notification: {str(e)}")
-
+            # Guest notifications are sent from booking-service's booking.created event
             return {
                 "success": True,
                 "booking_data": booking_data,
@@ -0,0 +1,105 @@
+"""Fan-out of booking-service availability changes to Server-Sent Events clients"""
+import asyncio
+import json
+import logging
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+AVAILABILITY_CHANNEL = 'availability:changes'
+SUBSCRIBER_QUEUE_SIZE = 100
+RECONNECT_DELAY = 1.0
+
+# Sent when a client may have missed changes and should reload the snapshot
+RESYNC = {'event': 'resync'}
+
+
+def format_sse(event, data):
+    """Encode one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class Subscription:
+    """One SSE client: its room type filter and a bounded queue of pending changes.
+
+    Inventory is a single pool shared by all hotels, so there is no hotel filter.
+    """
+
+    def __init__(self, room_type=None, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.room_type = room_type
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def matches(self, change):
+        return self.room_type is None or change.get('room_type') == self.room_type
+
+    def put(self, item):
+        """Queue an item; a client that falls too far behind is told to resync instead"""
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+class AvailabilityFeed:
+    """Relays the availability channel to every subscriber of this process.
+
+    The process holds a single Redis subscription however many clients are
+    connected; it is opened with the first subscriber and reopened after
+    connection errors, after which every client is told to resync.
+    """
+
+    def __init__(self, redis_client, channel=AVAILABILITY_CHANNEL):
+        self.redis = redis_client
+        self.channel = channel
+        self.subscribers = set()
+        self._task = None
+
+    def subscribe(self, room_type=None):
+        subscription = Subscription(room_type)
+        self.subscribers.add(subscription)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.listen())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+
+    def dispatch(self, change):
+        for subscription in self.subscribers:
+            if subscription.matches(change):
+                subscription.put(change)
+
+    def broadcast(self, item):
+        for subscription in self.subscribers:
+            subscription.put(item)
+
+    async def listen(self):
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                logger.info(f"Subscribed to {self.channel}")
+                async for message in pubsub.listen():
+                    try:
+                        self.dispatch(json.loads(message['data']))
+                    except (ValueError, TypeError) as e:
+                        logger.warning(f"Skipping malformed availability change: {str(e)}")
+            except redis.RedisError as e:
+                logger.error(f"Availability feed error: {str(e)}")
+            finally:
+                await pubsub.aclose()
+            # Changes published while disconnected are lost
+            self.broadcast(RESYNC)
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -1,8 +1,11 @@
 import unittest
 import json
-from unittest.mock import patch, MagicMock
+import httpx
+from unittest.mock import patch, MagicMock, AsyncMock
 from fastapi.testclient import TestClient
+import asyncio
 from app import app
+from availability_feed import AvailabilityFeed, Subscription, format_sse
 
 
 class TestAPIGateway(unittest.TestCase):
@@ -57,6 +60,60 @@ class TestAPIGateway(unittest.TestCase):
         self.assertEqual(response.status_code, 422)  # FastAPI validation error
 
 
+    def test_search_hotels_stream_relay(self):
+        """Test NDJSON search stream is relayed from hotel-search-service"""
+        body = b'{"id": 1}\n{"id": 2}\n'
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, content=body))
+        real_client = httpx.AsyncClient
+
+        with patch('httpx.AsyncClient', lambda **kwargs: real_client(transport=transport, **kwargs)):
+            response = self.client.post('/api/search/stream', json={
+                'city': 'Moscow',
+                'check_in': '2025-12-15',
+                'check_out': '2025-12-20'
+            })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['content-type'].startswith('application/x-ndjson'))
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([item['id'] for item in lines], [1, 2])
+
+
+class TestAvailabilityFeed(unittest.TestCase):
+    """Unit tests for the availability change fan-out"""
+
+    def test_dispatch_filters_by_room_type(self):
+        """Test each change reaches only the matching subscribers"""
+        async def scenario():
+            feed = AvailabilityFeed(MagicMock())
+            with patch.object(AvailabilityFeed, 'listen', new=AsyncMock()):
+                everything = feed.subscribe()
+                standard = feed.subscribe(room_type='Standard')
+                suite = feed.subscribe(room_type='Suite')
+            feed.dispatch({'room_type': 'Standard', 'delta': -1, 'available': 9})
+            feed.dispatch({'room_type': 'Suite', 'delta': -2, 'available': 3})
+            feed.unsubscribe(standard)
+            feed.dispatch({'room_type': 'Standard', 'delta': -1, 'available': 8})
+            await feed.close()
+            return everything.queue.qsize(), standard.queue.qsize(), suite.queue.qsize()
+
+        self.assertEqual(asyncio.run(scenario()), (3, 1, 1))
+
+    def test_slow_subscriber_is_told_to_resync(self):
+        """Test a full queue is replaced by a single resync marker"""
+        async def scenario():
+            subscription = Subscription(queue_size=2)
+            for available in (3, 2, 1):
+                subscription.put({'room_type': 'Standard', 'available': available})
+            return [subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+
+        self.assertEqual(asyncio.run(scenario()), [{'event': 'resync'}])
+
+    def test_format_sse(self):
+        """Test Server-Sent Events encoding"""
+        self.assertEqual(format_sse('availability', {'available': 2}), 'event: availability\ndata: {"available": 2}\n\n')
+
+
 if __name__ == '__main__':
     unittest.main()
 
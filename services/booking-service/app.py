@@ -1,7 +1,7 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 import os
 import logging
 import uuid
@@ -30,9 +30,40 @@ REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
 
 redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
 
+# Bumped on every reservation so cached enriched searches are invalidated
+AVAILABILITY_VERSION_KEY = 'availability:version'
+# Pub/sub channel feeding the gateway's availability stream
+AVAILABILITY_CHANNEL = 'availability:changes'
+
+def publish_availability_change(room_type, delta, available):
+    """Bump the availability version and publish the change in one round trip.
+
+    Room inventory is one pool shared by all hotels, so changes are not
+    tagged with the hotel that was booked.
+    """
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.incr(AVAILABILITY_VERSION_KEY)
+        pipe.publish(AVAILABILITY_CHANNEL, json.dumps({
+            'room_type': room_type,
+            'delta': delta,
+            'available': available
+        }))
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to publish availability change: {str(e)}")
+
 def get_db_connection():
     return psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor)
 
+def add_outbox_events(cur, event_type, bookings):
+    """Write one event per booking to the outbox, in the caller's transaction"""
+    execute_values(
+        cur,
+        'INSERT INTO booking_outbox (aggregate_id, event_type, payload) VALUES %s',
+        [(booking['booking_id'], event_type, json.dumps(booking, default=str)) for booking in bookings]
+    )
+
 def create_database_if_not_exists():
     """Create database if it doesn't exist"""
     try:
@@ -81,6 +112,36 @@ def init_db():
         )
     ''')
     
+    # Guest contacts, used for notifications about a hotel stay
+    cur.execute('''
+        ALTER TABLE bookings
+        ADD COLUMN IF NOT EXISTS guest_name VARCHAR(255),
+        ADD COLUMN IF NOT EXISTS guest_email VARCHAR(255),
+        ADD COLUMN IF NOT EXISTS guest_phone VARCHAR(50),
+        ADD COLUMN IF NOT EXISTS locale VARCHAR(10) NOT NULL DEFAULT 'ru'
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_hotel_stay
+        ON bookings (hotel_id, status, check_in, check_out)
+    ''')
+    
+    # Transactional outbox: events are written with the booking change and
+    # published to Redis by outbox_relay.py
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS booking_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            aggregate_id VARCHAR(36) NOT NULL,
+            event_type VARCHAR(50) NOT NULL,
+            payload TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            published_at TIMESTAMP
+        )
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_booking_outbox_unpublished
+        ON booking_outbox (id) WHERE published_at IS NULL
+    ''')
+    
     cur.execute('''
         CREATE TABLE IF NOT EXISTS room_availability (
             id SERIAL PRIMARY KEY,
@@ -142,6 +203,41 @@ def get_room_availability():
         logger.error(f"Error getting room availability: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/rooms/availability/batch', methods=['POST'])
+def get_room_availability_batch():
+    """Get free room counts for many hotels with a single query"""
+    try:
+        data = request.get_json()
+        hotel_ids = data.get('hotel_ids', [])
+        check_in = data.get('check_in')
+        check_out = data.get('check_out')
+
+        if not isinstance(hotel_ids, list):
+            return jsonify({'error': 'hotel_ids must be a list'}), 400
+
+        conn = get_db_connection()
+        cur = conn.cursor()
+
+        # Inventory is a single pool shared by all hotels, so one read
+        # answers the whole batch
+        cur.execute('SELECT room_type, available_count FROM room_availability')
+        rooms = cur.fetchall()
+
+        cur.close()
+        conn.close()
+
+        pool = {room['room_type']: room['available_count'] for room in rooms}
+
+        return jsonify({
+            'availability': {str(hotel_id): pool for hotel_id in hotel_ids},
+            'check_in': check_in,
+            'check_out': check_out
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Error getting batch availability: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/rooms/check', methods=['POST'])
 def check_availability():
     """Check if specific room type is available"""
@@ -192,6 +288,10 @@ def create_booking():
         services = data.get('services', [])
         total_price = data.get('total_price')
         quantity = data.get('quantity', 1)
+        guest_name = data.get('guest_name')
+        guest_email = data.get('guest_email')
+        guest_phone = data.get('guest_phone')
+        locale = data.get('locale', 'ru')
 
         # Validate required fields
         if not all([hotel_id, hotel_name, room_type, check_in, check_out, total_price]):
@@ -215,9 +315,11 @@ def create_booking():
 
         # Reserve rooms
         cur.execute(
-            'UPDATE room_availability SET available_count = available_count - %s WHERE room_type = %s',
+            '''UPDATE room_availability SET available_count = available_count - %s
+               WHERE room_type = %s RETURNING available_count''',
             (quantity, room_type)
         )
+        available = cur.fetchone()['available_count']
 
         # Create bookings
         booking_ids = []
@@ -227,16 +329,35 @@ def create_booking():
 
             cur.execute(
                 '''INSERT INTO bookings
-                   (id, hotel_id, hotel_name, room_type, check_in, check_out, services, total_price, status)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)''',
+                   (id, hotel_id, hotel_name, room_type, check_in, check_out, services, total_price, status,
+                    guest_name, guest_email, guest_phone, locale)
+                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
                 (booking_id, hotel_id, hotel_name, room_type, check_in, check_out,
-                 json.dumps(services), total_price, 'pending')
+                 json.dumps(services), total_price, 'pending', guest_name, guest_email, guest_phone, locale)
             )
 
+        add_outbox_events(cur, 'booking.created', [{
+            'booking_id': booking_id,
+            'group_booking_ids': booking_ids,
+            'hotel_id': hotel_id,
+            'hotel_name': hotel_name,
+            'room_type': room_type,
+            'check_in': check_in,
+            'check_out': check_out,
+            'total_price': total_price,
+            'status': 'pending',
+            'guest_name': guest_name,
+            'guest_email': guest_email,
+            'guest_phone': guest_phone,
+            'locale': locale
+        } for booking_id in booking_ids])
+
         conn.commit()
         cur.close()
         conn.close()
 
+        publish_availability_change(room_type, -quantity, available)
+
         logger.info(f"Created {len(booking_ids)} bookings")
 
         return jsonify({
@@ -249,6 +370,49 @@ def create_booking():
         logger.error(f"Error creating booking: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/bookings/guests', methods=['GET'])
+def get_hotel_guests():
+    """Get contacts of guests staying at a hotel on a date"""
+    try:
+        hotel_id = request.args.get('hotel_id', type=int)
+        date = request.args.get('date')
+        status = request.args.get('status', 'confirmed')
+
+        if not hotel_id or not date:
+            return jsonify({'error': 'hotel_id and date are required'}), 400
+
+        conn = get_db_connection()
+        cur = conn.cursor()
+
+        cur.execute(
+            '''SELECT id, hotel_name, check_in, check_out, guest_name, guest_email, guest_phone
+               FROM bookings
+               WHERE hotel_id = %s AND status = %s AND check_in <= %s AND check_out > %s
+                 AND (guest_email IS NOT NULL OR guest_phone IS NOT NULL)
+               ORDER BY id''',
+            (hotel_id, status, date, date)
+        )
+        bookings = cur.fetchall()
+
+        cur.close()
+        conn.close()
+
+        guests = [{
+            'booking_id': booking['id'],
+            'hotel_name': booking['hotel_name'],
+            'check_in': str(booking['check_in']),
+            'check_out': str(booking['check_out']),
+            'guest_name': booking['guest_name'],
+            'email': booking['guest_email'],
+            'phone': booking['guest_phone']
+        } for booking in bookings]
+
+        return jsonify({'guests': guests, 'count': len(guests)}), 200
+
+    except Exception as e:
+        logger.error(f"Error getting hotel guests: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/bookings/<booking_id>', methods=['GET'])
 def get_booking(booking_id):
     """Get booking details"""
@@ -301,6 +465,21 @@ def confirm_booking(booking_id):
             conn.close()
             return jsonify({'error': 'Booking not found'}), 404
 
+        add_outbox_events(cur, 'booking.confirmed', [{
+            'booking_id': booking_id,
+            'hotel_id': booking['hotel_id'],
+            'hotel_name': booking['hotel_name'],
+            'room_type': booking['room_type'],
+            'check_in': booking['check_in'],
+            'check_out': booking['check_out'],
+            'total_price': booking['total_price'],
+            'status': 'confirmed',
+            'guest_name': booking.get('guest_name'),
+            'guest_email': booking.get('guest_email'),
+            'guest_phone': booking.get('guest_phone'),
+            'locale': booking.get('locale') or 'ru'
+        }])
+
         conn.commit()
         cur.close()
         conn.close()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Outbox relay: publishes booking events from the outbox table to a Redis stream in batches"""
+import logging
+import os
+import time
+
+import psycopg2
+import redis
+
+from app import REDIS_HOST, REDIS_PORT, get_db_connection
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EVENTS_STREAM = 'booking:events'
+EVENTS_STREAM_MAXLEN = 1000000
+RELAY_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 500))
+RELAY_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 0.5))
+# Published events are kept this long for inspection, then deleted
+OUTBOX_RETENTION_DAYS = int(os.getenv('OUTBOX_RETENTION_DAYS', 7))
+CLEANUP_INTERVAL = 3600
+# Marker keys that make a re-publish after a crash a no-op
+PUBLISHED_KEY_PREFIX = 'booking:events:published:'
+PUBLISHED_KEY_TTL = 7 * 24 * 3600
+
+# Appends an event unless this outbox id was already published
+PUBLISH_SCRIPT = """
+if redis.call('SET', KEYS[1], '1', 'NX', 'EX', ARGV[1]) then
+    return redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*',
+                      'event_id', ARGV[3], 'type', ARGV[4], 'aggregate_id', ARGV[5], 'payload', ARGV[6])
+end
+return false
+"""
+
+
+class OutboxRelay:
+    """Moves outbox rows to the events stream.
+
+    Rows are locked, published and marked in one database transaction. If
+    the process dies after publishing but before the commit, the rows are
+    published again, and the marker keys turn that into a no-op, so each
+    event reaches the stream exactly once.
+    """
+
+    def __init__(self, redis_client, connection_factory=get_db_connection, batch_size=RELAY_BATCH_SIZE):
+        self.redis = redis_client
+        self.connection_factory = connection_factory
+        self.batch_size = batch_size
+        self._conn = None
+        self._cleaned_at = 0
+
+    def connection(self):
+        """Long-lived database connection, reopened after failures"""
+        if self._conn is None or self._conn.closed:
+            self._conn = self.connection_factory()
+        return self._conn
+
+    def run(self):
+        logger.info("Outbox relay started")
+        while True:
+            try:
+                if self.publish_once() < self.batch_size:
+                    time.sleep(RELAY_POLL_INTERVAL)
+                self.cleanup()
+            except (redis.RedisError, psycopg2.Error) as e:
+                logger.error(f"Outbox relay error: {str(e)}")
+                if self._conn is not None:
+                    self._conn.close()
+                time.sleep(1)
+
+    def publish_once(self):
+        """Publish one batch of unpublished events in id order"""
+        conn = self.connection()
+        cur = conn.cursor()
+        try:
+            cur.execute('''
+                SELECT id, aggregate_id, event_type, payload
+                FROM booking_outbox
+                WHERE published_at IS NULL
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ''', (self.batch_size,))
+            events = cur.fetchall()
+            if not events:
+                conn.rollback()
+                return 0
+
+            pipe = self.redis.pipeline(transaction=False)
+            for event in events:
+                pipe.eval(PUBLISH_SCRIPT, 2, f"{PUBLISHED_KEY_PREFIX}{event['id']}", EVENTS_STREAM,
+                          PUBLISHED_KEY_TTL, EVENTS_STREAM_MAXLEN, event['id'], event['event_type'],
+                          event['aggregate_id'], event['payload'])
+            pipe.execute()
+
+            cur.execute('UPDATE booking_outbox SET published_at = CURRENT_TIMESTAMP WHERE id = ANY(%s)',
+                        ([event['id'] for event in events],))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+        logger.info(f"Published {len(events)} booking events")
+        return len(events)
+
+    def cleanup(self):
+        """Delete old published events, at most once per interval"""
+        now = time.monotonic()
+        if now - self._cleaned_at < CLEANUP_INTERVAL:
+            return
+        self._cleaned_at = now
+        conn = self.connection()
+        cur = conn.cursor()
+        cur.execute(
+            "DELETE FROM booking_outbox WHERE published_at < CURRENT_TIMESTAMP - make_interval(days => %s)",
+            (OUTBOX_RETENTION_DAYS,)
+        )
+        conn.commit()
+        cur.close()
+
+
+if __name__ == '__main__':
+    OutboxRelay(redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)).run()
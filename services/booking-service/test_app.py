@@ -1,7 +1,9 @@
 import unittest
 import json
 from unittest.mock import patch, MagicMock
+import redis
 from app import app
+from outbox_relay import OutboxRelay
 
 
 class TestBookingService(unittest.TestCase):
@@ -20,8 +22,10 @@ class TestBookingService(unittest.TestCase):
         self.assertEqual(data['status'], 'healthy')
         self.assertEqual(data['service'], 'booking-service')
 
+    @patch('app.redis_client')
+    @patch('app.execute_values')
     @patch('app.get_db_connection')
-    def test_create_booking_success(self, mock_db):
+    def test_create_booking_success(self, mock_db, mock_execute_values, mock_redis):
         """Test successful booking creation"""
         # Mock database connection
         mock_conn = MagicMock()
@@ -51,6 +55,14 @@ class TestBookingService(unittest.TestCase):
         data = json.loads(response.data)
         self.assertIn('booking_ids', data)
         self.assertIn('message', data)
+        # The event is written in the booking transaction, before the commit
+        events = mock_execute_values.call_args[0][2]
+        self.assertEqual([(event[0], event[1]) for event in events], [(data['booking_ids'][0], 'booking.created')])
+        mock_conn.commit.assert_called_once()
+        # The availability change is published after the commit
+        channel, change = mock_redis.pipeline.return_value.publish.call_args[0]
+        self.assertEqual(channel, 'availability:changes')
+        self.assertEqual(json.loads(change), {'room_type': 'Standard', 'delta': -1, 'available': 10})
 
     @patch('app.get_db_connection')
     def test_get_booking_success(self, mock_db):
@@ -94,6 +106,101 @@ class TestBookingService(unittest.TestCase):
         self.assertIn('error', data)
 
 
+    @patch('app.get_db_connection')
+    def test_batch_availability(self, mock_db):
+        """Test availability for many hotels is read with one query"""
+        mock_conn = MagicMock()
+        mock_cur = MagicMock()
+        mock_cur.fetchall.return_value = [
+            {'room_type': 'Standard', 'available_count': 10},
+            {'room_type': 'Luxury', 'available_count': 0}
+        ]
+        mock_conn.cursor.return_value = mock_cur
+        mock_db.return_value = mock_conn
+
+        payload = {
+            'hotel_ids': [1, 2],
+            'check_in': '2025-12-15',
+            'check_out': '2025-12-20'
+        }
+        response = self.app.post(
+            '/api/rooms/availability/batch',
+            data=json.dumps(payload),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['availability']['1'], {'Standard': 10, 'Luxury': 0})
+        self.assertEqual(data['availability']['2'], {'Standard': 10, 'Luxury': 0})
+        self.assertEqual(mock_cur.execute.call_count, 1)
+
+    @patch('app.get_db_connection')
+    def test_get_hotel_guests(self, mock_db):
+        """Test guests staying at a hotel on a date are listed with their contacts"""
+        mock_conn = MagicMock()
+        mock_cur = MagicMock()
+        mock_cur.fetchall.return_value = [{
+            'id': 'b1', 'hotel_name': 'Test Hotel', 'check_in': '2025-12-15', 'check_out': '2025-12-20',
+            'guest_name': 'John', 'guest_email': 'john@example.com', 'guest_phone': None
+        }]
+        mock_conn.cursor.return_value = mock_cur
+        mock_db.return_value = mock_conn
+
+        response = self.app.get('/api/bookings/guests?hotel_id=1&date=2025-12-16')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['guests'][0]['email'], 'john@example.com')
+        self.assertEqual(mock_cur.execute.call_args[0][1], (1, 'confirmed', '2025-12-16', '2025-12-16'))
+
+        response = self.app.get('/api/bookings/guests?hotel_id=1')
+        self.assertEqual(response.status_code, 400)
+
+
+class TestOutboxRelay(unittest.TestCase):
+    """Unit tests for the outbox relay"""
+
+    def test_publish_batch(self):
+        """Test a batch is published in one round trip and marked in the same transaction"""
+        mock_conn = MagicMock()
+        mock_cur = MagicMock()
+        mock_cur.fetchall.return_value = [
+            {'id': 7, 'aggregate_id': 'b1', 'event_type': 'booking.created', 'payload': '{}'},
+            {'id': 8, 'aggregate_id': 'b1', 'event_type': 'booking.confirmed', 'payload': '{}'}
+        ]
+        mock_conn.cursor.return_value = mock_cur
+        mock_redis = MagicMock()
+        mock_pipe = mock_redis.pipeline.return_value
+
+        relay = OutboxRelay(mock_redis, connection_factory=lambda: mock_conn)
+        published = relay.publish_once()
+
+        self.assertEqual(published, 2)
+        self.assertEqual(mock_pipe.eval.call_count, 2)
+        self.assertEqual(mock_pipe.eval.call_args_list[0][0][2], 'booking:events:published:7')
+        mock_pipe.execute.assert_called_once()
+        self.assertEqual(mock_cur.execute.call_args[0][1], ([7, 8],))
+        mock_conn.commit.assert_called_once()
+
+    def test_publish_failure_rolls_back(self):
+        """Test events stay unpublished when Redis fails"""
+        mock_conn = MagicMock()
+        mock_cur = MagicMock()
+        mock_cur.fetchall.return_value = [
+            {'id': 7, 'aggregate_id': 'b1', 'event_type': 'booking.created', 'payload': '{}'}
+        ]
+        mock_conn.cursor.return_value = mock_cur
+        mock_redis = MagicMock()
+        mock_redis.pipeline.return_value.execute.side_effect = redis.ConnectionError('down')
+
+        relay = OutboxRelay(mock_redis, connection_factory=lambda: mock_conn)
+        with self.assertRaises(redis.ConnectionError):
+            relay.publish_once()
+
+        mock_conn.rollback.assert_called_once()
+        mock_conn.commit.assert_not_called()
+
+
 if __name__ == '__main__':
     unittest.main()
 
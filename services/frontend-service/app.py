@@ -1,22 +1,132 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import (Flask, render_template, stream_template, request, redirect, url_for, flash, session,
+                   make_response, jsonify)
+from jinja2 import FileSystemBytecodeCache
+import redis
 import requests
+from requests.adapters import HTTPAdapter
 import os
+import json
 import logging
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from page_cache import CatalogCache, FragmentCache, TTLCache, digest, templates_digest
+from redis_session import RedisSessionInterface
 
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'supersecretkey')
 
+# Compiled templates are reused across workers and restarts
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(os.getenv('JINJA_CACHE_DIR'))
+
+# Sessions live in Redis when REDIS_HOST is set, otherwise in the signed cookie
+REDIS_HOST = os.getenv('REDIS_HOST')
+REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+SESSION_TTL = int(os.getenv('SESSION_TTL', 86400))
+
+if REDIS_HOST:
+    app.session_interface = RedisSessionInterface(
+        redis.Redis(host=REDIS_HOST, port=REDIS_PORT, socket_timeout=0.5, socket_connect_timeout=0.5),
+        SESSION_TTL
+    )
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # API Gateway URL
 API_GATEWAY = os.getenv('API_GATEWAY', 'http://api-gateway:8000')
 
+# Independent gateway calls of one page run concurrently on this pool
+UPSTREAM_CONCURRENCY = int(os.getenv('UPSTREAM_CONCURRENCY', 8))
+executor = ThreadPoolExecutor(max_workers=UPSTREAM_CONCURRENCY)
+
+# Shared HTTP session so gateway calls reuse keep-alive connections;
+# the pool fits every executor thread plus the request thread
+http = requests.Session()
+http.mount('http://', HTTPAdapter(pool_maxsize=UPSTREAM_CONCURRENCY + 1))
+http.mount('https://', HTTPAdapter(pool_maxsize=UPSTREAM_CONCURRENCY + 1))
+
+def gateway_get(path):
+    """GET a gateway endpoint and decode the JSON body"""
+    response = http.get(f'{API_GATEWAY}{path}', timeout=10)
+    return response.json()
+
+def load_catalog():
+    """Fetch room types, tariffs and extra services concurrently"""
+    rooms_future = executor.submit(gateway_get, '/api/rooms/types')
+    tariffs_future = executor.submit(gateway_get, '/api/pricing/tariffs')
+    extras_future = executor.submit(gateway_get, '/api/services/extra')
+    return (rooms_future.result().get('room_types', []),
+            tariffs_future.result().get('tariffs', []),
+            extras_future.result().get('extra_services', []))
+
+# Rendered fragments are keyed by catalog version and locale
+CATALOG_TTL = int(os.getenv('CATALOG_TTL', 60))
+catalog_cache = CatalogCache(load_catalog, CATALOG_TTL)
+fragments = FragmentCache(int(os.getenv('FRAGMENT_CACHE_ENTRIES', 512)))
+# Price quotes for the booking form, per catalog version and options
+PRICE_PREVIEW_TTL = int(os.getenv('PRICE_PREVIEW_TTL', 60))
+price_quotes = TTLCache(int(os.getenv('PRICE_PREVIEW_ENTRIES', 4096)), PRICE_PREVIEW_TTL)
+MAX_PREVIEW_DAYS = 365
+
+TEMPLATES_DIGEST = templates_digest(os.path.join(app.root_path, app.template_folder))
+
+SUPPORTED_LOCALES = ['ru']
+
+def get_locale():
+    return request.accept_languages.best_match(SUPPORTED_LOCALES, default=SUPPORTED_LOCALES[0])
+
+def cacheable_page(template_name, key, **context):
+    """Render a page that depends only on key, answering revalidations with 304.
+
+    Pages with pending flash messages are per-user and are never cached.
+    """
+    if session.get('_flashes'):
+        response = make_response(render_template(template_name, **context))
+        response.cache_control.no_store = True
+        return response
+
+    etag = digest(TEMPLATES_DIGEST, get_locale(), *key)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = make_response(render_template(template_name, **context))
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    response.vary.add('Accept-Language')
+    return response
+
+def read_ndjson(response):
+    """Yield objects from an NDJSON response; a malformed line is reported as an error item"""
+    for line in response.iter_lines():
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield {'error': 'Malformed search result'}
+            return
+
+def render_hotel_cards(hotels, check_in, check_out, locale):
+    """Render hotel cards as results arrive; identical cards come from the fragment cache"""
+    try:
+        for hotel in hotels:
+            if 'error' in hotel:
+                logger.error(f"Error streaming hotels: {hotel['error']}")
+                return
+            yield fragments.render('fragments/hotel_card.html',
+                                   (digest(hotel), check_in, check_out, locale),
+                                   hotel=hotel,
+                                   check_in=check_in,
+                                   check_out=check_out)
+    except requests.RequestException as e:
+        # Headers are already sent, so the page just ends with the cards so far
+        logger.error(f"Error streaming hotels: {str(e)}")
+
 @app.route('/')
 def index():
     """Main page with search form"""
-    return render_template('index.html')
+    return cacheable_page('index.html', ('index',))
 
 @app.route('/search', methods=['POST'])
 def search():
@@ -38,33 +148,47 @@ def search():
             flash('Дата выезда должна быть позже даты заезда!')
             return redirect(url_for('index'))
         
-        # Search hotels via API Gateway
-        response = requests.post(
-            f'{API_GATEWAY}/api/search',
+        # Stream search results via API Gateway
+        upstream = http.post(
+            f'{API_GATEWAY}/api/search/stream',
             json={
                 'city': city,
                 'check_in': check_in,
-                'check_out': check_out
+                'check_out': check_out,
+                'enrich': True
             },
-            timeout=10
+            timeout=10,
+            stream=True
         )
         
-        if response.status_code == 200:
-            data = response.json()
-            hotels = data.get('hotels', [])
-            
-            if not hotels:
-                flash(f'Отели в городе {city} не найдены!')
-                return redirect(url_for('index'))
-            
-            return render_template('hotels.html', 
-                                 hotels=hotels, 
-                                 city=city,
-                                 check_in=check_in,
-                                 check_out=check_out)
-        else:
+        if upstream.status_code != 200:
+            upstream.close()
             flash('Ошибка при поиске отелей!')
             return redirect(url_for('index'))
+
+        # The first result decides between a redirect and the streamed page
+        hotels = read_ndjson(upstream)
+        first = next(hotels, None)
+        if first is None or 'error' in first:
+            upstream.close()
+            if first is None:
+                flash(f'Отели в городе {city} не найдены!')
+            else:
+                logger.error(f"Error searching hotels: {first['error']}")
+                flash('Ошибка при поиске отелей!')
+            return redirect(url_for('index'))
+
+        # The header is sent at once and each card as its hotel arrives, so
+        # time to first byte does not grow with the number of results
+        response = app.response_class(stream_template(
+            'hotels.html',
+            hotel_cards=render_hotel_cards(chain([first], hotels), check_in, check_out, get_locale()),
+            city=city,
+            check_in=check_in,
+            check_out=check_out
+        ))
+        response.call_on_close(upstream.close)
+        return response
             
     except ValueError:
         flash('Неверный формат даты!')
@@ -86,42 +210,82 @@ def book(hotel_id, hotel_name):
         return redirect(url_for('index'))
     
     try:
-        # Get room types
-        rooms_response = requests.get(f'{API_GATEWAY}/api/rooms/types', timeout=10)
-        rooms_data = rooms_response.json()
-        room_types = rooms_data.get('room_types', [])
-        
-        # Get tariffs
-        tariffs_response = requests.get(f'{API_GATEWAY}/api/pricing/tariffs', timeout=10)
-        tariffs_data = tariffs_response.json()
-        tariffs = tariffs_data.get('tariffs', [])
-        
-        # Get extra services
-        extras_response = requests.get(f'{API_GATEWAY}/api/services/extra', timeout=10)
-        extras_data = extras_response.json()
-        extra_services = extras_data.get('extra_services', [])
+        catalog = catalog_cache.get()
         
         # Calculate days
         check_in_date = datetime.strptime(check_in, '%Y-%m-%d')
         check_out_date = datetime.strptime(check_out, '%Y-%m-%d')
         days = (check_out_date - check_in_date).days
         
-        return render_template('book.html',
-                             hotel_id=hotel_id,
-                             hotel_name=hotel_name,
-                             hotel_type=hotel_type,
-                             check_in=check_in,
-                             check_out=check_out,
-                             days=days,
-                             room_types=room_types,
-                             tariffs=tariffs,
-                             extra_services=extra_services)
+        catalog_fields = fragments.render('fragments/catalog_fields.html',
+                                          (catalog.version, get_locale()),
+                                          room_types=catalog.room_types,
+                                          tariffs=catalog.tariffs,
+                                          extra_services=catalog.extra_services)
+
+        return cacheable_page('book.html',
+                              ('book', catalog.version, hotel_id, hotel_name, hotel_type, check_in, check_out),
+                              hotel_id=hotel_id,
+                              hotel_name=hotel_name,
+                              hotel_type=hotel_type,
+                              check_in=check_in,
+                              check_out=check_out,
+                              days=days,
+                              catalog_fields=catalog_fields)
         
     except requests.RequestException as e:
         logger.error(f"Error loading booking form: {str(e)}")
         flash('Ошибка загрузки формы бронирования!')
         return redirect(url_for('index'))
 
+@app.route('/api/price-preview', methods=['GET'])
+def price_preview():
+    """Price of the options chosen in the booking form"""
+    room_type = request.args.get('room_type')
+    tariff = request.args.get('tariff')
+    days = request.args.get('days', type=int)
+    extras = tuple(sorted(set(filter(None, request.args.get('extras', '').split(',')))))
+
+    try:
+        catalog = catalog_cache.get()
+    except requests.RequestException as e:
+        logger.error(f"Error loading catalog for price preview: {str(e)}")
+        return jsonify({'error': 'Ошибка соединения с сервером!'}), 502
+
+    # Only options offered by the catalog are priced, so the memo cannot be
+    # flooded with made-up combinations
+    if (not days or not 1 <= days <= MAX_PREVIEW_DAYS
+            or room_type not in {room['room_type'] for room in catalog.room_types}
+            or tariff not in {item['tariff_type'] for item in catalog.tariffs}
+            or not set(extras) <= {service['service_code'] for service in catalog.extra_services}):
+        return jsonify({'error': 'Неверные параметры'}), 400
+
+    key = (catalog.version, room_type, tariff, days, extras)
+    quote = price_quotes.get(key)
+    if quote is None:
+        try:
+            response = http.post(
+                f'{API_GATEWAY}/api/pricing/calculate',
+                json={'room_type': room_type, 'days': days, 'tariff': tariff, 'extras': list(extras)},
+                timeout=10
+            )
+            response.raise_for_status()
+            data = response.json()
+        except requests.RequestException as e:
+            logger.error(f"Error previewing price: {str(e)}")
+            return jsonify({'error': 'Ошибка расчета стоимости!'}), 502
+        quote = {
+            'room_total': data.get('room_total'),
+            'extras_total': data.get('extras_total'),
+            'total_price': data['total_price']
+        }
+        price_quotes.set(key, quote)
+
+    response = jsonify(quote)
+    response.cache_control.private = True
+    response.cache_control.max_age = PRICE_PREVIEW_TTL
+    return response
+
 @app.route('/confirmation', methods=['POST'])
 def confirmation():
     """Process booking and show confirmation"""
@@ -156,7 +320,7 @@ def confirmation():
                                   check_in=check_in, check_out=check_out))
 
         # Create booking via API Gateway
-        response = requests.post(
+        response = http.post(
             f'{API_GATEWAY}/api/bookings',
             json={
                 'hotel_id': hotel_id,
@@ -0,0 +1,147 @@
+"""In-process caches for rendered page fragments, the catalog they are built from and price quotes"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import render_template
+from markupsafe import Markup
+
+logger = logging.getLogger(__name__)
+
+Catalog = namedtuple('Catalog', 'version room_types tariffs extra_services')
+
+
+def digest(*parts):
+    """Short stable hash of JSON-serializable parts"""
+    encoded = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()[:20]
+
+
+def templates_digest(folder):
+    """Hash of every template file, so cache keys change when templates are deployed"""
+    sha = hashlib.sha1()
+    for root, dirs, files in sorted(os.walk(folder)):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            sha.update(os.path.relpath(path, folder).encode())
+            with open(path, 'rb') as f:
+                sha.update(f.read())
+    return sha.hexdigest()[:12]
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered template fragments.
+
+    Keys must identify everything a fragment depends on (data version,
+    locale, ...), so entries never need to be invalidated, only evicted.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def render(self, template_name, key, **context):
+        """Return the cached fragment for key, rendering template_name on a miss"""
+        key = (template_name,) + tuple(key)
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is not None:
+                self._entries.move_to_end(key)
+                return fragment
+
+        fragment = Markup(render_template(template_name, **context))
+        with self._lock:
+            self._entries[key] = fragment
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return fragment
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CatalogCache:
+    """Room types, tariffs and extra services, refreshed at most once per ttl seconds.
+
+    The catalog version is a hash of its contents, so it changes exactly
+    when the data does. If a refresh fails the previous catalog is kept.
+    """
+
+    def __init__(self, loader, ttl=60):
+        self.loader = loader
+        self.ttl = ttl
+        self._catalog = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        catalog = self._catalog
+        if catalog is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return catalog
+        with self._lock:
+            # Another thread may have refreshed while we waited
+            if self._catalog is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._catalog
+            try:
+                room_types, tariffs, extra_services = self.loader()
+            except Exception as e:
+                if self._catalog is None:
+                    raise
+                logger.warning(f"Catalog refresh failed, serving previous version: {str(e)}")
+                self._loaded_at = time.monotonic()
+                return self._catalog
+            self._catalog = Catalog(digest(room_types, tariffs, extra_services),
+                                    room_types, tariffs, extra_services)
+            self._loaded_at = time.monotonic()
+            return self._catalog
+
+    def clear(self):
+        with self._lock:
+            self._catalog = None
+            self._loaded_at = None
+
+
+class TTLCache:
+    """Thread-safe LRU of values that expire ttl seconds after being stored"""
+
+    def __init__(self, max_entries=4096, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
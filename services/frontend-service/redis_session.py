@@ -0,0 +1,140 @@
+"""Server-side Flask sessions stored in Redis; the cookie only carries the session id"""
+import logging
+import secrets
+
+import redis
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY_PREFIX = 'session:'
+SESSION_ID_BYTES = 24
+
+
+def new_session_id():
+    return secrets.token_urlsafe(SESSION_ID_BYTES)
+
+
+def valid_session_id(sid):
+    return 0 < len(sid) <= 64 and sid.replace('-', '').replace('_', '').isalnum()
+
+
+class RedisSession(SessionMixin):
+    """Session whose data is fetched from Redis on first access.
+
+    A session id that is not found in Redis (expired, or made up by the
+    client) is replaced by a fresh one, so a client cannot choose the id
+    its session is stored under. If Redis cannot be read, the session is
+    empty for this request and is never saved, so the partial data cannot
+    overwrite the stored session.
+    """
+
+    def __init__(self, sid, loader=None):
+        self.sid = sid
+        self.new = loader is None
+        self.modified = False
+        self.accessed = False
+        self.unavailable = False
+        self._loader = loader
+        self._data = {} if loader is None else None
+
+    @property
+    def data(self):
+        self.accessed = True
+        if self._data is None:
+            try:
+                self._data = self._loader(self.sid)
+            except redis.RedisError:
+                self._data = {}
+                self.unavailable = True
+                return self._data
+            if self._data is None:
+                self._data = {}
+                self.sid = new_session_id()
+                self.new = True
+        return self._data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class RedisSessionInterface(SessionInterface):
+    """Keeps session data in Redis under session:<id> with a TTL.
+
+    Reading a session is one GET, issued only when the request touches the
+    session; only modified sessions are written back, with one SET that
+    also renews the TTL.
+    """
+
+    serializer = session_json_serializer
+
+    def __init__(self, redis_client, ttl, prefix=SESSION_KEY_PREFIX):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and valid_session_id(sid):
+            return RedisSession(sid, self.load)
+        return RedisSession(new_session_id())
+
+    def load(self, sid):
+        """Session data for sid, or None if there is no such session; raises RedisError if Redis fails"""
+        try:
+            raw = self.redis.get(self.prefix + sid)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to load session: {str(e)}")
+            raise
+        if raw is None:
+            return None
+        try:
+            return self.serializer.loads(raw)
+        except ValueError:
+            return None
+
+    def save_session(self, app, session, response):
+        if not session.accessed:
+            return
+        response.vary.add('Cookie')
+        if not session.modified or session.unavailable:
+            return
+
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        try:
+            if not session:
+                if not session.new:
+                    self.redis.delete(self.prefix + session.sid)
+                    response.delete_cookie(name, domain=domain, path=path)
+                return
+            self.redis.set(self.prefix + session.sid, self.serializer.dumps(dict(session)), ex=self.ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to save session: {str(e)}")
+            return
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
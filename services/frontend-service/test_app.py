@@ -1,5 +1,9 @@
 import unittest
-from app import app
+import json
+from unittest.mock import patch, MagicMock
+import redis
+from app import app, catalog_cache, fragments, price_quotes
+from redis_session import RedisSessionInterface
 
 
 class TestFrontendService(unittest.TestCase):
@@ -9,6 +13,9 @@ class TestFrontendService(unittest.TestCase):
         """Set up test client"""
         self.app = app.test_client()
         self.app.testing = True
+        catalog_cache.clear()
+        fragments.clear()
+        price_quotes.clear()
 
     def test_health_check(self):
         """Test index page as health check"""
@@ -28,6 +35,195 @@ class TestFrontendService(unittest.TestCase):
         self.assertIn(response.status_code, [200, 302, 405])
 
 
+    def mock_catalog(self, mock_http):
+        """Serve room types, tariffs and extras from the mocked session"""
+        bodies = {
+            '/api/rooms/types': {'room_types': [{'room_type': 'Standard', 'name': 'Стандарт', 'base_price': 100.0}]},
+            '/api/pricing/tariffs': {'tariffs': [{'tariff_type': 'Flexible', 'name': 'Гибкий', 'description': 'Без штрафов'}]},
+            '/api/services/extra': {'extra_services': [{'service_code': 'breakfast', 'name': 'Завтрак', 'price': 15.0, 'per_day': True}]}
+        }
+
+        def get(url, timeout):
+            response = MagicMock()
+            response.json.return_value = bodies[url[url.index('/api/'):]]
+            return response
+
+        mock_http.get.side_effect = get
+
+    @patch('app.http')
+    def test_book_page_fetches_catalog_concurrently(self, mock_http):
+        """Test booking form loads room types, tariffs and extras through the shared session"""
+        self.mock_catalog(mock_http)
+
+        response = self.app.get('/book/1/Test?check_in=2025-12-15&check_out=2025-12-20')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_http.get.call_count, 3)
+        page = response.data.decode()
+        self.assertIn('Стандарт', page)
+        self.assertIn('Гибкий', page)
+        self.assertIn('Завтрак', page)
+
+    @patch('app.http')
+    def test_book_page_is_cached(self, mock_http):
+        """Test the catalog and its fragment are reused and revalidation returns 304"""
+        self.mock_catalog(mock_http)
+        url = '/book/1/Test?check_in=2025-12-15&check_out=2025-12-20'
+
+        first = self.app.get(url)
+        self.assertEqual(first.headers['Cache-Control'], 'no-cache')
+        etag = first.headers['ETag']
+
+        revalidated = self.app.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.data, b'')
+
+        other_dates = self.app.get('/book/1/Test?check_in=2025-12-16&check_out=2025-12-20',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(other_dates.status_code, 200)
+        self.assertNotEqual(other_dates.headers['ETag'], etag)
+        self.assertIn('Стандарт', other_dates.data.decode())
+
+        # One catalog fetch and one fragment for all three requests
+        self.assertEqual(mock_http.get.call_count, 3)
+        self.assertEqual(len(fragments), 1)
+
+    @patch('app.http')
+    def test_price_preview_is_memoized(self, mock_http):
+        """Test identical previews reach the pricing API once, whatever the extras order"""
+        self.mock_catalog(mock_http)
+        quote = MagicMock()
+        quote.json.return_value = {'room_total': 500.0, 'extras_total': 75.0, 'total_price': 575.0}
+        mock_http.post.return_value = quote
+
+        first = self.app.get('/api/price-preview?room_type=Standard&tariff=Flexible&days=5&extras=breakfast')
+        second = self.app.get('/api/price-preview?room_type=Standard&tariff=Flexible&days=5&extras=breakfast,')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(json.loads(first.data)['total_price'], 575.0)
+        self.assertEqual(second.data, first.data)
+        mock_http.post.assert_called_once()
+        self.assertEqual(mock_http.post.call_args[1]['json'],
+                         {'room_type': 'Standard', 'days': 5, 'tariff': 'Flexible', 'extras': ['breakfast']})
+
+    @patch('app.http')
+    def test_price_preview_rejects_unknown_options(self, mock_http):
+        """Test options missing from the catalog are not sent upstream"""
+        self.mock_catalog(mock_http)
+
+        response = self.app.get('/api/price-preview?room_type=Penthouse&tariff=Flexible&days=5')
+
+        self.assertEqual(response.status_code, 400)
+        mock_http.post.assert_not_called()
+
+    @patch('app.http')
+    def test_search_streams_hotel_cards(self, mock_http):
+        """Test the results page is streamed from the gateway NDJSON search"""
+        hotels = [
+            {'id': 1, 'name': 'Отель Москва Городской', 'type': 'City', 'description': 'Центр', 'rating': 4.5,
+             'rooms_available': 3, 'price_from': 80.0},
+            {'id': 2, 'name': 'Отель Москва Курортный', 'type': 'Resort', 'description': 'Парк', 'rating': 4.8,
+             'rooms_available': 0, 'price_from': 120.0}
+        ]
+        upstream = mock_http.post.return_value
+        upstream.status_code = 200
+        upstream.iter_lines.return_value = iter([json.dumps(hotel).encode() for hotel in hotels])
+
+        response = self.app.post('/search', data={'city': 'Москва', 'check_in': '2025-12-15', 'check_out': '2025-12-20'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertTrue(mock_http.post.call_args[0][0].endswith('/api/search/stream'))
+        page = response.get_data(as_text=True)
+        self.assertIn('Отель Москва Городской', page)
+        self.assertIn('Нет свободных номеров на эти даты', page)
+        # The WSGI server closes the response, which closes the upstream stream
+        response.close()
+        upstream.close.assert_called_once()
+
+    @patch('app.http')
+    def test_search_without_results_redirects(self, mock_http):
+        """Test an empty result stream redirects back with a message"""
+        upstream = mock_http.post.return_value
+        upstream.status_code = 200
+        upstream.iter_lines.return_value = iter([])
+
+        response = self.app.post('/search', data={'city': 'Тверь', 'check_in': '2025-12-15', 'check_out': '2025-12-20'})
+
+        self.assertEqual(response.status_code, 302)
+        upstream.close.assert_called_once()
+        self.assertIn('Отели в городе Тверь не найдены!', self.app.get('/').get_data(as_text=True))
+
+    def test_page_with_flash_is_not_cached(self):
+        """Test pages carrying a flash message are neither tagged nor stored"""
+        self.app.post('/search', data={'city': 'Moscow'})
+        response = self.app.get('/')
+        self.assertNotIn('ETag', response.headers)
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+
+        response = self.app.get('/')
+        self.assertIn('ETag', response.headers)
+
+
+class TestRedisSessions(unittest.TestCase):
+    """Unit tests for the server-side session store"""
+
+    def setUp(self):
+        """Install the Redis session interface backed by a dict"""
+        self.store = {}
+        self.redis = MagicMock()
+        self.redis.get.side_effect = self.store.get
+        self.redis.set.side_effect = lambda key, value, ex: self.store.__setitem__(key, value)
+        self.default_interface = app.session_interface
+        app.session_interface = RedisSessionInterface(self.redis, 3600)
+        self.app = app.test_client()
+
+    def tearDown(self):
+        app.session_interface = self.default_interface
+
+    def test_session_data_is_stored_in_redis(self):
+        """Test the cookie carries only the id and the flash is read back with one GET"""
+        response = self.app.post('/search', data={'city': 'Moscow'})
+        self.assertEqual(response.status_code, 302)
+        key, = self.store
+        sid = self.app.get_cookie('session').value
+        self.assertEqual(key, f'session:{sid}')
+        self.assertLess(len(sid), 64)
+        self.assertEqual(self.redis.set.call_args[1], {'ex': 3600})
+
+        self.redis.get.reset_mock()
+        response = self.app.get('/')
+        self.assertIn('Пожалуйста, заполните все поля!', response.data.decode())
+        self.redis.get.assert_called_once_with(key)
+
+    def test_unknown_session_id_is_replaced(self):
+        """Test a session id missing from Redis is not reused for new data"""
+        self.app.set_cookie('session', 'chosen-by-client')
+        self.app.post('/search', data={'city': 'Moscow'})
+        self.assertNotIn('session:chosen-by-client', self.store)
+        self.assertNotEqual(self.app.get_cookie('session').value, 'chosen-by-client')
+
+    def test_untouched_session_costs_nothing(self):
+        """Test requests that never read the session skip Redis entirely"""
+        self.app.set_cookie('session', 'some-session')
+        self.app.get('/search')
+        self.redis.get.assert_not_called()
+        self.redis.set.assert_not_called()
+
+
+    def test_unreadable_session_is_not_overwritten(self):
+        """Test a session that failed to load is not saved over the stored one"""
+        self.store['session:stored-session'] = '{"booking_result": "kept"}'
+        self.app.set_cookie('session', 'stored-session')
+        self.redis.get.side_effect = redis.ConnectionError('down')
+
+        response = self.app.post('/search', data={'city': 'Moscow'})
+
+        self.assertEqual(response.status_code, 302)
+        self.redis.set.assert_not_called()
+        self.assertEqual(self.store, {'session:stored-session': '{"booking_result": "kept"}'})
+        self.assertEqual(self.app.get_cookie('session').value, 'stored-session')
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -1,6 +1,16 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g, stream_with_context
 from flask_cors import CORS
+from itertools import islice
+import requests
+import redis
+import base64
+import io
+import json
+import os
 import logging
+import catalog_snapshot
+import ranking
+from search_cache import LRUCache, SearchCache, normalize_query
 
 app = Flask(__name__)
 CORS(app)
@@ -8,7 +18,201 @@ CORS(app)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# No database needed - hotels are generated dynamically like in monolith
+# No database needed - hotels come from the memory-mapped catalog snapshot
+# when one is built, otherwise they are generated dynamically like in monolith
+CATALOG_SNAPSHOT = os.getenv('CATALOG_SNAPSHOT', 'catalog.snap')
+SNAPSHOT_CHECK_INTERVAL = float(os.getenv('SNAPSHOT_CHECK_INTERVAL', 5))
+
+catalog = catalog_snapshot.SnapshotStore(CATALOG_SNAPSHOT, SNAPSHOT_CHECK_INTERVAL)
+
+# Downstream services used by the enriched search mode
+BOOKING_SERVICE = os.getenv('BOOKING_SERVICE', 'http://booking-service:5002')
+ROOM_SERVICE = os.getenv('ROOM_SERVICE', 'http://room-service:5003')
+
+# Pagination and streaming limits
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 100))
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 50))
+# Larger streams are not buffered for the search cache
+STREAM_CACHE_MAX_BYTES = int(os.getenv('STREAM_CACHE_MAX_BYTES', 256 * 1024))
+
+# Search result cache: per-worker LRU, plus a shared Redis tier when REDIS_HOST is set
+REDIS_HOST = os.getenv('REDIS_HOST')
+REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 300))
+SEARCH_CACHE_ENRICHED_TTL = int(os.getenv('SEARCH_CACHE_ENRICHED_TTL', 30))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', 1000))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv('SEARCH_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+redis_client = None
+if REDIS_HOST:
+    redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT,
+                               socket_timeout=0.1, socket_connect_timeout=0.1)
+
+search_cache = SearchCache(LRUCache(SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_MAX_BYTES), redis_client)
+
+# Shared HTTP session so enrichment calls reuse connections
+http = requests.Session()
+
+def generate_hotels(city):
+    """Yield hotels for a city one at a time, ordered by id"""
+    yield {
+        'id': 1,
+        'name': f"Отель {city} Городской",
+        'city': city,
+        'type': 'City',
+        'description': f"Современный городской отель в центре города {city}",
+        'rating': 4.5
+    }
+    yield {
+        'id': 2,
+        'name': f"Отель {city} Курортный",
+        'city': city,
+        'type': 'Resort',
+        'description': f"Роскошный курортный отель в {city} с видом на парк",
+        'rating': 4.8
+    }
+
+def hotel_sort_key(hotel):
+    """Stable sort key used for cursors"""
+    return [hotel['id']]
+
+def encode_cursor(key):
+    """Encode a sort key as an opaque cursor string"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(key, list):
+        raise ValueError('Invalid cursor')
+    return key
+
+def find_city(city):
+    """Return (snapshot, rows) for a city in the catalog snapshot, or (None, None)"""
+    snapshot = catalog.current()
+    if snapshot is not None:
+        rows = snapshot.city_rows(city)
+        if rows is not None:
+            return snapshot, rows
+    return None, None
+
+def iter_hotels(city, cursor=None):
+    """Yield hotels in sort key order, starting after the cursor"""
+    after = None
+    if cursor is not None:
+        after = decode_cursor(cursor)
+        if len(after) != 1:
+            raise ValueError('Invalid cursor')
+
+    snapshot, rows = find_city(city)
+    if snapshot is not None:
+        return snapshot.iter_hotels(rows, after[0] if after else None)
+
+    hotels = generate_hotels(city)
+    if after is None:
+        return hotels
+    return (hotel for hotel in hotels if hotel_sort_key(hotel) > after)
+
+def ranking_candidates(data):
+    """Return (candidates, hotel_at) for the ranking stage.
+
+    Snapshot cities are ranked straight from the mapped columns and only the
+    selected page is materialized. Enriched searches need price and
+    availability per hotel, so they rank the enriched hotel dicts.
+    """
+    city = data.get('city')
+    snapshot, rows = find_city(city)
+
+    if snapshot is not None and not data.get('enrich'):
+        columns = {field: snapshot.column(field, rows) for field in catalog_snapshot.NUMERIC_FIELDS}
+        candidates = ranking.CandidateSet.from_columns(snapshot.ids[rows.start:rows.stop], columns)
+        return candidates, lambda index: snapshot.hotel(rows.start + index)
+
+    hotels = list(iter_hotels(city))
+    # Price and availability are ranking features, so enrich before ranking
+    if data.get('enrich'):
+        hotels = try_enrich(hotels, data)
+    return ranking.CandidateSet.from_hotels(hotels), hotels.__getitem__
+
+def rank_hotels(data, limit=None, cursor=None):
+    """Rank candidates by weighted score and return (page, next_cursor)"""
+    weights = ranking.resolve_weights(data.get('experiment'), data.get('weights'))
+    after = None
+    if cursor is not None:
+        after = decode_cursor(cursor)
+        if len(after) != 2:
+            raise ValueError('Invalid cursor')
+
+    candidates, hotel_at = ranking_candidates(data)
+    indices, scores, has_more = candidates.top_k(weights, limit or max(len(candidates), 1), after)
+
+    page = []
+    for index, score in zip(indices, scores):
+        hotel = hotel_at(index)
+        hotel['score'] = round(float(score), 4)
+        page.append(hotel)
+
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor([float(scores[-1]), int(candidates.ids[indices[-1]])])
+    return page, next_cursor
+
+def parse_limit(value):
+    """Validate the requested page size"""
+    if value is None:
+        return None
+    limit = int(value)
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    return limit
+
+def fetch_availability(hotel_ids, check_in, check_out):
+    """Fetch free room counts for all hotels in one batched call"""
+    response = http.post(
+        f"{BOOKING_SERVICE}/api/rooms/availability/batch",
+        json={'hotel_ids': hotel_ids, 'check_in': check_in, 'check_out': check_out},
+        timeout=5
+    )
+    response.raise_for_status()
+    return response.json()['availability']
+
+def fetch_lowest_prices(room_types):
+    """Fetch the lowest nightly price for each room type in one batched call"""
+    response = http.post(
+        f"{ROOM_SERVICE}/api/pricing/lowest",
+        json={'room_types': room_types},
+        timeout=5
+    )
+    response.raise_for_status()
+    return response.json()['prices']
+
+def enrich_hotels(hotels, check_in, check_out, only_available=False):
+    """Add rooms_available and price_from to every hotel.
+
+    Uses exactly one availability call and one pricing call per search,
+    regardless of the number of hotels.
+    """
+    availability = fetch_availability([hotel['id'] for hotel in hotels], check_in, check_out)
+    room_types = sorted({room_type for rooms in availability.values() for room_type in rooms})
+    prices = fetch_lowest_prices(room_types) if room_types else {}
+
+    result = []
+    for hotel in hotels:
+        rooms = availability.get(str(hotel['id']), {})
+        free_types = [room_type for room_type, count in rooms.items() if count > 0]
+        nightly_prices = [prices[room_type] for room_type in free_types if room_type in prices]
+
+        hotel['rooms_available'] = sum(rooms[room_type] for room_type in free_types)
+        hotel['price_from'] = min(nightly_prices) if nightly_prices else None
+
+        if only_available and not free_types:
+            continue
+        result.append(hotel)
+
+    return result
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -17,47 +221,193 @@ def health():
 
 @app.route('/api/search', methods=['POST'])
 def search_hotels():
-    """Search hotels by city and dates - generates hotels dynamically like in monolith"""
+    """Search hotels by city and dates - generates hotels dynamically like in monolith
+
+    Pass limit (and the returned next_cursor) to page through large results,
+    rank=true to order them by weighted score. Responses are cached by
+    normalized query.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        city = data.get('city')
+
+        if not city:
+            return jsonify({'error': 'City is required'}), 400
+
+        try:
+            cache_key = search_cache_key(data)
+        except (TypeError, ValueError, AttributeError) as e:
+            return jsonify({'error': f'Invalid search parameters: {str(e)}'}), 400
+
+        body = search_cache.get(cache_key)
+        if body is not None:
+            return Response(body, mimetype='application/json')
+
+        try:
+            result = search_ranked(data) if data.get('rank') else search_ordered(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        body = json.dumps(result, ensure_ascii=False).encode('utf-8')
+        # Results degraded by a failed enrichment are not worth keeping
+        if not g.get('enrich_failed'):
+            ttl = SEARCH_CACHE_ENRICHED_TTL if data.get('enrich') else SEARCH_CACHE_TTL
+            search_cache.set(cache_key, body, ttl)
+        return Response(body, mimetype='application/json')
+
+    except Exception as e:
+        logger.error(f"Error searching hotels: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def search_cache_key(data):
+    """Cache key for a search request.
+
+    Catalog cities are keyed by their normalized name and the snapshot
+    generation. Generated hotels echo the city as typed, so those are keyed
+    by the raw name.
+    """
+    city = data.get('city')
+    snapshot, _ = find_city(city)
+    if snapshot is not None:
+        return search_cache.make_key(normalize_query(data, catalog_snapshot.normalize_city(city)),
+                                     snapshot.generation)
+    return search_cache.make_key(normalize_query(data, city), 0)
+
+def search_ordered(data):
+    """Search in sort key order, one page at a time when limit is set"""
+    city = data.get('city')
+    limit = parse_limit(data.get('limit'))
+    hotels = iter_hotels(city, data.get('cursor'))
+
+    next_cursor = None
+    if limit is None:
+        hotels = list(hotels)
+    else:
+        # Read one extra hotel to know whether another page exists
+        hotels = list(islice(hotels, limit + 1))
+        if len(hotels) > limit:
+            hotels = hotels[:limit]
+            next_cursor = encode_cursor(hotel_sort_key(hotels[-1]))
+
+    if data.get('enrich'):
+        hotels = try_enrich(hotels, data)
+
+    logger.info(f"Generated {len(hotels)} hotels for city: {city}")
+    return {
+        'hotels': hotels,
+        'check_in': data.get('check_in'),
+        'check_out': data.get('check_out'),
+        'next_cursor': next_cursor
+    }
+
+def try_enrich(hotels, data):
+    """Enrich hotels, returning them unchanged if downstream services fail"""
+    try:
+        return enrich_hotels(hotels, data.get('check_in'), data.get('check_out'),
+                             only_available=data.get('only_available', False))
+    except requests.RequestException as e:
+        # Search still works without live availability and prices
+        logger.warning(f"Failed to enrich search results: {str(e)}")
+        g.enrich_failed = True
+        return hotels
+
+def search_ranked(data):
+    """Ranked search: every candidate is scored, then the requested page is selected"""
+    limit = parse_limit(data.get('limit'))
+    hotels, next_cursor = rank_hotels(data, limit, data.get('cursor'))
+
+    logger.info(f"Ranked {len(hotels)} hotels for city: {data.get('city')}")
+    return {
+        'hotels': hotels,
+        'check_in': data.get('check_in'),
+        'check_out': data.get('check_out'),
+        'next_cursor': next_cursor
+    }
+
+@app.route('/api/search/stream', methods=['POST'])
+def search_hotels_stream():
+    """Stream search results as NDJSON, one hotel per line
+
+    Streams small enough to buffer (STREAM_CACHE_MAX_BYTES) are cached as
+    their NDJSON body, so hits go out line by line; larger streams are never
+    held in memory.
+    """
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         city = data.get('city')
-        check_in = data.get('check_in')
-        check_out = data.get('check_out')
+        enrich = data.get('enrich', False)
 
         if not city:
             return jsonify({'error': 'City is required'}), 400
 
-        # Generate hotels dynamically based on city (like in original monolith)
-        hotels = [
-            {
-                'id': 1,
-                'name': f"Отель {city} Городской",
-                'city': city,
-                'type': 'City',
-                'description': f"Современный городской отель в центре города {city}",
-                'rating': 4.5
-            },
-            {
-                'id': 2,
-                'name': f"Отель {city} Курортный",
-                'city': city,
-                'type': 'Resort',
-                'description': f"Роскошный курортный отель в {city} с видом на парк",
-                'rating': 4.8
-            }
-        ]
-
-        logger.info(f"Generated {len(hotels)} hotels for city: {city}")
-        return jsonify({
-            'hotels': hotels,
-            'check_in': check_in,
-            'check_out': check_out
-        }), 200
+        try:
+            # Kept apart from the /api/search entry for the same query, which is a JSON document
+            cache_key = search_cache_key(data) + ':ndjson'
+        except (TypeError, ValueError, AttributeError) as e:
+            return jsonify({'error': f'Invalid search parameters: {str(e)}'}), 400
+
+        body = search_cache.get(cache_key)
+        if body is not None:
+            return Response(io.BytesIO(body), mimetype='application/x-ndjson')
+
+        try:
+            if data.get('rank'):
+                hotels, _ = rank_hotels(data, parse_limit(data.get('limit')), data.get('cursor'))
+                hotels = iter(hotels)
+                enrich = False
+            else:
+                hotels = iter_hotels(city, data.get('cursor'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
     except Exception as e:
         logger.error(f"Error searching hotels: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+    def generate():
+        count = 0
+        buffered, buffered_bytes = [], 0
+        try:
+            while True:
+                chunk = list(islice(hotels, STREAM_CHUNK_SIZE))
+                if not chunk:
+                    break
+                if enrich:
+                    chunk = try_enrich(chunk, data)
+                for hotel in chunk:
+                    count += 1
+                    line = (json.dumps(hotel, ensure_ascii=False) + '\n').encode('utf-8')
+                    if buffered is not None:
+                        buffered_bytes += len(line)
+                        if buffered_bytes > STREAM_CACHE_MAX_BYTES:
+                            # Too large to cache: stop buffering and keep memory flat
+                            buffered = None
+                        else:
+                            buffered.append(line)
+                    yield line
+        except Exception as e:
+            logger.error(f"Error streaming hotels: {str(e)}")
+            yield json.dumps({'error': str(e)}) + '\n'
+        else:
+            if buffered is not None and not g.get('enrich_failed'):
+                ttl = SEARCH_CACHE_ENRICHED_TTL if data.get('enrich') else SEARCH_CACHE_TTL
+                search_cache.set(cache_key, b''.join(buffered), ttl)
+        logger.info(f"Streamed {count} hotels for city: {city}")
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Search cache hit ratio and memory use for this worker"""
+    return jsonify(search_cache.stats()), 200
+
+@app.route('/api/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    """Invalidate cached search results in all workers"""
+    search_cache.invalidate()
+    logger.info("Search cache invalidated")
+    return jsonify({'message': 'Search cache invalidated'}), 200
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True)
 
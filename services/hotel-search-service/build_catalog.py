@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""Build the catalog snapshot before starting the application"""
+import json
+import os
+import sys
+
+from catalog_snapshot import write_snapshot
+
+CATALOG_SOURCE = os.getenv('CATALOG_SOURCE')
+CATALOG_SNAPSHOT = os.getenv('CATALOG_SNAPSHOT', 'catalog.snap')
+
+
+def load_hotels(path):
+    """Read hotels from a JSON lines file"""
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if __name__ == '__main__':
+    source = sys.argv[1] if len(sys.argv) > 1 else CATALOG_SOURCE
+    if not source:
+        print("No catalog source configured, hotels will be generated dynamically")
+        sys.exit(0)
+
+    hotels = load_hotels(source)
+    generation = write_snapshot(CATALOG_SNAPSHOT, hotels)
+    print(f"Catalog snapshot {CATALOG_SNAPSHOT} written: {len(hotels)} hotels, generation {generation}")
@@ -0,0 +1,247 @@
+"""Read-only, memory-mapped hotel catalog snapshot.
+
+The snapshot is one binary file holding the catalog in columnar form plus
+a city index. Every gunicorn worker maps the same file, so the pages are
+shared through the OS page cache instead of being copied per process.
+
+Layout (little-endian, sections 8-byte aligned):
+    header          magic, version, generation, rows, cities, string and key blob sizes
+    ids             int64[rows], sorted by (city, id)
+    features        float64[len(NUMERIC_FIELDS) * rows], NaN when missing
+    string_offsets  uint64[rows * len(STRING_FIELDS) + 1] into the string blob
+    key_offsets     uint64[cities + 1] into the key blob
+    city_bounds     uint64[cities * 2], row range of each city
+    strings         utf-8 blob
+    keys            utf-8 blob of normalized city names, sorted
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'HCAT'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sIQQQQQ')
+
+STRING_FIELDS = ('name', 'city', 'type', 'description')
+NUMERIC_FIELDS = ('rating', 'distance_km', 'popularity')
+
+
+# Cyrillic to Latin transliteration, so "Москва" and "Moskva" share a key
+TRANSLITERATION = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    'і': 'i', 'ї': 'yi', 'є': 'ye', 'ă': 'a', 'â': 'a', 'î': 'i', 'ș': 's', 'ț': 't'
+})
+
+
+def normalize_city(city):
+    """Normalize a city name: whitespace, casing, transliteration and accents"""
+    city = ' '.join(city.replace('-', ' ').split()).casefold().translate(TRANSLITERATION)
+    return ''.join(char for char in unicodedata.normalize('NFKD', city)
+                   if not unicodedata.combining(char))
+
+
+def _align(size):
+    return (size + 7) & ~7
+
+
+def write_snapshot(path, hotels, generation=None):
+    """Write hotels to a snapshot file atomically.
+
+    The file is written next to path and moved into place with os.replace,
+    so readers see either the old or the new snapshot, never a partial one.
+    """
+    if generation is None:
+        generation = time.time_ns()
+
+    hotels = sorted(hotels, key=lambda hotel: (normalize_city(hotel['city']), hotel['id']))
+    rows = len(hotels)
+
+    ids = np.array([hotel['id'] for hotel in hotels], dtype='<i8')
+    features = np.array(
+        [[np.nan if hotel.get(field) is None else hotel[field] for hotel in hotels]
+         for field in NUMERIC_FIELDS],
+        dtype='<f8'
+    ).reshape(len(NUMERIC_FIELDS), rows)
+
+    strings = bytearray()
+    string_offsets = [0]
+    for hotel in hotels:
+        for field in STRING_FIELDS:
+            strings += str(hotel.get(field) or '').encode('utf-8')
+            string_offsets.append(len(strings))
+
+    keys = bytearray()
+    key_offsets = [0]
+    city_bounds = []
+    previous_key = None
+    for row, hotel in enumerate(hotels):
+        key = normalize_city(hotel['city'])
+        if key != previous_key:
+            if city_bounds:
+                city_bounds.append(row)
+            keys += key.encode('utf-8')
+            key_offsets.append(len(keys))
+            city_bounds.append(row)
+            previous_key = key
+    if city_bounds:
+        city_bounds.append(rows)
+    cities = len(key_offsets) - 1
+
+    sections = [
+        ids.tobytes(),
+        features.tobytes(),
+        np.array(string_offsets, dtype='<u8').tobytes(),
+        np.array(key_offsets, dtype='<u8').tobytes(),
+        np.array(city_bounds, dtype='<u8').tobytes(),
+        bytes(strings),
+        bytes(keys)
+    ]
+
+    tmp_path = f'{path}.tmp.{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, generation, rows, cities, len(strings), len(keys)))
+        for section in sections:
+            f.write(section)
+            f.write(b'\0' * (_align(len(section)) - len(section)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return generation
+
+
+class CatalogSnapshot:
+    """Zero-copy view of a snapshot file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, generation, rows, cities, strings_size, keys_size = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'Not a catalog snapshot: {path}')
+
+        self.path = path
+        self.generation = generation
+        self.row_count = rows
+        self.city_count = cities
+
+        offset = HEADER.size
+        self.ids = self._array('<i8', rows, offset)
+        offset += _align(rows * 8)
+        self.features = self._array('<f8', rows * len(NUMERIC_FIELDS), offset).reshape(len(NUMERIC_FIELDS), rows)
+        offset += _align(rows * len(NUMERIC_FIELDS) * 8)
+        self._string_offsets = self._array('<u8', rows * len(STRING_FIELDS) + 1, offset)
+        offset += _align((rows * len(STRING_FIELDS) + 1) * 8)
+        self._key_offsets = self._array('<u8', cities + 1, offset)
+        offset += _align((cities + 1) * 8)
+        self._city_bounds = self._array('<u8', cities * 2, offset).reshape(cities, 2)
+        offset += _align(cities * 2 * 8)
+        self._strings_base = offset
+        self._keys_base = offset + _align(strings_size)
+
+    def _array(self, dtype, count, offset):
+        return np.frombuffer(self._mmap, dtype=dtype, count=count, offset=offset)
+
+    def _city_key(self, index):
+        start = self._keys_base + int(self._key_offsets[index])
+        end = self._keys_base + int(self._key_offsets[index + 1])
+        return self._mmap[start:end].decode('utf-8')
+
+    def city_rows(self, city):
+        """Return the row range of a city, or None if it is not in the catalog"""
+        key = normalize_city(city)
+        low, high = 0, self.city_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._city_key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.city_count and self._city_key(low) == key:
+            start, end = self._city_bounds[low]
+            return range(int(start), int(end))
+        return None
+
+    def column(self, field, rows):
+        """Zero-copy numeric column for a row range"""
+        return self.features[NUMERIC_FIELDS.index(field), rows.start:rows.stop]
+
+    def hotel(self, row):
+        """Materialize one row as a hotel dict"""
+        hotel = {'id': int(self.ids[row])}
+        base = row * len(STRING_FIELDS)
+        for position, field in enumerate(STRING_FIELDS):
+            start = self._strings_base + int(self._string_offsets[base + position])
+            end = self._strings_base + int(self._string_offsets[base + position + 1])
+            hotel[field] = self._mmap[start:end].decode('utf-8')
+        for position, field in enumerate(NUMERIC_FIELDS):
+            value = self.features[position, row]
+            hotel[field] = None if np.isnan(value) else float(value)
+        return hotel
+
+    def iter_hotels(self, rows, after_id=None):
+        """Yield hotels of a row range in id order, starting after after_id"""
+        start = rows.start
+        if after_id is not None:
+            start += int(np.searchsorted(self.ids[rows.start:rows.stop], after_id, side='right'))
+        for row in range(start, rows.stop):
+            yield self.hotel(row)
+
+
+class SnapshotStore:
+    """Holds the current snapshot and hot-swaps it when the file is replaced"""
+
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._signature = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """Return the latest snapshot, or None if there is none"""
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            # Only one thread re-checks the file; the others keep the current snapshot
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._checked_at = now
+                    self._reload_if_changed()
+                finally:
+                    self._lock.release()
+        return self._snapshot
+
+    def _reload_if_changed(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return
+
+        try:
+            snapshot = CatalogSnapshot(self.path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.error(f"Failed to load catalog snapshot {self.path}: {str(e)}")
+            return
+
+        # The previous mapping is released once in-flight requests drop it
+        self._snapshot = snapshot
+        self._signature = signature
+        logger.info(f"Loaded catalog snapshot {self.path}: {snapshot.row_count} hotels, "
+                    f"{snapshot.city_count} cities, generation {snapshot.generation}")
@@ -0,0 +1,151 @@
+"""Vectorized ranking of hotel search candidates"""
+import json
+import math
+import os
+
+import numpy as np
+
+# Ranking features and the hotel fields they are read from
+FEATURES = ('rating', 'price', 'distance', 'popularity', 'availability')
+FEATURE_FIELDS = {
+    'rating': 'rating',
+    'price': 'price_from',
+    'distance': 'distance_km',
+    'popularity': 'popularity',
+    'availability': 'rooms_available'
+}
+
+# Lower price and distance are better, so those columns are inverted
+HIGHER_IS_BETTER = np.array([True, False, False, True, True])
+
+DEFAULT_WEIGHTS = {
+    'rating': 0.4,
+    'price': 0.25,
+    'distance': 0.15,
+    'popularity': 0.1,
+    'availability': 0.1
+}
+
+# Named weight profiles for experiments, e.g.
+# RANKING_PROFILES='{"cheap_first": {"price": 0.6, "rating": 0.2}}'
+RANKING_PROFILES = json.loads(os.getenv('RANKING_PROFILES', '{}'))
+
+
+def resolve_weights(experiment=None, overrides=None):
+    """Build the weight vector from defaults, an experiment profile and overrides"""
+    weights = dict(DEFAULT_WEIGHTS)
+
+    if experiment:
+        if not isinstance(experiment, str) or experiment not in RANKING_PROFILES:
+            raise ValueError(f'Unknown ranking experiment: {experiment}')
+        weights.update(RANKING_PROFILES[experiment])
+
+    if overrides:
+        if not isinstance(overrides, dict):
+            raise ValueError('Ranking weights must be an object of feature weights')
+        unknown = set(overrides) - set(FEATURES)
+        if unknown:
+            raise ValueError(f"Unknown ranking features: {', '.join(sorted(unknown))}")
+        for feature, value in overrides.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise ValueError(f'Ranking weight for {feature} must be a finite number')
+        weights.update(overrides)
+
+    return np.array([float(weights.get(feature, 0.0)) for feature in FEATURES])
+
+
+class CandidateSet:
+    """Ranking candidates stored as columnar arrays.
+
+    ids has shape (n,), features has shape (len(FEATURES), n) and uses NaN
+    for missing values.
+    """
+
+    def __init__(self, ids, features):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.features = np.asarray(features, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_hotels(cls, hotels):
+        """Build columns from hotel dicts"""
+        ids = np.fromiter((hotel['id'] for hotel in hotels), dtype=np.int64, count=len(hotels))
+        features = np.empty((len(FEATURES), len(hotels)), dtype=np.float64)
+        for row, feature in enumerate(FEATURES):
+            field = FEATURE_FIELDS[feature]
+            features[row] = [
+                np.nan if hotel.get(field) is None else hotel[field]
+                for hotel in hotels
+            ]
+        return cls(ids, features)
+
+    @classmethod
+    def from_columns(cls, ids, columns):
+        """Build from existing arrays keyed by hotel field, e.g. snapshot columns"""
+        features = np.full((len(FEATURES), len(ids)), np.nan)
+        for row, feature in enumerate(FEATURES):
+            column = columns.get(FEATURE_FIELDS[feature])
+            if column is not None:
+                features[row] = column
+        return cls(ids, features)
+
+    def scores(self, weights):
+        """Score every candidate in one vectorized pass.
+
+        Min-max normalization, direction and weights are folded into one
+        coefficient per feature, so scoring is a single matrix-vector product.
+        """
+        features = self.features
+        if not len(self):
+            return np.empty(0)
+        # fmin/fmax skip NaN, so missing values do not affect the range
+        low = np.fmin.reduce(features, axis=1)
+        high = np.fmax.reduce(features, axis=1)
+        spread = high - low
+        varying = spread > 0
+
+        coefficients = np.zeros(len(FEATURES))
+        np.divide(weights, spread, out=coefficients, where=varying)
+        coefficients[~HIGHER_IS_BETTER] *= -1
+        # Offsets map each feature range onto [0, 1]; constant features score 0.5
+        offsets = np.where(HIGHER_IS_BETTER, -low, -high) * coefficients
+        offsets[~varying] = 0.5 * weights[~varying]
+
+        missing = np.isnan(features)
+        if missing.any():
+            # Missing values sit in the middle of the range, i.e. neutral
+            features = np.where(missing, ((low + high) / 2)[:, None], features)
+            features[np.isnan(features)] = 0.0
+
+        return coefficients @ features + np.nansum(offsets)
+
+    def top_k(self, weights, k, after=None):
+        """Return (indices, scores, has_more) for the best k candidates.
+
+        Order is by score descending, then id ascending. after is the
+        (score, id) sort key of the last candidate of the previous page.
+        """
+        scores = self.scores(weights)
+        candidates = np.arange(len(self))
+
+        if after is not None:
+            after_score, after_id = after
+            mask = (scores < after_score) | ((scores == after_score) & (self.ids > after_id))
+            candidates = candidates[mask]
+
+        has_more = len(candidates) > k
+        negated = -scores[candidates]
+
+        if has_more:
+            # Partial selection: keep everything that can reach the top k,
+            # ties at the boundary included, then sort only those
+            kth = np.partition(negated, k - 1)[k - 1]
+            keep = negated <= kth
+            candidates = candidates[keep]
+            negated = negated[keep]
+
+        order = np.lexsort((self.ids[candidates], negated))[:k]
+        selected = candidates[order]
+        return selected, scores[selected], has_more
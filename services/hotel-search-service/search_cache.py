@@ -0,0 +1,207 @@
+"""Two-tier cache for search responses: per-worker LRU plus shared Redis"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# Redis keys shared with other services
+CACHE_GENERATION_KEY = 'search:cache:generation'
+AVAILABILITY_VERSION_KEY = 'availability:version'
+
+
+class LRUCache:
+    """Thread-safe LRU cache of byte strings with TTL and memory accounting"""
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self.bytes -= len(key) + len(value)
+
+
+class SearchCache:
+    """Search response cache keyed by normalized query.
+
+    Keys embed the catalog generation, a shared cache generation and, for
+    enriched searches, the availability version, so bumping any of them
+    invalidates the affected entries in every worker.
+    """
+
+    def __init__(self, local, redis_client=None, version_refresh=1.0, prefix='search:cache'):
+        self.local = local
+        self.redis = redis_client
+        self.version_refresh = version_refresh
+        self.prefix = prefix
+        self._versions = (0, 0)
+        self._versions_read_at = None
+        self.stats_counters = {'local_hits': 0, 'redis_hits': 0, 'misses': 0, 'redis_errors': 0}
+
+    def versions(self):
+        """Return (cache_generation, availability_version), refreshed at most once per interval"""
+        if self.redis is None:
+            return self._versions
+        now = time.monotonic()
+        if self._versions_read_at is None or now - self._versions_read_at >= self.version_refresh:
+            self._versions_read_at = now
+            try:
+                generation, availability = self.redis.mget(CACHE_GENERATION_KEY, AVAILABILITY_VERSION_KEY)
+                self._versions = (int(generation or 0), int(availability or 0))
+            except redis.RedisError as e:
+                self._redis_error(e)
+        return self._versions
+
+    def make_key(self, query, catalog_generation):
+        """Build a cache key from an already normalized query dict"""
+        cache_generation, availability_version = self.versions()
+        parts = dict(query, catalog=catalog_generation, generation=cache_generation)
+        if query.get('enrich'):
+            parts['availability'] = availability_version
+        digest = hashlib.sha1(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+        return f'{self.prefix}:{digest}'
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self.stats_counters['local_hits'] += 1
+            return value
+
+        if self.redis is not None:
+            try:
+                value = self.redis.get(key)
+            except redis.RedisError as e:
+                self._redis_error(e)
+                value = None
+            if value is not None:
+                ttl = self._remaining_ttl(key)
+                self.local.set(key, value, ttl)
+                self.stats_counters['redis_hits'] += 1
+                return value
+
+        self.stats_counters['misses'] += 1
+        return None
+
+    def set(self, key, value, ttl):
+        self.local.set(key, value, ttl)
+        if self.redis is not None:
+            try:
+                self.redis.set(key, value, ex=max(int(ttl), 1))
+            except redis.RedisError as e:
+                self._redis_error(e)
+
+    def invalidate(self):
+        """Drop all cached responses in this worker and, through Redis, in every worker"""
+        self.local.clear()
+        if self.redis is not None:
+            try:
+                self.redis.incr(CACHE_GENERATION_KEY)
+            except redis.RedisError as e:
+                self._redis_error(e)
+        self._versions_read_at = None
+
+    def clear(self):
+        """Drop this worker's entries and counters"""
+        self.local.clear()
+        self._versions_read_at = None
+        for name in self.stats_counters:
+            self.stats_counters[name] = 0
+
+    def stats(self):
+        counters = dict(self.stats_counters)
+        lookups = counters['local_hits'] + counters['redis_hits'] + counters['misses']
+        hits = counters['local_hits'] + counters['redis_hits']
+        result = {
+            **counters,
+            'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+            'local_entries': len(self.local),
+            'local_bytes': self.local.bytes,
+            'local_evictions': self.local.evictions,
+            'redis_enabled': self.redis is not None
+        }
+        if self.redis is not None:
+            try:
+                result['redis_used_memory'] = self.redis.info('memory').get('used_memory')
+            except redis.RedisError as e:
+                self._redis_error(e)
+        return result
+
+    def _remaining_ttl(self, key):
+        try:
+            ttl = self.redis.ttl(key)
+        except redis.RedisError:
+            ttl = -1
+        return ttl if ttl and ttl > 0 else 1
+
+    def _redis_error(self, error):
+        self.stats_counters['redis_errors'] += 1
+        logger.warning(f"Search cache Redis error: {str(error)}")
+
+
+def normalize_date(value):
+    """Return an ISO date string, or the raw value if it is not a date"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date().isoformat()
+    except (TypeError, ValueError):
+        return value
+
+
+def normalize_query(data, city_key):
+    """Reduce a search request to the fields that affect its result"""
+    weights = data.get('weights') or {}
+    return {
+        'city': city_key,
+        'check_in': normalize_date(data.get('check_in')),
+        'check_out': normalize_date(data.get('check_out')),
+        'enrich': bool(data.get('enrich')),
+        'only_available': bool(data.get('only_available')) and bool(data.get('enrich')),
+        'limit': data.get('limit'),
+        'cursor': data.get('cursor'),
+        'rank': bool(data.get('rank')),
+        'experiment': data.get('experiment') if data.get('rank') else None,
+        'weights': {name: float(value) for name, value in sorted(weights.items())} if data.get('rank') else None
+    }
@@ -1,6 +1,12 @@
 import unittest
 import json
-from app import app
+import os
+import tempfile
+import numpy as np
+from unittest.mock import patch
+from app import app, search_cache, search_cache_key
+from ranking import CandidateSet, resolve_weights
+from catalog_snapshot import CatalogSnapshot, SnapshotStore, write_snapshot
 
 
 class TestHotelSearchService(unittest.TestCase):
@@ -10,6 +16,7 @@ class TestHotelSearchService(unittest.TestCase):
         """Set up test client"""
         self.app = app.test_client()
         self.app.testing = True
+        search_cache.clear()
 
     def test_health_check(self):
         """Test health check endpoint"""
@@ -94,6 +101,318 @@ class TestHotelSearchService(unittest.TestCase):
         data = json.loads(response.data)
         self.assertIn('error', data)
 
+    @patch('app.fetch_lowest_prices')
+    @patch('app.fetch_availability')
+    def test_search_hotels_enriched(self, mock_availability, mock_prices):
+        """Test enriched search adds availability and lowest price with batched calls"""
+        mock_availability.return_value = {
+            '1': {'Standard': 3, 'Luxury': 0},
+            '2': {'Standard': 0, 'Luxury': 0}
+        }
+        mock_prices.return_value = {'Standard': 90.0, 'Luxury': 225.0}
+
+        payload = {
+            'city': 'Moscow',
+            'check_in': '2025-12-15',
+            'check_out': '2025-12-20',
+            'enrich': True
+        }
+        response = self.app.post(
+            '/api/search',
+            data=json.dumps(payload),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+
+        self.assertEqual(len(data['hotels']), 2)
+        self.assertEqual(data['hotels'][0]['rooms_available'], 3)
+        self.assertEqual(data['hotels'][0]['price_from'], 90.0)
+        self.assertEqual(data['hotels'][1]['rooms_available'], 0)
+        self.assertIsNone(data['hotels'][1]['price_from'])
+
+        # One availability call and one pricing call for the whole search
+        mock_availability.assert_called_once_with([1, 2], '2025-12-15', '2025-12-20')
+        mock_prices.assert_called_once_with(['Luxury', 'Standard'])
+
+    @patch('app.fetch_lowest_prices')
+    @patch('app.fetch_availability')
+    def test_search_hotels_only_available(self, mock_availability, mock_prices):
+        """Test hotels without free rooms are filtered out on request"""
+        mock_availability.return_value = {
+            '1': {'Standard': 0},
+            '2': {'Standard': 2}
+        }
+        mock_prices.return_value = {'Standard': 90.0}
+
+        payload = {
+            'city': 'Moscow',
+            'check_in': '2025-12-15',
+            'check_out': '2025-12-20',
+            'enrich': True,
+            'only_available': True
+        }
+        response = self.app.post(
+            '/api/search',
+            data=json.dumps(payload),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([hotel['id'] for hotel in data['hotels']], [2])
+
+    def test_search_hotels_pagination(self):
+        """Test cursor pagination walks results in stable order"""
+        payload = {
+            'city': 'Moscow',
+            'check_in': '2025-12-15',
+            'check_out': '2025-12-20',
+            'limit': 1
+        }
+        response = self.app.post('/api/search', data=json.dumps(payload),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        first_page = json.loads(response.data)
+        self.assertEqual([hotel['id'] for hotel in first_page['hotels']], [1])
+        self.assertIsNotNone(first_page['next_cursor'])
+
+        payload['cursor'] = first_page['next_cursor']
+        response = self.app.post('/api/search', data=json.dumps(payload),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        second_page = json.loads(response.data)
+        self.assertEqual([hotel['id'] for hotel in second_page['hotels']], [2])
+        self.assertIsNone(second_page['next_cursor'])
+
+    def test_search_hotels_invalid_cursor(self):
+        """Test malformed cursor is rejected"""
+        payload = {'city': 'Moscow', 'limit': 1, 'cursor': 'not-a-cursor'}
+        response = self.app.post('/api/search', data=json.dumps(payload),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_hotels_stream(self):
+        """Test NDJSON streaming returns one hotel per line"""
+        payload = {
+            'city': 'Paris',
+            'check_in': '2025-12-15',
+            'check_out': '2025-12-20'
+        }
+        response = self.app.post('/api/search/stream', data=json.dumps(payload),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([hotel['id'] for hotel in lines], [1, 2])
+        self.assertEqual(lines[0]['city'], 'Paris')
+
+    def test_search_hotels_missing_body(self):
+        """Test a missing or non-JSON body is rejected on both search endpoints"""
+        for url in ('/api/search', '/api/search/stream'):
+            self.assertEqual(self.app.post(url).status_code, 400)
+            self.assertEqual(self.app.post(url, data='city=Paris').status_code, 400)
+
+    @patch('app.iter_hotels')
+    def test_search_hotels_stream_uses_search_cache(self, mock_iter_hotels):
+        """Test a repeated stream is served from its cached NDJSON body"""
+        payload = {'city': 'Paris', 'check_in': '2025-12-15', 'check_out': '2025-12-20'}
+        mock_iter_hotels.return_value = iter([{'id': 1, 'city': 'Paris'}, {'id': 2, 'city': 'Paris'}])
+
+        # The cache is filled once the stream has been read to the end
+        first = self.app.post('/api/search/stream', data=json.dumps(payload),
+                              content_type='application/json').data
+        second = self.app.post('/api/search/stream', data=json.dumps(payload),
+                               content_type='application/json').data
+        self.assertEqual(first, second)
+        self.assertEqual([json.loads(line)['id'] for line in second.splitlines()], [1, 2])
+        self.assertEqual(mock_iter_hotels.call_count, 1)
+
+    @patch('app.STREAM_CACHE_MAX_BYTES', 1024)
+    @patch('app.iter_hotels')
+    def test_search_hotels_large_stream_not_buffered(self, mock_iter_hotels):
+        """Test a stream larger than the cache limit is neither buffered nor cached"""
+        payload = {'city': 'Paris'}
+        mock_iter_hotels.side_effect = lambda city, cursor: ({'id': i, 'city': 'Paris'} for i in range(1000))
+
+        for _ in range(2):
+            response = self.app.post('/api/search/stream', data=json.dumps(payload),
+                                     content_type='application/json')
+            self.assertEqual(len(response.data.splitlines()), 1000)
+        self.assertEqual(mock_iter_hotels.call_count, 2)
+        self.assertEqual(search_cache.stats()['local_entries'], 0)
+
+    def test_search_hotels_ranked(self):
+        """Test ranked search orders hotels by score and pages by score cursor"""
+        payload = {'city': 'Moscow', 'rank': True, 'limit': 1}
+        response = self.app.post('/api/search', data=json.dumps(payload),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        # Higher rating wins with default weights
+        self.assertEqual([hotel['id'] for hotel in data['hotels']], [2])
+        self.assertIn('score', data['hotels'][0])
+
+        payload['cursor'] = data['next_cursor']
+        response = self.app.post('/api/search', data=json.dumps(payload),
+                                 content_type='application/json')
+        data = json.loads(response.data)
+        self.assertEqual([hotel['id'] for hotel in data['hotels']], [1])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_search_hotels_ranked_unknown_experiment(self):
+        """Test unknown ranking experiment is rejected"""
+        payload = {'city': 'Moscow', 'rank': True, 'experiment': 'missing'}
+        response = self.app.post('/api/search', data=json.dumps(payload),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    @patch('app.fetch_lowest_prices')
+    @patch('app.fetch_availability')
+    def test_search_cache_hit(self, mock_availability, mock_prices):
+        """Test repeated searches are served from cache without downstream calls"""
+        mock_availability.return_value = {'1': {'Standard': 1}, '2': {'Standard': 1}}
+        mock_prices.return_value = {'Standard': 90.0}
+
+        payload = {'city': 'Paris', 'check_in': '2025-12-15', 'check_out': '2025-12-20', 'enrich': True}
+        first = self.app.post('/api/search', data=json.dumps(payload), content_type='application/json')
+        second = self.app.post('/api/search', data=json.dumps(payload), content_type='application/json')
+
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(mock_availability.call_count, 1)
+
+        stats = json.loads(self.app.get('/api/cache/stats').data)
+        self.assertEqual(stats['local_hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_ratio'], 0.5)
+        self.assertGreater(stats['local_bytes'], 0)
+
+        self.app.post('/api/cache/invalidate')
+        self.app.post('/api/search', data=json.dumps(payload), content_type='application/json')
+        self.assertEqual(mock_availability.call_count, 2)
+
+
+class TestRanking(unittest.TestCase):
+    """Unit tests for the vectorized ranking engine"""
+
+    def test_top_k_matches_full_sort(self):
+        """Test partial top-k selection agrees with a full sort"""
+        rng = np.random.default_rng(42)
+        features = rng.random((5, 1000))
+        features[1, ::10] = np.nan
+        # Duplicate scores exercise the id tie-break
+        features[:, 500:] = features[:, :500]
+        candidates = CandidateSet(np.arange(1000), features)
+        weights = resolve_weights()
+
+        scores = candidates.scores(weights)
+        expected = np.lexsort((candidates.ids, -scores))
+
+        first, first_scores, has_more = candidates.top_k(weights, 50)
+        self.assertTrue(has_more)
+        self.assertEqual(list(first), list(expected[:50]))
+
+        after = (first_scores[-1], candidates.ids[first[-1]])
+        second, _, _ = candidates.top_k(weights, 50, after)
+        self.assertEqual(list(second), list(expected[50:100]))
+
+    def test_lower_price_ranks_higher(self):
+        """Test price and distance are inverted features"""
+        hotels = [
+            {'id': 1, 'rating': 4.5, 'price_from': 200.0},
+            {'id': 2, 'rating': 4.5, 'price_from': 100.0}
+        ]
+        candidates = CandidateSet.from_hotels(hotels)
+        indices, _, _ = candidates.top_k(resolve_weights(overrides={'price': 1.0}), 2)
+        self.assertEqual([hotels[i]['id'] for i in indices], [2, 1])
+
+
+    def test_invalid_weights_rejected(self):
+        """Test weights must map known features to finite numbers"""
+        for overrides in ([1, 2], 'price', {'price': None}, {'price': 'high'},
+                          {'price': float('nan')}, {'price': True}):
+            with self.assertRaises(ValueError):
+                resolve_weights(overrides=overrides)
+        with self.assertRaises(ValueError):
+            resolve_weights(experiment=['cheap_first'])
+
+        app.testing = True
+        client = app.test_client()
+        for url in ('/api/search', '/api/search/stream'):
+            response = client.post(url, data=json.dumps({'city': 'Moscow', 'rank': True, 'weights': {'price': None}}),
+                                   content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+CATALOG = [
+    {'id': 10, 'name': 'Гранд Отель', 'city': 'Москва', 'type': 'City',
+     'description': 'Центр', 'rating': 4.9, 'distance_km': 0.5, 'popularity': 900},
+    {'id': 7, 'name': 'Парк Отель', 'city': 'москва', 'type': 'Resort',
+     'description': 'Парк', 'rating': 4.1, 'distance_km': 12.0, 'popularity': None},
+    {'id': 3, 'name': 'Old Town', 'city': 'Paris', 'type': 'City',
+     'description': 'Rive gauche', 'rating': 4.6, 'distance_km': 1.2, 'popularity': 400}
+]
+
+
+class TestCatalogSnapshot(unittest.TestCase):
+    """Unit tests for the memory-mapped catalog snapshot"""
+
+    def setUp(self):
+        """Write a small snapshot to a temporary directory"""
+        search_cache.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'catalog.snap')
+        write_snapshot(self.path, CATALOG, generation=1)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_city_lookup(self):
+        """Test city index lookup is case-insensitive and rows are id-ordered"""
+        snapshot = CatalogSnapshot(self.path)
+        rows = snapshot.city_rows('  МОСКВА ')
+        hotels = list(snapshot.iter_hotels(rows))
+        self.assertEqual([hotel['id'] for hotel in hotels], [7, 10])
+        self.assertEqual(hotels[1]['name'], 'Гранд Отель')
+        self.assertEqual(hotels[1]['rating'], 4.9)
+        self.assertIsNone(hotels[0]['popularity'])
+        self.assertEqual([hotel['id'] for hotel in snapshot.iter_hotels(rows, after_id=7)], [10])
+        self.assertIsNone(snapshot.city_rows('Berlin'))
+
+    def test_hot_swap(self):
+        """Test the store picks up a replaced snapshot file without restart"""
+        store = SnapshotStore(self.path, check_interval=0)
+        self.assertEqual(store.current().generation, 1)
+
+        write_snapshot(self.path, CATALOG[2:], generation=2)
+        snapshot = store.current()
+        self.assertEqual(snapshot.generation, 2)
+        self.assertIsNone(snapshot.city_rows('Москва'))
+
+    def test_search_uses_snapshot(self):
+        """Test search serves snapshot cities and generates the rest"""
+        with patch('app.catalog', SnapshotStore(self.path, check_interval=0)):
+            client = app.test_client()
+            response = client.post('/api/search', data=json.dumps({'city': 'Москва', 'rank': True}),
+                                   content_type='application/json')
+            data = json.loads(response.data)
+            self.assertEqual([hotel['id'] for hotel in data['hotels']], [10, 7])
+
+            response = client.post('/api/search', data=json.dumps({'city': 'Tokyo'}),
+                                   content_type='application/json')
+            data = json.loads(response.data)
+            self.assertEqual([hotel['id'] for hotel in data['hotels']], [1, 2])
+
+    def test_cache_key_normalization(self):
+        """Test catalog city spellings share a cache key and the snapshot generation is part of it"""
+        store = SnapshotStore(self.path, check_interval=0)
+        with patch('app.catalog', store):
+            query = {'city': 'Москва', 'check_in': '2025-12-15', 'check_out': '2025-12-20'}
+            key = search_cache_key(query)
+            self.assertEqual(key, search_cache_key(dict(query, city='  MOSKVA ')))
+            self.assertNotEqual(key, search_cache_key(dict(query, check_out='2025-12-21')))
+
+            write_snapshot(self.path, CATALOG, generation=2)
+            self.assertNotEqual(key, search_cache_key(query))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -4,8 +4,17 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 import os
 import logging
+import math
+import time
 import uuid
-from datetime import datetime
+from urllib.parse import urlsplit
+import httpx
+import redis
+import requests
+import notification_history
+import notification_queue
+from transports import webhook_host_error
+from message_templates import DEFAULT_LOCALE, CompiledTemplate, TemplateNotFound, TemplateRegistry
 
 app = Flask(__name__)
 CORS(app)
@@ -22,9 +31,61 @@ DB_CONFIG = {
     'port': os.getenv('DB_PORT', '5432')
 }
 
+# Redis configuration (notification queue)
+REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
+REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+
+redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+
+CHANNELS = ('email', 'sms', 'push', 'webhook')
+
+# Guest contacts for bulk notifications by query
+BOOKING_SERVICE = os.getenv('BOOKING_SERVICE', 'http://booking-service:5002')
+BULK_MAX_MESSAGES = int(os.getenv('BULK_MAX_MESSAGES', 50000))
+# Recipient field holding the address for each channel
+CHANNEL_ADDRESS_FIELDS = {'email': 'email', 'sms': 'phone', 'push': 'push_token', 'webhook': 'webhook_url'}
+
 def get_db_connection():
     return psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor)
 
+def parse_limit(value, default, maximum):
+    """Page size from a request value, clamped to 1..maximum; ValueError if it is not an integer"""
+    if value is None:
+        return default
+    try:
+        return max(1, min(int(value), maximum))
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+
+def invalid_recipient(channel, recipient):
+    """Return an error for an address the channel cannot deliver to, or None"""
+    if not isinstance(recipient, str):
+        return 'Recipient must be a string'
+    if channel == 'webhook':
+        try:
+            url = httpx.URL(recipient)
+            # httpx accepts ports out of range; urlsplit rejects them
+            urlsplit(recipient).port
+        except (httpx.InvalidURL, ValueError):
+            return 'Webhook recipient must be a valid http(s) URL'
+        if url.scheme not in ('http', 'https') or not url.host:
+            return 'Webhook recipient must be a valid http(s) URL'
+        # Loopback, private and internal hosts would let callers reach our own services
+        return webhook_host_error(url.host)
+    return None
+
+def load_template_overrides():
+    """Read template overrides saved through the templates API"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute('SELECT name, locale, channel, body FROM message_templates')
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    return {(row['name'], row['locale'], row['channel'] or None): row['body'] for row in rows}
+
+templates = TemplateRegistry(load_overrides=load_template_overrides, redis_client=redis_client)
+
 def create_database_if_not_exists():
     """Create database if it doesn't exist"""
     try:
@@ -58,15 +119,39 @@ def init_db():
     conn = get_db_connection()
     cur = conn.cursor()
     
+    # Partitioned by month; see notification_history
+    notification_history.ensure_partitioned_table(cur)
+    
+    # Messages that failed every delivery attempt, kept for replay
     cur.execute('''
-        CREATE TABLE IF NOT EXISTS notifications (
+        CREATE TABLE IF NOT EXISTS notification_dead_letters (
             id VARCHAR(36) PRIMARY KEY,
             booking_id VARCHAR(36) NOT NULL,
             notification_type VARCHAR(50) NOT NULL,
             recipient VARCHAR(255) NOT NULL,
             message TEXT NOT NULL,
-            status VARCHAR(50) NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            attempts INTEGER NOT NULL,
+            failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            replayed_at TIMESTAMP
+        )
+    ''')
+    # Original queue time, so a replayed message updates its own history row
+    cur.execute('ALTER TABLE notification_dead_letters ADD COLUMN IF NOT EXISTS created_at TIMESTAMP')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_dead_letters_pending
+        ON notification_dead_letters (failed_at) WHERE replayed_at IS NULL
+    ''')
+    
+    # Overrides of the built-in message templates; channel '' applies to any channel
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS message_templates (
+            name VARCHAR(100) NOT NULL,
+            locale VARCHAR(10) NOT NULL,
+            channel VARCHAR(20) NOT NULL DEFAULT '',
+            body TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (name, locale, channel)
         )
     ''')
     
@@ -82,7 +167,7 @@ def health():
 
 @app.route('/api/notifications/send', methods=['POST'])
 def send_notification():
-    """Send notification (email or SMS)"""
+    """Queue notification (email or SMS) for delivery by the worker"""
     try:
         data = request.get_json()
         
@@ -90,43 +175,44 @@ def send_notification():
         notification_type = data.get('type', 'email')  # email or sms
         recipient = data.get('recipient')
         message = data.get('message')
+        # Optional, e.g. booking_confirmation; repeated categories for a booking are dropped
+        category = data.get('category')
+        
+        if notification_type not in CHANNELS:
+            return jsonify({'error': 'Invalid notification type'}), 400
+        
+        # A registered template can be used instead of a ready message
+        if not message and data.get('template'):
+            params = dict(data.get('params') or {}, booking_id=booking_id)
+            try:
+                message = templates.render(data['template'], params,
+                                           data.get('locale', DEFAULT_LOCALE), notification_type)
+            except TemplateNotFound as e:
+                return jsonify({'error': str(e.args[0])}), 400
         
         if not all([booking_id, recipient, message]):
             return jsonify({'error': 'Missing required fields'}), 400
         
-        notification_id = str(uuid.uuid4())
-        
-        # Simulate sending notification
-        if notification_type == 'email':
-            logger.info(f"Sending email to {recipient}: {message}")
-            status = 'sent'
-        elif notification_type == 'sms':
-            logger.info(f"Sending SMS to {recipient}: {message}")
-            status = 'sent'
-        else:
-            return jsonify({'error': 'Invalid notification type'}), 400
+        error = invalid_recipient(notification_type, recipient)
+        if error:
+            return jsonify({'error': error}), 400
         
-        # Save to database
-        conn = get_db_connection()
-        cur = conn.cursor()
+        result = send_notification_internal(booking_id, notification_type, recipient, message, category)
         
-        cur.execute(
-            '''INSERT INTO notifications 
-               (id, booking_id, notification_type, recipient, message, status)
-               VALUES (%s, %s, %s, %s, %s, %s)''',
-            (notification_id, booking_id, notification_type, recipient, message, status)
-        )
-        
-        conn.commit()
-        cur.close()
-        conn.close()
+        if result['status'] == 'duplicate':
+            return jsonify({
+                'notification_id': None,
+                'status': 'duplicate',
+                'type': notification_type,
+                'message': f'{notification_type.upper()} was already sent for this booking'
+            }), 200
         
         return jsonify({
-            'notification_id': notification_id,
-            'status': status,
+            'notification_id': result['notification_id'],
+            'status': result['status'],
             'type': notification_type,
-            'message': f'{notification_type.upper()} sent successfully'
-        }), 200
+            'message': f'{notification_type.upper()} queued for delivery'
+        }), 202
         
     except Exception as e:
         logger.error(f"Error sending notification: {str(e)}")
@@ -134,62 +220,455 @@ def send_notification():
 
 @app.route('/api/notifications/booking/<booking_id>', methods=['POST'])
 def notify_booking_confirmation(booking_id):
-    """Send booking confirmation notifications"""
+    """Send booking confirmation notifications on every requested channel.
+    
+    Channels are given as recipients {channel: address}; the legacy email and
+    phone fields map to email and sms. All channels are queued in one Redis
+    round trip, so the cost does not grow with the number of channels, and
+    the worker delivers them concurrently and records them in its batches.
+    """
     try:
         data = request.get_json()
-        email = data.get('email')
-        phone = data.get('phone')
-        hotel_name = data.get('hotel_name', 'Hotel')
+        recipients = dict(data.get('recipients') or {})
+        if data.get('email'):
+            recipients.setdefault('email', data['email'])
+        if data.get('phone'):
+            recipients.setdefault('sms', data['phone'])
+        template = data.get('template', 'booking_confirmation')
+        locale = data.get('locale', DEFAULT_LOCALE)
+        params = {
+            'booking_id': booking_id,
+            'hotel_name': data.get('hotel_name', 'Hotel'),
+            'room_type': data.get('room_type', ''),
+            'guest_name': data.get('guest_name', ''),
+            'check_in': data.get('check_in', ''),
+            'check_out': data.get('check_out', '')
+        }
         
-        notifications_sent = []
+        for channel, recipient in recipients.items():
+            if channel not in CHANNELS:
+                return jsonify({'error': f'Invalid notification type: {channel}'}), 400
+            error = recipient and invalid_recipient(channel, recipient)
+            if error:
+                return jsonify({'error': error}), 400
         
-        # Send email notification
-        if email:
-            email_message = f"Ваше бронирование {booking_id} в отеле {hotel_name} подтверждено!"
-            email_result = send_notification_internal(booking_id, 'email', email, email_message)
-            notifications_sent.append(email_result)
+        try:
+            messages = [
+                notification_queue.build_message(booking_id, channel, recipient,
+                                                 templates.render(template, params, locale, channel))
+                for channel, recipient in recipients.items() if recipient
+            ]
+        except TemplateNotFound as e:
+            return jsonify({'error': str(e.args[0])}), 400
         
-        # Send SMS notification
-        if phone:
-            sms_message = f"Бронирование {booking_id} подтверждено в {hotel_name}"
-            sms_result = send_notification_internal(booking_id, 'sms', phone, sms_message)
-            notifications_sent.append(sms_result)
+        notifications_sent = queue_notifications(messages, 'booking_confirmation')
         
         return jsonify({
             'booking_id': booking_id,
             'notifications': notifications_sent,
-            'message': 'Notifications sent successfully'
-        }), 200
+            'message': 'Notifications queued for delivery'
+        }), 202
         
     except Exception as e:
         logger.error(f"Error sending booking notifications: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-def send_notification_internal(booking_id, notification_type, recipient, message):
-    """Internal function to send notification"""
-    notification_id = str(uuid.uuid4())
-    
-    logger.info(f"Sending {notification_type} to {recipient}: {message}")
+@app.route('/api/notifications', methods=['GET'])
+def get_notifications():
+    """Notification history for a booking or recipient, newest first, with keyset pagination"""
+    try:
+        booking_id = request.args.get('booking_id')
+        recipient = request.args.get('recipient')
+        cursor = request.args.get('cursor')
+        try:
+            limit = parse_limit(request.args.get('limit'), 50, 500)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Without a filter the query could not use an index
+        if not booking_id and not recipient:
+            return jsonify({'error': 'booking_id or recipient is required'}), 400
+        
+        conditions = []
+        params = []
+        if booking_id:
+            conditions.append('booking_id = %s')
+            params.append(booking_id)
+        if recipient:
+            conditions.append('recipient = %s')
+            params.append(recipient)
+        if cursor:
+            try:
+                created_at, notification_id = notification_history.decode_cursor(cursor)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            conditions.append('(created_at, id) < (%s, %s)')
+            params.extend([created_at, notification_id])
+        params.append(limit + 1)
+        
+        conn = get_db_connection()
+        cur = conn.cursor()
+        
+        cur.execute(f'''
+            SELECT id, booking_id, notification_type, recipient, message, status, attempts, created_at
+            FROM notifications
+            WHERE {' AND '.join(conditions)}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        ''', params)
+        notifications = cur.fetchall()
+        
+        cur.close()
+        conn.close()
+        
+        next_cursor = None
+        if len(notifications) > limit:
+            notifications = notifications[:limit]
+            last = notifications[-1]
+            next_cursor = notification_history.encode_cursor(last['created_at'], last['id'])
+        
+        for notification in notifications:
+            notification['created_at'] = notification['created_at'].isoformat()
+        
+        return jsonify({
+            'notifications': notifications,
+            'count': len(notifications),
+            'next_cursor': next_cursor
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error getting notifications: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/notifications/dead-letters', methods=['GET'])
+def get_dead_letters():
+    """List dead letters waiting for replay"""
+    try:
+        try:
+            limit = parse_limit(request.args.get('limit'), 100, 1000)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        conn = get_db_connection()
+        cur = conn.cursor()
+        
+        cur.execute('''
+            SELECT id, booking_id, notification_type, recipient, message, attempts, failed_at
+            FROM notification_dead_letters
+            WHERE replayed_at IS NULL
+            ORDER BY failed_at
+            LIMIT %s
+        ''', (limit,))
+        dead_letters = cur.fetchall()
+        
+        cur.close()
+        conn.close()
+        
+        for dead_letter in dead_letters:
+            dead_letter['failed_at'] = dead_letter['failed_at'].isoformat()
+        
+        return jsonify({'dead_letters': dead_letters, 'count': len(dead_letters)}), 200
+        
+    except Exception as e:
+        logger.error(f"Error getting dead letters: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/notifications/dead-letters/replay', methods=['POST'])
+def replay_dead_letters():
+    """Put dead letters back on the retry schedule with a fresh attempt budget.
     
-    conn = get_db_connection()
-    cur = conn.cursor()
+    Replays are spread evenly over spread_seconds so a large backlog does not
+    hit the provider in one burst.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        ids = data.get('ids')
+        channel = data.get('type')
+        try:
+            limit = parse_limit(data.get('limit'), 1000, 10000)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        try:
+            spread_seconds = float(data.get('spread_seconds', 0))
+        except (TypeError, ValueError):
+            spread_seconds = None
+        if spread_seconds is None or not math.isfinite(spread_seconds) or spread_seconds < 0:
+            return jsonify({'error': 'spread_seconds must be a non-negative number'}), 400
+        if ids is not None and not (isinstance(ids, list) and all(isinstance(id_, str) for id_ in ids)):
+            return jsonify({'error': 'ids must be a list of strings'}), 400
+        
+        conditions = ['replayed_at IS NULL']
+        params = []
+        if ids:
+            conditions.append('id = ANY(%s)')
+            params.append(ids)
+        if channel:
+            conditions.append('notification_type = %s')
+            params.append(channel)
+        params.append(limit)
+        
+        conn = get_db_connection()
+        cur = conn.cursor()
+        
+        # Lock the rows so concurrent replays do not schedule them twice
+        cur.execute(f'''
+            SELECT id, booking_id, notification_type, recipient, message,
+                   COALESCE(created_at, failed_at) AS created_at
+            FROM notification_dead_letters
+            WHERE {' AND '.join(conditions)}
+            ORDER BY failed_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ''', params)
+        rows = cur.fetchall()
+        
+        messages = [{
+            'id': row['id'],
+            'booking_id': row['booking_id'],
+            'channel': row['notification_type'],
+            'recipient': row['recipient'],
+            'message': row['message'],
+            'attempts': 0,
+            'created_at': row['created_at'].isoformat()
+        } for row in rows]
+        
+        ids = [message['id'] for message in messages]
+        if messages:
+            cur.execute(
+                'UPDATE notification_dead_letters SET replayed_at = CURRENT_TIMESTAMP WHERE id = ANY(%s)',
+                (ids,)
+            )
+        # Committed before scheduling, so a failed commit never leaves queued messages behind
+        conn.commit()
+        
+        if messages:
+            now = time.time()
+            step = spread_seconds / len(messages)
+            try:
+                notification_queue.schedule(redis_client, messages, [now + index * step for index in range(len(messages))])
+            except redis.RedisError:
+                # Nothing was queued; make the rows replayable again
+                cur.execute('UPDATE notification_dead_letters SET replayed_at = NULL WHERE id = ANY(%s)', (ids,))
+                conn.commit()
+                raise
+        
+        cur.close()
+        conn.close()
+        
+        logger.info(f"Replaying {len(messages)} dead letters over {spread_seconds}s")
+        
+        return jsonify({
+            'replayed': len(messages),
+            'notification_ids': ids
+        }), 202
+        
+    except Exception as e:
+        logger.error(f"Error replaying dead letters: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/notifications/bulk', methods=['POST'])
+def send_bulk_notification():
+    """Queue one templated notification per recipient and channel as a single job.
     
-    cur.execute(
-        '''INSERT INTO notifications 
-           (id, booking_id, notification_type, recipient, message, status)
-           VALUES (%s, %s, %s, %s, %s, %s)''',
-        (notification_id, booking_id, notification_type, recipient, message, 'sent')
+    The message is a registered template (template, locale) or an inline
+    template_text. Recipients are given as a list of {booking_id, email, phone,
+    guest_name, ...} objects, or selected with a query {hotel_id, date, status}
+    that is resolved through booking-service. Like single sends, bulk messages
+    are recorded in the notifications table by the worker as they are delivered.
+    """
+    try:
+        data = request.get_json()
+        template = data.get('template')
+        template_text = data.get('template_text')
+        locale = data.get('locale', DEFAULT_LOCALE)
+        channels = data.get('channels', ['email'])
+        recipients = data.get('recipients')
+        query = data.get('query')
+        
+        if not (template or template_text) or (recipients is None and not query):
+            return jsonify({'error': 'template and recipients or query are required'}), 400
+        
+        if recipients is not None and not (isinstance(recipients, list)
+                                           and all(isinstance(recipient, dict) for recipient in recipients)):
+            return jsonify({'error': 'recipients must be a list of objects'}), 400
+        
+        if query and not isinstance(query, dict):
+            return jsonify({'error': 'query must be an object'}), 400
+        
+        if not isinstance(channels, list) or not channels or any(channel not in CHANNELS for channel in channels):
+            return jsonify({'error': 'Invalid notification type'}), 400
+        
+        # Compile once per channel, before anything is queued
+        try:
+            if template_text:
+                compiled = CompiledTemplate(template_text)
+                channel_templates = {channel: compiled for channel in channels}
+            else:
+                channel_templates = {channel: templates.get(template, locale, channel) for channel in channels}
+        except ValueError as e:
+            return jsonify({'error': f'Invalid template: {str(e)}'}), 400
+        except TemplateNotFound as e:
+            return jsonify({'error': str(e.args[0])}), 400
+        
+        if query:
+            try:
+                recipients = fetch_guests(query)
+            except requests.RequestException as e:
+                logger.error(f"Error fetching guests for bulk notification: {str(e)}")
+                return jsonify({'error': 'Failed to resolve recipients'}), 502
+        
+        # Addresses are checked first so an oversized job is rejected before rendering
+        targets = []
+        for recipient in recipients:
+            addresses = []
+            for channel in channels:
+                address = recipient.get(CHANNEL_ADDRESS_FIELDS[channel])
+                if address and not invalid_recipient(channel, address):
+                    addresses.append((channel, address))
+            if addresses:
+                targets.append((recipient, addresses))
+        
+        total = sum(len(addresses) for _, addresses in targets)
+        if total > BULK_MAX_MESSAGES:
+            return jsonify({'error': f'Too many messages, limit is {BULK_MAX_MESSAGES}'}), 400
+        
+        job_id = str(uuid.uuid4())
+        messages = []
+        for recipient, addresses in targets:
+            rendered = {}
+            for channel, address in addresses:
+                compiled = channel_templates[channel]
+                # Channels sharing a template render it once per recipient
+                text = rendered.get(compiled)
+                if text is None:
+                    text = rendered[compiled] = compiled.render(recipient)
+                messages.append(notification_queue.build_message(
+                    recipient.get('booking_id', ''), channel, address, text, job_id=job_id
+                ))
+        
+        notification_queue.enqueue_job(redis_client, job_id, messages, description=data.get('description', ''))
+        
+        logger.info(f"Queued bulk job {job_id} with {len(messages)} notifications")
+        
+        return jsonify({
+            'job_id': job_id,
+            'total': len(messages),
+            'status': 'queued'
+        }), 202
+        
+    except Exception as e:
+        logger.error(f"Error sending bulk notification: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/notifications/jobs/<job_id>', methods=['GET'])
+def get_notification_job(job_id):
+    """Get delivery progress of a bulk job"""
+    try:
+        job = notification_queue.get_job(redis_client, job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job), 200
+        
+    except Exception as e:
+        logger.error(f"Error getting notification job: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/templates', methods=['GET'])
+def get_templates():
+    """List message templates, with overrides applied"""
+    try:
+        return jsonify({'templates': templates.templates()}), 200
+        
+    except Exception as e:
+        logger.error(f"Error getting templates: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/templates', methods=['PUT'])
+def save_template():
+    """Create or replace a template override and invalidate compiled templates everywhere"""
+    try:
+        data = request.get_json()
+        name = data.get('name')
+        locale = data.get('locale', DEFAULT_LOCALE)
+        channel = data.get('channel') or ''
+        body = data.get('body')
+        
+        if not name or not body:
+            return jsonify({'error': 'Missing required fields'}), 400
+        
+        if channel and channel not in CHANNELS:
+            return jsonify({'error': 'Invalid notification type'}), 400
+        
+        try:
+            CompiledTemplate(body)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid template: {str(e)}'}), 400
+        
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute('''
+            INSERT INTO message_templates (name, locale, channel, body)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (name, locale, channel) DO UPDATE
+            SET body = EXCLUDED.body,
+                version = message_templates.version + 1,
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING version
+        ''', (name, locale, channel, body))
+        version = cur.fetchone()['version']
+        conn.commit()
+        cur.close()
+        conn.close()
+        
+        templates.invalidate()
+        
+        logger.info(f"Saved template {name}/{locale}/{channel or '*'} version {version}")
+        
+        return jsonify({
+            'name': name,
+            'locale': locale,
+            'channel': channel or None,
+            'version': version
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error saving template: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def fetch_guests(query):
+    """Resolve a bulk query to guest contacts through booking-service"""
+    response = requests.get(
+        f"{BOOKING_SERVICE}/api/bookings/guests",
+        params={
+            'hotel_id': query.get('hotel_id'),
+            'date': query.get('date'),
+            'status': query.get('status', 'confirmed')
+        },
+        timeout=10
     )
+    response.raise_for_status()
+    return response.json()['guests']
+
+def send_notification_internal(booking_id, notification_type, recipient, message, category=None):
+    """Internal function to queue notification"""
+    queued = notification_queue.build_message(booking_id, notification_type, recipient, message)
+    return queue_notifications([queued], category)[0]
+
+def queue_notifications(messages, category=None):
+    """Queue messages in one Redis round trip; history rows are written by the worker's batches"""
+    accepted = notification_queue.submit_many(redis_client, messages, category)
     
-    conn.commit()
-    cur.close()
-    conn.close()
-    
-    return {
-        'notification_id': notification_id,
-        'type': notification_type,
-        'status': 'sent'
-    }
+    results = []
+    for message, ok in zip(messages, accepted):
+        if ok:
+            logger.info(f"Queued {message['channel']} {message['id']} to {message['recipient']}")
+        else:
+            logger.info(f"Skipped duplicate {category} {message['channel']} for booking {message['booking_id']}")
+        results.append({
+            'notification_id': message['id'] if ok else None,
+            'type': message['channel'],
+            'status': 'queued' if ok else 'duplicate'
+        })
+    return results
 
 if __name__ == '__main__':
     create_database_if_not_exists()
@@ -0,0 +1,137 @@
+"""Consumer of booking events published by booking-service's outbox relay"""
+import json
+import logging
+import os
+import time
+
+import psycopg2
+import redis
+
+import notification_queue
+from message_templates import DEFAULT_LOCALE, TemplateNotFound
+
+logger = logging.getLogger(__name__)
+
+EVENTS_STREAM = 'booking:events'
+EVENTS_GROUP = 'notification-service'
+
+# Event type -> (template, dedup category)
+EVENT_NOTIFICATIONS = {
+    'booking.created': ('booking_created', 'booking_created'),
+    'booking.confirmed': ('booking_confirmation', 'booking_confirmation'),
+}
+
+# Event payload field holding the address for each channel
+CONTACT_FIELDS = {'email': 'guest_email', 'sms': 'guest_phone'}
+
+# Pending entries of consumers that are gone (crashed, or recreated under a
+# new hostname) are reclaimed after this idle time
+CLAIM_IDLE_MS = int(os.getenv('WORKER_CLAIM_IDLE_MS', 60000))
+CLAIM_INTERVAL = 30
+
+
+def event_messages(event_type, payload, templates):
+    """Build the notifications for one event; returns (category, messages)"""
+    template, category = EVENT_NOTIFICATIONS[event_type]
+    locale = payload.get('locale') or DEFAULT_LOCALE
+    messages = []
+    for channel, field in CONTACT_FIELDS.items():
+        recipient = payload.get(field)
+        if recipient:
+            text = templates.render(template, payload, locale, channel)
+            messages.append(notification_queue.build_message(payload['booking_id'], channel, recipient, text))
+    return category, messages
+
+
+class BookingEventConsumer:
+    """Turns booking events into queued notifications.
+
+    Processing is idempotent: notifications are deduplicated per
+    (booking_id, category, channel), so an event redelivered after a crash
+    does not notify the guest twice.
+    """
+
+    def __init__(self, redis_client, consumer_name, connection_factory, templates,
+                 batch_size=100, block_ms=1000, claim_idle_ms=CLAIM_IDLE_MS):
+        self.redis = redis_client
+        self.consumer_name = consumer_name
+        self.connection_factory = connection_factory
+        self.templates = templates
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self._conn = None
+        # Start with entries delivered to this consumer but never acknowledged
+        self._read_id = '0'
+        self._claimed_at = 0
+
+    def connection(self):
+        """Long-lived database connection, reopened after failures"""
+        if self._conn is None or self._conn.closed:
+            self._conn = self.connection_factory()
+        return self._conn
+
+    def ensure_group(self):
+        try:
+            self.redis.xgroup_create(EVENTS_STREAM, EVENTS_GROUP, id='0', mkstream=True)
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def run(self):
+        self.ensure_group()
+        logger.info(f"Booking event consumer {self.consumer_name} started")
+        while True:
+            try:
+                self.process_once()
+            except (redis.RedisError, psycopg2.Error) as e:
+                logger.error(f"Booking event consumer error: {str(e)}")
+                if self._conn is not None:
+                    self._conn.close()
+                # Unacknowledged entries are picked up again from the pending list
+                self._read_id = '0'
+                time.sleep(1)
+
+    def read_batch(self):
+        """Read own pending or new entries, and periodically reclaim entries stuck with other consumers"""
+        now = time.monotonic()
+        if now - self._claimed_at >= CLAIM_INTERVAL:
+            self._claimed_at = now
+            claimed = self.redis.xautoclaim(EVENTS_STREAM, EVENTS_GROUP, self.consumer_name,
+                                            min_idle_time=self.claim_idle_ms, count=self.batch_size)
+            if claimed[1]:
+                return claimed[1]
+
+        response = self.redis.xreadgroup(EVENTS_GROUP, self.consumer_name, {EVENTS_STREAM: self._read_id},
+                                         count=self.batch_size, block=self.block_ms)
+        return response[0][1] if response else []
+
+    def process_once(self):
+        entries = self.read_batch()
+        if not entries and self._read_id == '0':
+            # Pending backlog is done; continue with new entries
+            self._read_id = '>'
+            return 0
+        if not entries:
+            return 0
+
+        by_category = {}
+        for _, fields in entries:
+            if not fields or fields.get('type') not in EVENT_NOTIFICATIONS:
+                continue
+            try:
+                category, messages = event_messages(fields['type'], json.loads(fields['payload']), self.templates)
+            except (ValueError, KeyError, TemplateNotFound) as e:
+                logger.error(f"Skipping malformed booking event {fields.get('event_id')}: {str(e)}")
+                continue
+            by_category.setdefault(category, []).extend(messages)
+
+        queued = []
+        for category, messages in by_category.items():
+            accepted = notification_queue.submit_many(self.redis, messages, category)
+            queued.extend(message for message, ok in zip(messages, accepted) if ok)
+        notification_queue.record_queued(self.connection(), queued)
+
+        self.redis.xack(EVENTS_STREAM, EVENTS_GROUP, *[entry_id for entry_id, _ in entries])
+        logger.info(f"Processed {len(entries)} booking events, queued {len(queued)} notifications")
+        return len(entries)
@@ -0,0 +1,196 @@
+"""Per-locale, per-channel message templates, compiled once and cached"""
+import logging
+import string
+import threading
+import time
+from operator import itemgetter
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCALE = 'ru'
+
+# Bumped whenever a template override is saved, so every process recompiles
+TEMPLATES_VERSION_KEY = 'notifications:templates:version'
+
+# Built-in templates by (name, locale, channel); channel None applies to any channel
+DEFAULT_TEMPLATES = {
+    ('booking_confirmation', 'ru', 'email'):
+        'Ваше бронирование {booking_id} в отеле {hotel_name} подтверждено!',
+    ('booking_confirmation', 'ru', 'sms'):
+        'Бронирование {booking_id} подтверждено в {hotel_name}',
+    ('booking_confirmation', 'ru', None):
+        'Бронирование {booking_id} в отеле {hotel_name} подтверждено',
+    ('booking_confirmation', 'en', 'email'):
+        'Your booking {booking_id} at {hotel_name} is confirmed!',
+    ('booking_confirmation', 'en', 'sms'):
+        'Booking {booking_id} confirmed at {hotel_name}',
+    ('booking_confirmation', 'en', None):
+        'Booking {booking_id} at {hotel_name} is confirmed',
+    ('booking_created', 'ru', None):
+        'Бронирование создано! Отель: {hotel_name}, Номер: {room_type}, {check_in} - {check_out}',
+    ('booking_created', 'en', None):
+        'Booking received! Hotel: {hotel_name}, Room: {room_type}, {check_in} - {check_out}',
+}
+
+
+class TemplateNotFound(KeyError):
+    """Raised when no template matches a name, locale and channel"""
+
+
+class CompiledTemplate:
+    """A template parsed once into a %-format string and a field getter.
+
+    Rendering is a single C-level % operation on a tuple of values, which is
+    about twice as fast as str.format_map and allocates only the result.
+    Templates with format specs or conversions fall back to format_map.
+    Fields must be plain names: attribute access and indexing would only
+    fail at render time, so they are rejected when the template is compiled.
+    """
+
+    __slots__ = ('source', 'fields', '_format', '_getter', '_simple')
+
+    def __init__(self, source):
+        self.source = source
+        parts = list(string.Formatter().parse(source))
+        self.fields = tuple(field for _, field, _, _ in parts if field is not None)
+        for field in self.fields:
+            if not field.isidentifier():
+                raise ValueError(f"Template fields must be plain names, got {{{field}}}")
+        if any(spec and '{' in spec for _, field, spec, _ in parts if field is not None):
+            raise ValueError('Template format specs must not contain fields')
+        self._simple = all(
+            spec == '' and conversion is None
+            for _, field, spec, conversion in parts if field is not None
+        )
+        self._format = ''.join(
+            literal.replace('%', '%%') + ('%s' if field is not None else '')
+            for literal, field, _, _ in parts
+        )
+        if not self.fields:
+            self._getter = None
+        elif len(self.fields) == 1:
+            field = self.fields[0]
+            self._getter = lambda params: (params[field],)
+        else:
+            self._getter = itemgetter(*self.fields)
+
+    def render(self, params):
+        """Render with params; missing fields render as empty strings"""
+        if not self._simple:
+            return self.source.format_map(_Params(params))
+        if self._getter is None:
+            return self._format % ()
+        try:
+            return self._format % self._getter(params)
+        except KeyError:
+            return self._format % tuple(params.get(field, '') for field in self.fields)
+
+
+class _Params(dict):
+    def __missing__(self, key):
+        return ''
+
+
+class TemplateRegistry:
+    """Resolves templates by name, locale and channel.
+
+    Built-in templates can be overridden through load_overrides, a callable
+    returning {(name, locale, channel): source}. Overrides and compiled
+    templates are reloaded when the shared version in Redis changes, checked
+    at most once per version_refresh seconds.
+    """
+
+    def __init__(self, defaults=DEFAULT_TEMPLATES, load_overrides=None, redis_client=None,
+                 version_refresh=5.0):
+        self.defaults = defaults
+        self.load_overrides = load_overrides
+        self.redis = redis_client
+        self.version_refresh = version_refresh
+        self._sources = dict(defaults)
+        self._compiled = {}
+        self._version = 0
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def get(self, name, locale=DEFAULT_LOCALE, channel=None):
+        """Return the compiled template, falling back to any channel and the default locale"""
+        self._refresh()
+        key = (name, locale, channel)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            compiled = self._compile(key)
+        return compiled
+
+    def render(self, name, params, locale=DEFAULT_LOCALE, channel=None):
+        return self.get(name, locale, channel).render(params)
+
+    def exists(self, name):
+        self._refresh()
+        return any(key[0] == name for key in self._sources)
+
+    def templates(self):
+        """All current template sources as a list of dicts"""
+        self._refresh()
+        return [
+            {'name': name, 'locale': locale, 'channel': channel, 'body': source}
+            for (name, locale, channel), source in sorted(self._sources.items(), key=lambda item: str(item[0]))
+        ]
+
+    def invalidate(self):
+        """Make every process reload templates on its next lookup"""
+        if self.redis is not None:
+            try:
+                self.redis.incr(TEMPLATES_VERSION_KEY)
+            except redis.RedisError as e:
+                logger.warning(f"Failed to bump templates version: {str(e)}")
+        self._version = None
+        self._checked_at = None
+
+    def _compile(self, key):
+        name, locale, channel = key
+        for candidate in ((name, locale, channel), (name, locale, None),
+                          (name, DEFAULT_LOCALE, channel), (name, DEFAULT_LOCALE, None)):
+            source = self._sources.get(candidate)
+            if source is not None:
+                compiled = CompiledTemplate(source)
+                # Cache under the requested key so fallbacks are resolved once
+                self._compiled[key] = compiled
+                return compiled
+        raise TemplateNotFound(f"Template {name} not found for locale {locale}, channel {channel}")
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.version_refresh:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = now
+            version = self._read_version()
+            if version == self._version:
+                return
+            sources = dict(self.defaults)
+            # Version 0 means no override was ever saved; after a local
+            # invalidate (version None) overrides are always reloaded
+            if self.load_overrides is not None and (version or self._version is None):
+                try:
+                    sources.update(self.load_overrides())
+                except Exception as e:
+                    logger.error(f"Failed to load template overrides: {str(e)}")
+                    return
+            self._sources = sources
+            self._compiled = {}
+            self._version = version
+        finally:
+            self._lock.release()
+
+    def _read_version(self):
+        if self.redis is None:
+            return 0
+        try:
+            return int(self.redis.get(TEMPLATES_VERSION_KEY) or 0)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to read templates version: {str(e)}")
+            return self._version or 0
@@ -0,0 +1,180 @@
+"""Monthly partitioning of the notifications table and keyset pagination helpers.
+
+notifications is range-partitioned by created_at into one partition per
+month, named notifications_pYYYYMM. Old months are removed by dropping
+their partition, which is instant and leaves no dead tuples behind.
+"""
+import base64
+import json
+import logging
+import os
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = 'notifications'
+DEFAULT_PARTITION = 'notifications_default'
+PARTITION_PREFIX = 'notifications_p'
+RETENTION_MONTHS = int(os.getenv('NOTIFICATION_RETENTION_MONTHS', 6))
+PARTITIONS_AHEAD = int(os.getenv('NOTIFICATION_PARTITIONS_AHEAD', 2))
+
+CREATE_PARTITIONED_TABLE = '''
+    CREATE TABLE notifications (
+        id VARCHAR(36) NOT NULL,
+        booking_id VARCHAR(36) NOT NULL,
+        notification_type VARCHAR(50) NOT NULL,
+        recipient VARCHAR(255) NOT NULL,
+        message TEXT NOT NULL,
+        status VARCHAR(50) NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)
+'''
+
+# Created on the parent, so every partition gets them
+HISTORY_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_notifications_booking '
+    'ON notifications (booking_id, created_at DESC, id DESC)',
+    'CREATE INDEX IF NOT EXISTS idx_notifications_recipient '
+    'ON notifications (recipient, created_at DESC, id DESC)',
+)
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{PARTITION_PREFIX}{month.year:04d}{month.month:02d}'
+
+
+def partition_month(name):
+    """Month of a partition name, or None for other tables (e.g. the default partition)"""
+    suffix = name[len(PARTITION_PREFIX):]
+    if not name.startswith(PARTITION_PREFIX) or len(suffix) != 6 or not suffix.isdigit():
+        return None
+    return date(int(suffix[:4]), int(suffix[4:]), 1)
+
+
+def create_partition(cur, month):
+    """Create the partition for a month, moving its rows out of the default partition.
+
+    Postgres refuses to create a partition while the default partition holds
+    rows in its range, so in that case the default partition is detached,
+    the month is created, its rows are moved and the default is re-attached,
+    all in the caller's transaction.
+    """
+    name = partition_name(month)
+    bounds = (month, add_months(month, 1))
+    cur.execute(f'''
+        SELECT to_regclass(%s) IS NOT NULL AS present,
+               EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s) AS in_default
+    ''', (name,) + bounds)
+    row = cur.fetchone()
+    if row['present']:
+        return
+
+    if not row['in_default']:
+        cur.execute(f'CREATE TABLE {name} PARTITION OF {PARENT_TABLE} FOR VALUES FROM (%s) TO (%s)', bounds)
+        return
+
+    cur.execute(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION {DEFAULT_PARTITION}')
+    cur.execute(f'CREATE TABLE {name} PARTITION OF {PARENT_TABLE} FOR VALUES FROM (%s) TO (%s)', bounds)
+    cur.execute(f'''
+        INSERT INTO {name}
+        SELECT * FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s
+    ''', bounds)
+    cur.execute(f'DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s', bounds)
+    cur.execute(f'ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT')
+    logger.info(f'Moved rows for {month:%Y-%m} from {DEFAULT_PARTITION} to {name}')
+
+
+def ensure_partitions(cur, today=None, first_month=None, months_ahead=PARTITIONS_AHEAD):
+    """Create monthly partitions from first_month (default: this month) to months_ahead ahead"""
+    current = month_start(today or date.today())
+    month = month_start(first_month) if first_month else current
+    last = add_months(current, months_ahead)
+    while month <= last:
+        create_partition(cur, month)
+        month = add_months(month, 1)
+
+
+def list_partitions(cur):
+    cur.execute('''
+        SELECT child.relname AS name
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = %s
+    ''', (PARENT_TABLE,))
+    return [row['name'] for row in cur.fetchall()]
+
+
+def drop_expired_partitions(cur, today=None, retention_months=RETENTION_MONTHS):
+    """Drop partitions whose whole month is older than the retention period"""
+    cutoff = add_months(month_start(today or date.today()), -retention_months)
+    dropped = []
+    for name in sorted(list_partitions(cur)):
+        month = partition_month(name)
+        if month is not None and add_months(month, 1) <= cutoff:
+            cur.execute(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}')
+            cur.execute(f'DROP TABLE {name}')
+            dropped.append(name)
+    return dropped
+
+
+def ensure_partitioned_table(cur, today=None):
+    """Create the partitioned notifications table, migrating a plain legacy table into it"""
+    cur.execute('SELECT relkind FROM pg_class WHERE relname = %s AND relkind IN (%s, %s)',
+                (PARENT_TABLE, 'r', 'p'))
+    row = cur.fetchone()
+
+    if row and row['relkind'] == 'p':
+        ensure_partitions(cur, today)
+    elif row is None:
+        cur.execute(CREATE_PARTITIONED_TABLE)
+        cur.execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT')
+        ensure_partitions(cur, today)
+    else:
+        # Plain table from before partitioning: copy its rows into monthly partitions
+        cur.execute(f'ALTER TABLE {PARENT_TABLE} RENAME TO {PARENT_TABLE}_legacy')
+        cur.execute(f'ALTER TABLE {PARENT_TABLE}_legacy RENAME CONSTRAINT notifications_pkey TO notifications_legacy_pkey')
+        cur.execute(f'ALTER TABLE {PARENT_TABLE}_legacy ADD COLUMN IF NOT EXISTS attempts INTEGER')
+        cur.execute(CREATE_PARTITIONED_TABLE)
+        cur.execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT')
+        cur.execute(f'SELECT MIN(created_at) AS first FROM {PARENT_TABLE}_legacy')
+        first = cur.fetchone()['first']
+        ensure_partitions(cur, today, first_month=first)
+        cur.execute(f'''
+            INSERT INTO {PARENT_TABLE}
+                (id, booking_id, notification_type, recipient, message, status, attempts, created_at)
+            SELECT id, booking_id, notification_type, recipient, message, status,
+                   COALESCE(attempts, 0), COALESCE(created_at, CURRENT_TIMESTAMP)
+            FROM {PARENT_TABLE}_legacy
+        ''')
+        cur.execute(f'DROP TABLE {PARENT_TABLE}_legacy')
+        logger.info('Migrated notifications into a partitioned table')
+
+    for statement in HISTORY_INDEXES:
+        cur.execute(statement)
+
+
+def encode_cursor(created_at, notification_id):
+    """Encode a (created_at, id) position as an opaque cursor string"""
+    key = [created_at.isoformat(), notification_id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        created_at, notification_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), str(notification_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
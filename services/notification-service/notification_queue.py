@@ -0,0 +1,350 @@
+"""Redis stream queue for notifications, retry scheduling and batched persistence of results"""
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from datetime import datetime
+
+import redis
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = 'notifications:stream'
+CONSUMER_GROUP = 'notification-workers'
+# Approximate cap so acknowledged entries do not grow the stream forever
+STREAM_MAXLEN = 1000000
+
+# Retry schedule: a sorted set of payloads scored by the time they are due
+DELAYED_KEY = 'notifications:delayed'
+MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', 6))
+RETRY_BASE_DELAY = float(os.getenv('NOTIFICATION_RETRY_BASE_DELAY', 5))
+RETRY_MAX_DELAY = float(os.getenv('NOTIFICATION_RETRY_MAX_DELAY', 900))
+
+# Moves due entries from the schedule to the stream atomically, so several
+# workers can poll without delivering an entry twice. Cost is O(log N + M)
+# in the schedule size N and the number of due entries M.
+PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, payload in ipairs(due) do
+    redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', 'payload', payload)
+    redis.call('ZREM', KEYS[1], payload)
+end
+return #due
+"""
+
+
+# Deduplication: one notification per (booking_id, category, channel)
+DEDUP_KEY_PREFIX = 'notifications:dedup:'
+DEDUP_TTL = int(os.getenv('NOTIFICATION_DEDUP_TTL', 7 * 24 * 3600))
+
+# Coalescing (leading edge): the first message to a recipient is sent at once
+# and opens a window; follow-ups within the window are sent as one digest
+# when it closes
+COALESCE_KEY_PREFIX = 'notifications:coalesce:'
+COALESCE_WINDOW = float(os.getenv('NOTIFICATION_COALESCE_WINDOW', 10))
+COALESCE_TAKEN_TTL = 24 * 3600
+
+# Dedup check plus either a stream append or a coalescing buffer append,
+# in one atomic step. A message that finds no open window goes straight to
+# the stream and opens one; the first buffered follow-up schedules the
+# digest for the end of the window.
+SUBMIT_SCRIPT = """
+if ARGV[1] == '1' and not redis.call('SET', KEYS[1], '1', 'NX', 'EX', ARGV[2]) then
+    return 0
+end
+local window_ms = tonumber(ARGV[4])
+if window_ms > 0 and not redis.call('SET', KEYS[5], '1', 'NX', 'PX', window_ms) then
+    if redis.call('RPUSH', KEYS[2], ARGV[3]) == 1 then
+        local remaining_ms = math.max(redis.call('PTTL', KEYS[5]), 0)
+        redis.call('ZADD', KEYS[3], tonumber(ARGV[5]) + remaining_ms / 1000, ARGV[6])
+    end
+    return 1
+end
+redis.call('XADD', KEYS[4], 'MAXLEN', '~', ARGV[7], '*', 'payload', ARGV[3])
+return 1
+"""
+
+# Moves a coalescing buffer aside under the digest id and returns it.
+# A redelivered digest finds the buffer it already took.
+TAKE_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return {}
+    end
+    redis.call('RENAME', KEYS[1], KEYS[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[1])
+end
+return redis.call('LRANGE', KEYS[2], 0, -1)
+"""
+
+# Bulk job progress hashes
+JOB_KEY_PREFIX = 'notifications:job:'
+JOB_TTL = 7 * 24 * 3600
+
+
+def build_message(booking_id, channel, recipient, message, job_id=None):
+    """Create a queue message with its own notification id"""
+    queued = {
+        'id': str(uuid.uuid4()),
+        'booking_id': str(booking_id),
+        'channel': channel,
+        'recipient': recipient,
+        'message': message,
+        'attempts': 0,
+        'created_at': datetime.utcnow().isoformat()
+    }
+    if job_id:
+        queued['job_id'] = job_id
+    return queued
+
+
+def encode(message):
+    return json.dumps(message, ensure_ascii=False, sort_keys=True)
+
+
+def dedup_key(booking_id, category, channel):
+    return f'{DEDUP_KEY_PREFIX}{booking_id}:{category}:{channel}'
+
+
+def coalesce_key(channel, recipient):
+    return f'{COALESCE_KEY_PREFIX}{channel}:{recipient}'
+
+
+def coalesce_window_key(channel, recipient):
+    return f'{COALESCE_KEY_PREFIX}window:{channel}:{recipient}'
+
+
+def submit_many(redis_client, messages, category=None, window=COALESCE_WINDOW, now=None):
+    """Queue notifications in one round trip, deduplicated and coalesced per recipient.
+
+    With a category, only the first message for (booking_id, category,
+    channel) is accepted. With a positive window, the first message to a
+    recipient is queued immediately; further messages to that recipient
+    within the window are buffered and sent as one digest when it closes.
+    Returns one flag per message, False for a duplicate.
+    """
+    now = time.time() if now is None else now
+    pipe = redis_client.pipeline(transaction=False)
+    for message in messages:
+        marker = {
+            'id': str(uuid.uuid4()),
+            'digest': True,
+            'channel': message['channel'],
+            'recipient': message['recipient']
+        }
+        pipe.eval(
+            SUBMIT_SCRIPT, 5,
+            dedup_key(message['booking_id'], category, message['channel']),
+            coalesce_key(message['channel'], message['recipient']),
+            DELAYED_KEY,
+            STREAM_KEY,
+            coalesce_window_key(message['channel'], message['recipient']),
+            '1' if category else '0', DEDUP_TTL, encode(message), int(window * 1000),
+            now, encode(marker), STREAM_MAXLEN
+        )
+    return [bool(queued) for queued in pipe.execute()]
+
+
+def take_coalesced(redis_client, marker):
+    """Return the messages buffered for a digest marker"""
+    payloads = redis_client.eval(
+        TAKE_SCRIPT, 2,
+        coalesce_key(marker['channel'], marker['recipient']),
+        f"{COALESCE_KEY_PREFIX}taken:{marker['id']}",
+        COALESCE_TAKEN_TTL
+    )
+    return [json.loads(payload) for payload in payloads]
+
+
+def release_coalesced(redis_client, markers):
+    """Drop the buffers of digests whose results are committed"""
+    if markers:
+        redis_client.delete(*[f"{COALESCE_KEY_PREFIX}taken:{marker['id']}" for marker in markers])
+
+
+def build_digest(marker, messages):
+    """Combine buffered messages to one recipient into a single message"""
+    return {
+        'id': marker['id'],
+        'booking_id': messages[0]['booking_id'],
+        'channel': marker['channel'],
+        'recipient': marker['recipient'],
+        'message': '\n\n'.join(message['message'] for message in messages),
+        'attempts': 0,
+        'created_at': messages[0]['created_at'],
+        'coalesced_ids': [message['id'] for message in messages]
+    }
+
+
+def job_key(job_id):
+    return f'{JOB_KEY_PREFIX}{job_id}'
+
+
+def enqueue_job(redis_client, job_id, messages, description=''):
+    """Create a bulk job and append all its messages in one MULTI/EXEC transaction.
+
+    Either the job record and every message are queued, or nothing is.
+    """
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hset(job_key(job_id), mapping={
+        'total': len(messages),
+        'sent': 0,
+        'failed': 0,
+        'description': description,
+        'created_at': datetime.utcnow().isoformat()
+    })
+    pipe.expire(job_key(job_id), JOB_TTL)
+    for message in messages:
+        pipe.xadd(STREAM_KEY, {'payload': encode(message)},
+                  maxlen=STREAM_MAXLEN, approximate=True)
+    pipe.execute()
+
+
+def record_job_progress(redis_client, results):
+    """Count final delivery results of bulk messages; results are (message, status) pairs"""
+    counts = {}
+    for message, status in results:
+        if message.get('job_id') and status in ('sent', 'failed'):
+            key = (message['job_id'], status)
+            counts[key] = counts.get(key, 0) + 1
+    if not counts:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    for (job_id, status), count in counts.items():
+        pipe.hincrby(job_key(job_id), status, count)
+    pipe.execute()
+
+
+def get_job(redis_client, job_id):
+    """Return job progress, or None if the job is unknown or expired"""
+    job = redis_client.hgetall(job_key(job_id))
+    if not job:
+        return None
+    total, sent, failed = int(job['total']), int(job['sent']), int(job['failed'])
+    pending = max(total - sent - failed, 0)
+    return {
+        'job_id': job_id,
+        'description': job.get('description', ''),
+        'created_at': job.get('created_at'),
+        'total': total,
+        'sent': sent,
+        'failed': failed,
+        'pending': pending,
+        'status': 'completed' if pending == 0 else 'in_progress'
+    }
+
+
+def backoff_delay(attempts, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Exponential backoff with full jitter for the given number of failed attempts.
+
+    Jitter spreads retries of messages that failed together (e.g. during a
+    provider outage) instead of sending them back in one burst.
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempts - 1)))
+
+
+def schedule(redis_client, messages, due_times):
+    """Put messages on the retry schedule, due at the given epoch times.
+
+    Re-scheduling the same payload only moves its due time, so a batch that
+    is processed twice after a crash is not duplicated.
+    """
+    if not messages:
+        return
+    redis_client.zadd(DELAYED_KEY, {encode(message): due for message, due in zip(messages, due_times)})
+
+
+def schedule_retries(redis_client, messages, now=None):
+    """Schedule failed messages for another attempt with backoff"""
+    now = time.time() if now is None else now
+    schedule(redis_client, messages, [now + backoff_delay(message['attempts']) for message in messages])
+
+
+def promote_due(redis_client, limit, now=None):
+    """Move up to limit due messages from the schedule to the stream"""
+    now = time.time() if now is None else now
+    return redis_client.eval(PROMOTE_SCRIPT, 2, DELAYED_KEY, STREAM_KEY, now, limit, STREAM_MAXLEN)
+
+
+def ensure_consumer_group(redis_client):
+    """Create the consumer group (and the stream) if they do not exist yet"""
+    try:
+        redis_client.xgroup_create(STREAM_KEY, CONSUMER_GROUP, id='0', mkstream=True)
+    except redis.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def parse_entries(entries):
+    """Turn XREADGROUP/XAUTOCLAIM entries into (entry_id, message) pairs"""
+    result = []
+    for entry_id, fields in entries:
+        if not fields:
+            # Entry was trimmed from the stream while pending
+            result.append((entry_id, None))
+            continue
+        result.append((entry_id, json.loads(fields['payload'])))
+    return result
+
+
+def record_queued(conn, messages):
+    """Write 'queued' audit rows for accepted messages in one transaction.
+
+    The worker may already have stored a result for a message, which wins.
+    """
+    if not messages:
+        return
+    cur = conn.cursor()
+    execute_values(
+        cur,
+        '''INSERT INTO notifications
+           (id, booking_id, notification_type, recipient, message, status, attempts, created_at)
+           VALUES %s
+           ON CONFLICT (id, created_at) DO NOTHING''',
+        [(message['id'], message['booking_id'], message['channel'], message['recipient'],
+          message['message'], 'queued', 0, message['created_at'])
+         for message in messages],
+        page_size=len(messages)
+    )
+    conn.commit()
+    cur.close()
+
+
+def persist_batch(conn, rows, dead_letters=()):
+    """Write delivery results and dead letters in one transaction.
+
+    rows are (id, booking_id, channel, recipient, message, status, attempts,
+    created_at) tuples. A retried message keeps its id and created_at, so its
+    row is updated in place. dead_letters are messages that ran out of attempts.
+    """
+    if not rows:
+        return
+    cur = conn.cursor()
+    execute_values(
+        cur,
+        '''INSERT INTO notifications
+           (id, booking_id, notification_type, recipient, message, status, attempts, created_at)
+           VALUES %s
+           ON CONFLICT (id, created_at) DO UPDATE
+           SET status = EXCLUDED.status, attempts = EXCLUDED.attempts''',
+        rows,
+        page_size=len(rows)
+    )
+    if dead_letters:
+        execute_values(
+            cur,
+            '''INSERT INTO notification_dead_letters
+               (id, booking_id, notification_type, recipient, message, attempts, created_at)
+               VALUES %s
+               ON CONFLICT (id) DO UPDATE
+               SET attempts = EXCLUDED.attempts, failed_at = CURRENT_TIMESTAMP, replayed_at = NULL''',
+            [(message['id'], message['booking_id'], message['channel'],
+              message['recipient'], message['message'], message['attempts'], message['created_at'])
+             for message in dead_letters],
+            page_size=len(dead_letters)
+        )
+    conn.commit()
+    cur.close()
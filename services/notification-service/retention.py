@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""Retention job: keeps monthly notification partitions ahead and drops expired ones"""
+import logging
+import os
+import time
+
+import psycopg2
+
+from app import get_db_connection
+from notification_history import drop_expired_partitions, ensure_partitions
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RETENTION_INTERVAL = int(os.getenv('NOTIFICATION_RETENTION_INTERVAL', 6 * 3600))
+
+
+def run_maintenance():
+    """Create upcoming partitions and drop expired ones in one transaction"""
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        ensure_partitions(cur)
+        dropped = drop_expired_partitions(cur)
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    if dropped:
+        logger.info(f"Dropped expired notification partitions: {', '.join(dropped)}")
+    return dropped
+
+
+if __name__ == '__main__':
+    while True:
+        try:
+            run_maintenance()
+        except psycopg2.Error as e:
+            logger.error(f"Notification retention error: {str(e)}")
+        time.sleep(RETENTION_INTERVAL)
@@ -1,7 +1,20 @@
 import unittest
+import asyncio
 import json
+import socket
+from datetime import date, datetime
 from unittest.mock import patch, MagicMock
-from app import app
+
+import httpx
+from aiosmtpd.controller import Controller
+
+import notification_history
+import notification_queue
+from app import app, templates
+from booking_events import BookingEventConsumer
+from message_templates import CompiledTemplate, TemplateNotFound, TemplateRegistry
+from transports import HttpSmsTransport, SmtpTransport, TransportRegistry, WebhookTransport
+from worker import NotificationWorker
 
 
 class TestNotificationService(unittest.TestCase):
@@ -21,14 +34,11 @@ class TestNotificationService(unittest.TestCase):
         self.assertEqual(data['service'], 'notification-service')
 
     @patch('app.get_db_connection')
-    def test_send_notification_success(self, mock_db):
-        """Test successful notification sending"""
-        # Mock database connection
-        mock_conn = MagicMock()
-        mock_cur = MagicMock()
-        mock_cur.fetchone.return_value = {'id': 1}
-        mock_conn.cursor.return_value = mock_cur
-        mock_db.return_value = mock_conn
+    @patch('app.redis_client')
+    def test_send_notification_success(self, mock_redis, mock_db):
+        """Test notification is accepted into the queue without touching the database"""
+        mock_pipe = mock_redis.pipeline.return_value
+        mock_pipe.execute.return_value = [1]
 
         payload = {
             'booking_id': 1,
@@ -43,20 +53,43 @@ class TestNotificationService(unittest.TestCase):
             content_type='application/json'
         )
 
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, 202)
         data = json.loads(response.data)
         self.assertIn('notification_id', data)
-        self.assertIn('status', data)
+        self.assertEqual(data['status'], 'queued')
+        mock_pipe.eval.assert_called_once()
+        mock_db.assert_not_called()
 
-    @patch('app.get_db_connection')
-    def test_get_notifications_by_booking(self, mock_db):
+    @patch('app.redis_client')
+    def test_send_duplicate_notification(self, mock_redis):
+        """Test a repeated category for the same booking and channel is skipped"""
+        mock_pipe = mock_redis.pipeline.return_value
+        mock_pipe.execute.return_value = [0]
+
+        payload = {
+            'booking_id': 1,
+            'recipient': 'john@example.com',
+            'type': 'email',
+            'message': 'Your booking is confirmed',
+            'category': 'booking_confirmation'
+        }
+
+        response = self.app.post(
+            '/api/notifications/send',
+            data=json.dumps(payload),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['status'], 'duplicate')
+        args = mock_pipe.eval.call_args[0]
+        self.assertEqual(args[2], 'notifications:dedup:1:booking_confirmation:email')
+        self.assertEqual(args[7], '1')
+
+    @patch('app.redis_client')
+    def test_get_notifications_by_booking(self, mock_redis):
         """Test sending booking confirmation notification"""
-        # Mock database connection
-        mock_conn = MagicMock()
-        mock_cur = MagicMock()
-        mock_cur.fetchone.return_value = {'id': 1}
-        mock_conn.cursor.return_value = mock_cur
-        mock_db.return_value = mock_conn
+        mock_redis.pipeline.return_value.execute.return_value = [1]
 
         payload = {
             'email': 'john@example.com',
@@ -70,11 +103,672 @@ class TestNotificationService(unittest.TestCase):
             data=json.dumps(payload),
             content_type='application/json'
         )
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, 202)
         data = json.loads(response.data)
         self.assertIn('booking_id', data)
         self.assertIn('notifications', data)
 
+    @patch('app.redis_client')
+    def test_bulk_notification_with_recipients(self, mock_redis):
+        """Test a bulk job renders the template and queues everything in one transaction"""
+        mock_pipe = MagicMock()
+        mock_redis.pipeline.return_value = mock_pipe
+
+        payload = {
+            'template_text': 'Уважаемый {guest_name}, в отеле {hotel_name} нет воды',
+            'channels': ['email', 'sms'],
+            'recipients': [
+                {'booking_id': 'b1', 'guest_name': 'John', 'hotel_name': 'Test Hotel',
+                 'email': 'john@example.com', 'phone': '+100'},
+                {'booking_id': 'b2', 'guest_name': 'Jane', 'email': 'jane@example.com'}
+            ]
+        }
+        response = self.app.post(
+            '/api/notifications/bulk',
+            data=json.dumps(payload),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 202)
+        data = json.loads(response.data)
+        self.assertEqual(data['total'], 3)
+        mock_redis.pipeline.assert_called_once_with(transaction=True)
+        self.assertEqual(mock_pipe.xadd.call_count, 3)
+        mock_pipe.execute.assert_called_once()
+        first = json.loads(mock_pipe.xadd.call_args_list[0][0][1]['payload'])
+        self.assertEqual(first['message'], 'Уважаемый John, в отеле Test Hotel нет воды')
+        self.assertEqual(first['job_id'], data['job_id'])
+        self.assertEqual(mock_pipe.hset.call_args[1]['mapping']['total'], 3)
+
+    @patch('app.redis_client')
+    @patch('app.requests.get')
+    def test_bulk_notification_with_query(self, mock_get, mock_redis):
+        """Test a bulk query is resolved to guests through booking-service"""
+        mock_pipe = MagicMock()
+        mock_redis.pipeline.return_value = mock_pipe
+        mock_get.return_value.json.return_value = {'guests': [
+            {'booking_id': 'b1', 'guest_name': 'John', 'email': 'john@example.com', 'phone': None}
+        ]}
+
+        payload = {
+            'template_text': 'Уважаемый {guest_name}',
+            'query': {'hotel_id': 1, 'date': '2025-12-16'}
+        }
+        response = self.app.post(
+            '/api/notifications/bulk',
+            data=json.dumps(payload),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(json.loads(response.data)['total'], 1)
+        self.assertEqual(mock_get.call_args[1]['params'],
+                         {'hotel_id': 1, 'date': '2025-12-16', 'status': 'confirmed'})
+
+    @patch('app.BULK_MAX_MESSAGES', 2)
+    @patch('app.redis_client')
+    def test_bulk_notification_limit_checked_before_rendering(self, mock_redis):
+        """Test an oversized job is rejected without rendering or queueing anything"""
+        payload = {
+            'template_text': 'Уважаемый {guest_name}',
+            'channels': ['email', 'sms'],
+            'recipients': [
+                {'booking_id': 'b1', 'guest_name': 'John', 'email': 'john@example.com', 'phone': '+100'},
+                {'booking_id': 'b2', 'guest_name': 'Jane', 'email': 'jane@example.com'}
+            ]
+        }
+        with patch.object(CompiledTemplate, 'render') as mock_render:
+            response = self.app.post(
+                '/api/notifications/bulk',
+                data=json.dumps(payload),
+                content_type='application/json'
+            )
+
+        self.assertEqual(response.status_code, 400)
+        mock_render.assert_not_called()
+        mock_redis.pipeline.assert_not_called()
+
+    @patch('app.fetch_guests')
+    @patch('app.redis_client')
+    def test_bulk_notification_rejects_malformed_recipients(self, mock_redis, mock_fetch_guests):
+        """Test recipients must be a list of objects and query an object"""
+        for payload in ({'recipients': ['a@example.com']}, {'recipients': 'a@example.com'},
+                        {'recipients': {'email': 'a@example.com'}}, {'query': [1, '2025-12-16']},
+                        {'query': 'hotel_id=1'}, {'recipients': [], 'channels': 'email'}):
+            response = self.app.post(
+                '/api/notifications/bulk',
+                data=json.dumps(dict(payload, template_text='Уважаемый {guest_name}')),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400, payload)
+        mock_fetch_guests.assert_not_called()
+        mock_redis.pipeline.assert_not_called()
+
+    def test_bulk_notification_invalid_template(self):
+        """Test a malformed template is rejected before anything is queued"""
+        response = self.app.post(
+            '/api/notifications/bulk',
+            data=json.dumps({'template_text': 'Hello {guest_name', 'recipients': []}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @patch('app.get_db_connection')
+    def test_save_template_rejects_attribute_and_index_fields(self, mock_db):
+        """Test templates that could only fail at render time are not saved"""
+        for body in ('Booking {booking.id}', 'Hello {guest[0]}', '{price:{width}}'):
+            response = self.app.put(
+                '/api/templates',
+                data=json.dumps({'name': 'booking_confirmation', 'body': body}),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400, body)
+        mock_db.assert_not_called()
+
+    @patch('app.queue_notifications')
+    def test_booking_confirmation_uses_locale_templates(self, mock_queue):
+        """Test booking confirmations render the channel template for the requested locale"""
+        mock_queue.return_value = []
+
+        payload = {'email': 'john@example.com', 'phone': '+100', 'hotel_name': 'Test Hotel', 'locale': 'en'}
+        response = self.app.post(
+            '/api/notifications/booking/b1',
+            data=json.dumps(payload),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 202)
+        messages = [message['message'] for message in mock_queue.call_args[0][0]]
+        self.assertEqual(messages, ['Your booking b1 at Test Hotel is confirmed!',
+                                    'Booking b1 confirmed at Test Hotel'])
+
+    @patch('app.get_db_connection')
+    @patch('app.redis_client')
+    def test_booking_confirmation_multi_channel(self, mock_redis, mock_db):
+        """Test all channels are queued in one round trip"""
+        mock_pipe = mock_redis.pipeline.return_value
+        mock_pipe.execute.return_value = [1, 1, 1, 0]
+
+        payload = {
+            'hotel_name': 'Test Hotel',
+            'recipients': {
+                'email': 'john@example.com',
+                'sms': '+100',
+                'push': 'device-token',
+                'webhook': 'https://partner.example.com/hooks/booking'
+            }
+        }
+        response = self.app.post(
+            '/api/notifications/booking/b1',
+            data=json.dumps(payload),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 202)
+        data = json.loads(response.data)
+        self.assertEqual([n['status'] for n in data['notifications']], ['queued', 'queued', 'queued', 'duplicate'])
+        self.assertEqual(mock_pipe.eval.call_count, 4)
+        mock_pipe.execute.assert_called_once()
+        mock_db.assert_not_called()
+
+    def test_booking_confirmation_rejects_unknown_channel(self):
+        """Test unknown channels and non-URL or malformed webhooks are rejected"""
+        for recipients in ({'fax': '+100'}, {'webhook': 'ftp://example.com'}, {'webhook': 'https://[::1'},
+                           {'webhook': 'https://'}, {'webhook': 'https://example.com:99999'},
+                           {'webhook': 'http://localhost:5004/api'}, {'webhook': 'http://127.0.0.1/'},
+                           {'webhook': 'http://169.254.169.254/latest/meta-data'}, {'webhook': 'http://[::1]/'},
+                           {'webhook': 'http://10.0.0.5/'}, {'webhook': 'http://postgres:5432/'},
+                           {'webhook': 'http://booking-service:5002/api'}, {'webhook': 'http://metadata.internal/'}):
+            response = self.app.post(
+                '/api/notifications/booking/b1',
+                data=json.dumps({'recipients': recipients}),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400)
+
+    @patch('app.redis_client')
+    def test_get_notification_job(self, mock_redis):
+        """Test job status reports delivery progress"""
+        mock_redis.hgetall.return_value = {'total': '10', 'sent': '7', 'failed': '1', 'created_at': 'now'}
+
+        response = self.app.get('/api/notifications/jobs/job1')
+
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['pending'], 2)
+        self.assertEqual(data['status'], 'in_progress')
+
+        mock_redis.hgetall.return_value = {}
+        response = self.app.get('/api/notifications/jobs/missing')
+        self.assertEqual(response.status_code, 404)
+
+    @patch('app.get_db_connection')
+    def test_notification_history_keyset(self, mock_db):
+        """Test history pages by (created_at, id) and returns a cursor for the next page"""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [
+            {'id': f'n{i}', 'booking_id': 'b1', 'notification_type': 'email', 'recipient': 'a@example.com',
+             'message': 'Hi', 'status': 'sent', 'attempts': 1, 'created_at': datetime(2025, 12, 1, 12, 0, 10 - i)}
+            for i in range(3)
+        ]
+        mock_db.return_value.cursor.return_value = mock_cursor
+
+        response = self.app.get('/api/notifications?booking_id=b1&limit=2')
+
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([n['id'] for n in data['notifications']], ['n0', 'n1'])
+        self.assertEqual(notification_history.decode_cursor(data['next_cursor']),
+                         (datetime(2025, 12, 1, 12, 0, 9), 'n1'))
+
+        self.app.get(f"/api/notifications?booking_id=b1&limit=2&cursor={data['next_cursor']}")
+        sql, params = mock_cursor.execute.call_args[0]
+        self.assertIn('(created_at, id) < (%s, %s)', sql)
+        self.assertEqual(params, ['b1', datetime(2025, 12, 1, 12, 0, 9), 'n1', 3])
+
+        response = self.app.get('/api/notifications')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.app.get('/api/notifications?booking_id=b1&limit=abc')
+        self.assertEqual(response.status_code, 400)
+
+        self.app.get('/api/notifications?booking_id=b1&limit=0')
+        self.assertEqual(mock_cursor.execute.call_args[0][1], ['b1', 2])
+
+    @patch('app.redis_client')
+    @patch('app.get_db_connection')
+    def test_replay_dead_letters(self, mock_db, mock_redis):
+        """Test dead letters are rescheduled over the spread window and marked replayed"""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [
+            {'id': f'n{i}', 'booking_id': 'b1', 'notification_type': 'email',
+             'recipient': 'a@example.com', 'message': 'Hi', 'created_at': datetime(2025, 12, 1)}
+            for i in range(4)
+        ]
+        mock_db.return_value.cursor.return_value = mock_cursor
+        order = MagicMock()
+        order.attach_mock(mock_db.return_value.commit, 'commit')
+        order.attach_mock(mock_redis.zadd, 'zadd')
+
+        response = self.app.post(
+            '/api/notifications/dead-letters/replay',
+            data=json.dumps({'type': 'email', 'spread_seconds': 60}),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(json.loads(response.data)['replayed'], 4)
+        key, schedule = mock_redis.zadd.call_args[0]
+        self.assertEqual(key, 'notifications:delayed')
+        due_times = sorted(schedule.values())
+        self.assertAlmostEqual(due_times[-1] - due_times[0], 45, places=3)
+        self.assertTrue(all(json.loads(payload)['attempts'] == 0 for payload in schedule))
+        mock_db.return_value.commit.assert_called_once()
+        # Rows are marked replayed before anything is scheduled
+        self.assertEqual([call[0] for call in order.mock_calls], ['commit', 'zadd'])
+
+    @patch('app.redis_client')
+    @patch('app.get_db_connection')
+    def test_replay_dead_letters_rejects_bad_parameters(self, mock_db, mock_redis):
+        """Test malformed spread_seconds and ids are rejected before touching the database"""
+        for payload in ({'spread_seconds': 'soon'}, {'spread_seconds': -1}, {'spread_seconds': 'nan'},
+                        {'spread_seconds': 'inf'}, {'ids': 'n1'}, {'ids': [1, 2]}):
+            response = self.app.post(
+                '/api/notifications/dead-letters/replay',
+                data=json.dumps(payload),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400, payload)
+        mock_db.assert_not_called()
+        mock_redis.zadd.assert_not_called()
+
+
+class TestMessageTemplates(unittest.TestCase):
+    """Unit tests for the template registry"""
+
+    def test_compiled_template_render(self):
+        """Test rendering, missing fields and literal percent signs"""
+        template = CompiledTemplate('Скидка 10% для {guest_name} в {hotel_name}')
+        self.assertEqual(template.fields, ('guest_name', 'hotel_name'))
+        self.assertEqual(template.render({'guest_name': 'John', 'hotel_name': 'Test'}),
+                         'Скидка 10% для John в Test')
+        self.assertEqual(template.render({'guest_name': 'John'}), 'Скидка 10% для John в ')
+        self.assertEqual(CompiledTemplate('{price:.2f}').render({'price': 12.5}), '12.50')
+        self.assertEqual(CompiledTemplate('Без полей').render({}), 'Без полей')
+        for source in ('{0}', '{}', '{booking.id}', '{guest[0]}'):
+            with self.assertRaises(ValueError):
+                CompiledTemplate(source)
+
+    def test_registry_fallback_and_invalidation(self):
+        """Test locale/channel fallback and reloading overrides after a version bump"""
+        overrides = {}
+        mock_redis = MagicMock()
+        mock_redis.get.return_value = None
+        registry = TemplateRegistry(
+            defaults={('greeting', 'ru', None): 'Привет, {name}'},
+            load_overrides=lambda: dict(overrides),
+            redis_client=mock_redis,
+            version_refresh=0
+        )
+
+        self.assertEqual(registry.render('greeting', {'name': 'Ivan'}, 'en', 'sms'), 'Привет, Ivan')
+        self.assertIs(registry.get('greeting', 'en', 'sms'), registry.get('greeting', 'en', 'sms'))
+        with self.assertRaises(TemplateNotFound):
+            registry.get('missing')
+
+        overrides[('greeting', 'en', 'sms')] = 'Hi {name}'
+        mock_redis.get.return_value = '1'
+        self.assertEqual(registry.render('greeting', {'name': 'Ivan'}, 'en', 'sms'), 'Hi Ivan')
+
+
+class TestBookingEventConsumer(unittest.TestCase):
+    """Unit tests for the booking events consumer"""
+
+    @patch('notification_queue.execute_values')
+    def test_booking_created_event(self, mock_execute_values):
+        """Test a booking event queues guest notifications and is acknowledged"""
+        payload = {
+            'booking_id': 'b1', 'hotel_name': 'Test Hotel', 'room_type': 'Standard',
+            'check_in': '2025-12-15', 'check_out': '2025-12-20',
+            'guest_email': 'john@example.com', 'guest_phone': None, 'locale': 'en'
+        }
+        mock_redis = MagicMock()
+        mock_redis.xautoclaim.return_value = ['0-0', [], []]
+        mock_redis.xreadgroup.return_value = [['booking:events', [
+            ('5-0', {'event_id': '1', 'type': 'booking.created', 'payload': json.dumps(payload)}),
+            ('6-0', {'event_id': '2', 'type': 'booking.cancelled', 'payload': '{}'})
+        ]]]
+        mock_pipe = mock_redis.pipeline.return_value
+        mock_pipe.execute.return_value = [1]
+        mock_conn = MagicMock()
+
+        consumer = BookingEventConsumer(mock_redis, 'test', lambda: mock_conn, templates)
+        processed = consumer.process_once()
+
+        self.assertEqual(processed, 2)
+        args = mock_pipe.eval.call_args[0]
+        self.assertEqual(args[2], 'notifications:dedup:b1:booking_created:email')
+        message = json.loads(args[9])
+        self.assertEqual(message['message'], 'Booking received! Hotel: Test Hotel, Room: Standard, 2025-12-15 - 2025-12-20')
+        mock_conn.commit.assert_called_once()
+        mock_redis.xack.assert_called_once_with('booking:events', 'notification-service', '5-0', '6-0')
+
+    @patch('notification_queue.execute_values')
+    def test_reclaims_events_of_gone_consumers(self, mock_execute_values):
+        """Test events left pending by a consumer that no longer exists are reclaimed and processed"""
+        payload = {'booking_id': 'b1', 'guest_email': 'john@example.com', 'locale': 'en'}
+        mock_redis = MagicMock()
+        mock_redis.xautoclaim.return_value = ['0-0', [
+            ('3-0', {'event_id': '1', 'type': 'booking.confirmed', 'payload': json.dumps(payload)})
+        ], []]
+        mock_redis.pipeline.return_value.execute.return_value = [1]
+
+        consumer = BookingEventConsumer(mock_redis, 'new-host-events', MagicMock, templates, claim_idle_ms=5000)
+        processed = consumer.process_once()
+
+        self.assertEqual(processed, 1)
+        mock_redis.xautoclaim.assert_called_once_with('booking:events', 'notification-service', 'new-host-events',
+                                                      min_idle_time=5000, count=100)
+        mock_redis.xreadgroup.assert_not_called()
+        mock_redis.xack.assert_called_once_with('booking:events', 'notification-service', '3-0')
+
+
+class TestNotificationHistory(unittest.TestCase):
+    """Unit tests for partition maintenance"""
+
+    def test_ensure_partitions(self):
+        """Test monthly partitions are created through the months ahead"""
+        cur = MagicMock()
+        cur.fetchone.return_value = {'present': False, 'in_default': False}
+        notification_history.ensure_partitions(cur, today=date(2025, 11, 20), months_ahead=2)
+        creates = [call[0] for call in cur.execute.call_args_list if 'CREATE TABLE' in call[0][0]]
+        self.assertEqual(len(creates), 3)
+        self.assertIn('notifications_p202511 PARTITION OF notifications', creates[0][0])
+        self.assertEqual(creates[2][1], (date(2026, 1, 1), date(2026, 2, 1)))
+
+    def test_create_partition_moves_rows_from_default(self):
+        """Test a month with rows in the default partition is split out of it"""
+        cur = MagicMock()
+        cur.fetchone.return_value = {'present': False, 'in_default': True}
+        notification_history.create_partition(cur, date(2025, 11, 1))
+        statements = [' '.join(call[0][0].split()) for call in cur.execute.call_args_list[1:]]
+        self.assertEqual(statements[0], 'ALTER TABLE notifications DETACH PARTITION notifications_default')
+        self.assertIn('CREATE TABLE notifications_p202511 PARTITION OF notifications', statements[1])
+        self.assertIn('INSERT INTO notifications_p202511 SELECT * FROM notifications_default', statements[2])
+        self.assertIn('DELETE FROM notifications_default', statements[3])
+        self.assertEqual(statements[4], 'ALTER TABLE notifications ATTACH PARTITION notifications_default DEFAULT')
+
+    def test_create_partition_skips_existing(self):
+        """Test an existing partition is left alone"""
+        cur = MagicMock()
+        cur.fetchone.return_value = {'present': True, 'in_default': False}
+        notification_history.create_partition(cur, date(2025, 11, 1))
+        self.assertEqual(cur.execute.call_count, 1)
+
+    def test_drop_expired_partitions(self):
+        """Test only whole months older than the retention period are dropped"""
+        cur = MagicMock()
+        cur.fetchall.return_value = [
+            {'name': 'notifications_p202504'}, {'name': 'notifications_p202505'},
+            {'name': 'notifications_p202506'}, {'name': 'notifications_default'}
+        ]
+
+        dropped = notification_history.drop_expired_partitions(cur, today=date(2025, 11, 20), retention_months=6)
+
+        self.assertEqual(dropped, ['notifications_p202504'])
+        self.assertIn('DROP TABLE notifications_p202504', [c[0][0] for c in cur.execute.call_args_list])
+
+
+class TestNotificationWorker(unittest.TestCase):
+    """Unit tests for the queue worker"""
+
+    @patch('notification_queue.execute_values')
+    def test_process_batch(self, mock_execute_values):
+        """Test a batch is delivered, persisted with one insert and acknowledged"""
+        messages = [
+            {'id': 'n1', 'booking_id': 'b1', 'channel': 'email', 'recipient': 'a@example.com', 'message': 'Hi',
+             'created_at': '2025-12-01T00:00:00'},
+            {'id': 'n2', 'booking_id': 'b1', 'channel': 'sms', 'recipient': '+100', 'message': 'Hi',
+             'created_at': '2025-12-01T00:00:00'}
+        ]
+        mock_redis = MagicMock()
+        mock_redis.xautoclaim.return_value = ['0-0', [], []]
+        mock_redis.xreadgroup.return_value = [[
+            'notifications:stream',
+            [('1-0', {'payload': json.dumps(messages[0])}), ('2-0', {'payload': json.dumps(messages[1])})]
+        ]]
+        mock_conn = MagicMock()
+
+        worker = NotificationWorker(mock_redis, 'test', connection_factory=lambda: mock_conn)
+        processed = worker.process_once()
+
+        self.assertEqual(processed, 2)
+        mock_execute_values.assert_called_once()
+        rows = mock_execute_values.call_args[0][2]
+        self.assertEqual([row[0] for row in rows], ['n1', 'n2'])
+        self.assertEqual([row[5] for row in rows], ['sent', 'sent'])
+        mock_conn.commit.assert_called_once()
+        mock_redis.zadd.assert_not_called()
+        mock_redis.xack.assert_called_once_with('notifications:stream', 'notification-workers', '1-0', '2-0')
+
+    @patch('notification_queue.execute_values')
+    def test_failed_messages_retry_then_dead_letter(self, mock_execute_values):
+        """Test failures are rescheduled with backoff until the last attempt is dead-lettered"""
+        messages = [
+            {'id': 'n1', 'booking_id': 'b1', 'channel': 'email', 'recipient': 'a@example.com',
+             'message': 'Hi', 'attempts': 0, 'job_id': 'job1', 'created_at': '2025-12-01T00:00:00'},
+            {'id': 'n2', 'booking_id': 'b1', 'channel': 'email', 'recipient': 'b@example.com',
+             'message': 'Hi', 'attempts': 2, 'job_id': 'job1', 'created_at': '2025-12-01T00:00:00'}
+        ]
+        mock_redis = MagicMock()
+        mock_redis.xautoclaim.return_value = ['0-0', [], []]
+        mock_redis.xreadgroup.return_value = [[
+            'notifications:stream',
+            [('1-0', {'payload': json.dumps(messages[0])}), ('2-0', {'payload': json.dumps(messages[1])})]
+        ]]
+        transports = MagicMock()
+        transports.deliver_many.return_value = asyncio.sleep(0, result=['failed', 'failed'])
+
+        worker = NotificationWorker(mock_redis, 'test', connection_factory=MagicMock,
+                                    transports=transports, max_attempts=3)
+        worker.process_once()
+
+        mock_redis.eval.assert_called_once()
+        rows = mock_execute_values.call_args_list[0][0][2]
+        self.assertEqual([(row[5], row[6]) for row in rows], [('retrying', 1), ('failed', 3)])
+        dead_letters = mock_execute_values.call_args_list[1][0][2]
+        self.assertEqual([row[0] for row in dead_letters], ['n2'])
+        key, schedule = mock_redis.zadd.call_args[0]
+        self.assertEqual(key, 'notifications:delayed')
+        self.assertEqual([json.loads(payload)['id'] for payload in schedule], ['n1'])
+        # Only the final failure counts towards job progress
+        mock_redis.pipeline.return_value.hincrby.assert_called_once_with('notifications:job:job1', 'failed', 1)
+        mock_redis.xack.assert_called_once()
+
+    @patch('notification_queue.execute_values')
+    def test_digest_marker_coalesces_buffered_messages(self, mock_execute_values):
+        """Test messages buffered for one recipient are delivered as a single digest"""
+        buffered = [
+            {'id': f'n{i}', 'booking_id': f'b{i}', 'channel': 'email', 'recipient': 'a@example.com',
+             'message': f'Room {i} confirmed', 'attempts': 0, 'created_at': '2025-12-01T00:00:00'}
+            for i in range(3)
+        ]
+        marker = {'id': 'd1', 'digest': True, 'channel': 'email', 'recipient': 'a@example.com'}
+        mock_redis = MagicMock()
+        mock_redis.xautoclaim.return_value = ['0-0', [], []]
+        mock_redis.xreadgroup.return_value = [['notifications:stream', [('1-0', {'payload': json.dumps(marker)})]]]
+        mock_redis.eval.side_effect = lambda script, *args: (
+            [json.dumps(message) for message in buffered] if script == notification_queue.TAKE_SCRIPT else 0
+        )
+        transports = MagicMock()
+        transports.deliver_many.side_effect = lambda messages: asyncio.sleep(0, result=['sent'] * len(messages))
+
+        worker = NotificationWorker(mock_redis, 'test', connection_factory=MagicMock, transports=transports)
+        processed = worker.process_once()
+
+        self.assertEqual(processed, 1)
+        digest = transports.deliver_many.call_args[0][0][0]
+        self.assertEqual(digest['id'], 'd1')
+        self.assertEqual(digest['message'], 'Room 0 confirmed\n\nRoom 1 confirmed\n\nRoom 2 confirmed')
+        rows = mock_execute_values.call_args_list[0][0][2]
+        self.assertEqual([(row[0], row[5]) for row in rows],
+                         [('d1', 'sent'), ('n0', 'coalesced'), ('n1', 'coalesced'), ('n2', 'coalesced')])
+        mock_redis.delete.assert_called_once_with('notifications:coalesce:taken:d1')
+
+    def test_backoff_delay_bounds(self):
+        """Test backoff grows exponentially and is capped"""
+        for attempts in range(1, 12):
+            delay = notification_queue.backoff_delay(attempts, base=2, cap=60)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(60, 2 * 2 ** (attempts - 1)))
+
+    def test_submit_opens_coalescing_window_per_recipient(self):
+        """Test submit passes the recipient's window key and the window in milliseconds"""
+        mock_redis = MagicMock()
+        mock_redis.pipeline.return_value.execute.return_value = [1]
+        message = notification_queue.build_message('b1', 'sms', '+100', 'Hi')
+
+        notification_queue.submit_many(mock_redis, [message], window=10, now=100.0)
+
+        args = mock_redis.pipeline.return_value.eval.call_args[0]
+        self.assertEqual(args[1], 5)
+        self.assertEqual(args[6], 'notifications:coalesce:window:sms:+100')
+        self.assertEqual((args[10], args[11]), (10000, 100.0))
+
+
+class SmtpSink:
+    """aiosmtpd handler that records received messages"""
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return '250 OK'
+
+
+class TestTransports(unittest.TestCase):
+    """Tests for delivery transports against local stubs"""
+
+    def test_smtp_pool_reuses_connections(self):
+        """Test a burst of emails is sent over at most pool_size connections"""
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        sink = SmtpSink()
+        controller = Controller(sink, hostname='127.0.0.1', port=port)
+        controller.start()
+        self.addCleanup(controller.stop)
+
+        transport = SmtpTransport('127.0.0.1', port, pool_size=2)
+        registry = TransportRegistry({'email': transport})
+        messages = [
+            {'id': f'n{i}', 'channel': 'email', 'recipient': f'guest{i}@example.com', 'message': 'Hi'}
+            for i in range(10)
+        ]
+
+        async def run():
+            statuses = await registry.deliver_many(messages)
+            await registry.close()
+            return statuses
+
+        statuses = asyncio.run(run())
+
+        self.assertEqual(statuses, ['sent'] * 10)
+        self.assertEqual(len(sink.messages), 10)
+        self.assertLessEqual(transport.connections_opened, 2)
+
+    def test_sms_gateway_failure(self):
+        """Test SMS gateway errors mark only the affected message as failed"""
+        def handler(request):
+            body = json.loads(request.content)
+            return httpx.Response(500 if body['to'] == '+200' else 200, json={})
+
+        async def run():
+            client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            registry = TransportRegistry({'sms': HttpSmsTransport('http://sms.local/send', client=client)})
+            statuses = await registry.deliver_many([
+                {'id': 'n1', 'channel': 'sms', 'recipient': '+100', 'message': 'Hi'},
+                {'id': 'n2', 'channel': 'sms', 'recipient': '+200', 'message': 'Hi'},
+                {'id': 'n3', 'channel': 'fax', 'recipient': '+300', 'message': 'Hi'}
+            ])
+            await registry.close()
+            return statuses
+
+        self.assertEqual(asyncio.run(run()), ['sent', 'failed', 'failed'])
+
+    def test_webhook_posts_to_recipient_url(self):
+        """Test webhooks are posted to the recipient URL with the notification body"""
+        requests_seen = []
+
+        def handler(request):
+            requests_seen.append(request)
+            return httpx.Response(204)
+
+        async def run():
+            client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            registry = TransportRegistry({'webhook': WebhookTransport(client=client, allowed_hosts=('partner.example.com',))})
+            statuses = await registry.deliver_many([
+                {'id': 'n1', 'booking_id': 'b1', 'channel': 'webhook',
+                 'recipient': 'https://partner.example.com/hooks', 'message': 'Hi'}
+            ])
+            await registry.close()
+            return statuses
+
+        self.assertEqual(asyncio.run(run()), ['sent'])
+        self.assertEqual(str(requests_seen[0].url), 'https://partner.example.com/hooks')
+        self.assertEqual(json.loads(requests_seen[0].content)['booking_id'], 'b1')
+
+    def test_malformed_webhook_url_fails_the_message(self):
+        """Test a malformed URL fails its message instead of raising out of the batch"""
+        async def run():
+            client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(204)))
+            registry = TransportRegistry({'webhook': WebhookTransport(client=client, allowed_hosts=('partner.example.com',))})
+            statuses = await registry.deliver_many([
+                {'id': 'n1', 'booking_id': 'b1', 'channel': 'webhook', 'recipient': 'https://[::1', 'message': 'Hi'},
+                {'id': 'n2', 'booking_id': 'b2', 'channel': 'webhook',
+                 'recipient': 'https://partner.example.com/hooks', 'message': 'Hi'}
+            ])
+            await registry.close()
+            return statuses
+
+        self.assertEqual(asyncio.run(run()), ['failed', 'sent'])
+
+    def test_webhook_to_internal_address_fails_the_message(self):
+        """Test webhooks are not posted to hosts outside the allowlist or to non-public addresses"""
+        requests_seen = []
+
+        async def run():
+            client = httpx.AsyncClient(transport=httpx.MockTransport(
+                lambda request: requests_seen.append(request) or httpx.Response(204)))
+            open_transport = WebhookTransport(client=client, allowed_hosts=())
+            listed_transport = WebhookTransport(client=client, allowed_hosts=('partner.example.com',))
+            statuses = []
+            for transport, url in ((open_transport, 'http://127.0.0.1:5432/'),
+                                   (open_transport, 'http://169.254.169.254/latest/meta-data'),
+                                   (open_transport, 'http://redis:6379/'),
+                                   (listed_transport, 'https://evil.example.org/hooks')):
+                registry = TransportRegistry({'webhook': transport})
+                statuses += await registry.deliver_many([
+                    {'id': 'n1', 'booking_id': 'b1', 'channel': 'webhook', 'recipient': url, 'message': 'Hi'}
+                ])
+            await client.aclose()
+            return statuses
+
+        self.assertEqual(asyncio.run(run()), ['failed'] * 4)
+        self.assertEqual(requests_seen, [])
+
+    def test_unexpected_transport_error_fails_the_message(self):
+        """Test an unexpected exception in a transport is reported as a failed delivery"""
+        transport = MagicMock()
+        transport.send.side_effect = RuntimeError('boom')
+
+        async def run():
+            registry = TransportRegistry({'push': transport})
+            return await registry.deliver_many([{'id': 'n1', 'channel': 'push', 'recipient': 't', 'message': 'Hi'}])
+
+        self.assertEqual(asyncio.run(run()), ['failed'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,327 @@
+"""Async delivery transports with pooled connections and per-channel limits"""
+import asyncio
+import ipaddress
+import logging
+import os
+import socket
+from email.message import EmailMessage
+
+import aiosmtplib
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# SMTP settings; without SMTP_HOST email is only logged
+SMTP_HOST = os.getenv('SMTP_HOST')
+SMTP_PORT = int(os.getenv('SMTP_PORT', 25))
+SMTP_USER = os.getenv('SMTP_USER')
+SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
+SMTP_USE_TLS = os.getenv('SMTP_USE_TLS', 'false').lower() == 'true'
+SMTP_FROM = os.getenv('SMTP_FROM', 'noreply@hotel-booking.local')
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', 4))
+
+# SMS gateway settings; without SMS_API_URL SMS is only logged
+SMS_API_URL = os.getenv('SMS_API_URL')
+SMS_API_TOKEN = os.getenv('SMS_API_TOKEN')
+
+# Push gateway settings; without PUSH_API_URL push is only logged
+PUSH_API_URL = os.getenv('PUSH_API_URL')
+PUSH_API_TOKEN = os.getenv('PUSH_API_TOKEN')
+
+# Maximum in-flight sends per channel
+CHANNEL_CONCURRENCY = {
+    'email': int(os.getenv('EMAIL_CONCURRENCY', 8)),
+    'sms': int(os.getenv('SMS_CONCURRENCY', 16)),
+    'push': int(os.getenv('PUSH_CONCURRENCY', 32)),
+    'webhook': int(os.getenv('WEBHOOK_CONCURRENCY', 16))
+}
+DEFAULT_CONCURRENCY = 8
+
+# Hosts webhooks may be posted to, e.g. WEBHOOK_ALLOWED_HOSTS=partner.example.com;
+# subdomains of a listed host are allowed too. Without a list any public host is allowed
+WEBHOOK_ALLOWED_HOSTS = tuple(
+    host.strip().lower().rstrip('.') for host in os.getenv('WEBHOOK_ALLOWED_HOSTS', '').split(',') if host.strip()
+)
+
+# Name suffixes that only resolve inside a private network
+INTERNAL_HOST_SUFFIXES = ('.localhost', '.local', '.localdomain', '.internal')
+
+DEFAULT_SUBJECT = 'Уведомление о бронировании'
+
+
+class DeliveryError(Exception):
+    """Raised by a transport when a message could not be delivered"""
+
+
+def webhook_host_error(host, allowed_hosts=WEBHOOK_ALLOWED_HOSTS):
+    """Return why webhooks may not be posted to host, or None.
+
+    Only the name is checked here; WebhookTransport also checks the
+    addresses it resolves to before sending.
+    """
+    host = host.lower().rstrip('.')
+    if allowed_hosts:
+        if any(host == allowed or host.endswith('.' + allowed) for allowed in allowed_hosts):
+            return None
+        return f'Webhook host {host} is not allowed'
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        # Single-label names are services on the internal network, e.g. postgres or redis
+        if '.' not in host or host.endswith(INTERNAL_HOST_SUFFIXES):
+            return f'Webhook host {host} is internal'
+        return None
+    if not address.is_global:
+        return f'Webhook host {host} is not a public address'
+    return None
+
+
+def is_public_address(address):
+    try:
+        return ipaddress.ip_address(address.split('%', 1)[0]).is_global
+    except ValueError:
+        return False
+
+
+class Transport:
+    """Base class for delivery transports"""
+
+    async def send(self, message):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class LogTransport(Transport):
+    """Logs the message instead of sending it"""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def send(self, message):
+        logger.info(f"Sending {self.channel} to {message['recipient']}: {message['message']}")
+
+
+class SmtpTransport(Transport):
+    """SMTP transport backed by a pool of persistent connections.
+
+    Each connection stays open between messages, so a batch costs at most
+    pool_size handshakes instead of one per message.
+    """
+
+    def __init__(self, host, port, username=None, password=None, use_tls=False,
+                 sender=SMTP_FROM, pool_size=SMTP_POOL_SIZE, timeout=10):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.sender = sender
+        self.timeout = timeout
+        self.connections_opened = 0
+        self._pool = asyncio.LifoQueue()
+        for _ in range(pool_size):
+            self._pool.put_nowait(None)
+
+    async def _connect(self):
+        client = aiosmtplib.SMTP(hostname=self.host, port=self.port,
+                                 use_tls=self.use_tls, timeout=self.timeout)
+        await client.connect()
+        if self.username:
+            await client.login(self.username, self.password)
+        self.connections_opened += 1
+        return client
+
+    async def send(self, message):
+        email = EmailMessage()
+        email['From'] = self.sender
+        email['To'] = message['recipient']
+        email['Subject'] = message.get('subject') or DEFAULT_SUBJECT
+        email.set_content(message['message'])
+
+        client = await self._pool.get()
+        try:
+            if client is None or not client.is_connected:
+                client = await self._connect()
+            await client.send_message(email)
+        except (aiosmtplib.SMTPException, OSError) as e:
+            # Drop the broken connection; the slot reconnects on next use
+            if client is not None:
+                client.close()
+            client = None
+            raise DeliveryError(f"SMTP delivery to {message['recipient']} failed: {str(e)}")
+        finally:
+            self._pool.put_nowait(client)
+
+    async def close(self):
+        while not self._pool.empty():
+            client = self._pool.get_nowait()
+            if client is not None and client.is_connected:
+                try:
+                    await client.quit()
+                except aiosmtplib.SMTPException:
+                    client.close()
+
+
+class HttpTransport(Transport):
+    """Base for transports posting JSON over a keep-alive connection pool"""
+
+    name = 'HTTP'
+
+    def __init__(self, token=None, client=None, max_connections=DEFAULT_CONCURRENCY):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        self.client = client or httpx.AsyncClient(
+            timeout=10.0,
+            headers=headers,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections)
+        )
+
+    def request(self, message):
+        """Return (url, json body) for a message"""
+        raise NotImplementedError
+
+    async def send(self, message):
+        url, body = self.request(message)
+        try:
+            response = await self.client.post(url, json=body)
+            response.raise_for_status()
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
+            raise DeliveryError(f"{self.name} delivery to {message['recipient']} failed: {str(e)}")
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class HttpSmsTransport(HttpTransport):
+    """SMS transport posting to an HTTP gateway"""
+
+    name = 'SMS'
+
+    def __init__(self, url, token=None, client=None, max_connections=CHANNEL_CONCURRENCY['sms']):
+        super().__init__(token, client, max_connections)
+        self.url = url
+
+    def request(self, message):
+        return self.url, {'to': message['recipient'], 'text': message['message'], 'reference': message['id']}
+
+
+class HttpPushTransport(HttpTransport):
+    """Push transport posting to a push gateway; the recipient is a device token"""
+
+    name = 'Push'
+
+    def __init__(self, url, token=None, client=None, max_connections=CHANNEL_CONCURRENCY['push']):
+        super().__init__(token, client, max_connections)
+        self.url = url
+
+    def request(self, message):
+        return self.url, {
+            'token': message['recipient'],
+            'title': message.get('subject') or DEFAULT_SUBJECT,
+            'body': message['message'],
+            'reference': message['id']
+        }
+
+
+class WebhookTransport(HttpTransport):
+    """Webhook transport; the recipient is the URL to post the notification to.
+
+    Without allowed_hosts, a webhook is only posted if every address its
+    host resolves to is public, so recipients cannot reach internal services.
+    """
+
+    name = 'Webhook'
+
+    def __init__(self, client=None, max_connections=CHANNEL_CONCURRENCY['webhook'],
+                 allowed_hosts=WEBHOOK_ALLOWED_HOSTS):
+        super().__init__(None, client, max_connections)
+        self.allowed_hosts = allowed_hosts
+
+    async def send(self, message):
+        await self.check_target(message['recipient'])
+        await super().send(message)
+
+    async def check_target(self, recipient):
+        """Raise DeliveryError unless the URL's host may receive webhooks"""
+        try:
+            url = httpx.URL(recipient)
+        except httpx.InvalidURL as e:
+            raise DeliveryError(f"Webhook delivery to {recipient} failed: {str(e)}")
+        error = webhook_host_error(url.host, self.allowed_hosts)
+        if error:
+            raise DeliveryError(error)
+        if self.allowed_hosts:
+            return
+        port = url.port or (443 if url.scheme == 'https' else 80)
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(url.host, port, type=socket.SOCK_STREAM)
+        except OSError as e:
+            raise DeliveryError(f"Webhook host {url.host} could not be resolved: {str(e)}")
+        if not all(is_public_address(info[4][0]) for info in infos):
+            raise DeliveryError(f"Webhook host {url.host} resolves to a non-public address")
+
+    def request(self, message):
+        return message['recipient'], {
+            'id': message['id'],
+            'booking_id': message['booking_id'],
+            'message': message['message'],
+            'created_at': message.get('created_at')
+        }
+
+
+class TransportRegistry:
+    """Routes messages to channel transports and limits concurrency per channel"""
+
+    def __init__(self, transports, concurrency=None):
+        self.transports = transports
+        limits = dict(CHANNEL_CONCURRENCY, **(concurrency or {}))
+        self._limits = {channel: limits.get(channel, DEFAULT_CONCURRENCY) for channel in transports}
+        self._semaphores = {}
+
+    def _semaphore(self, channel):
+        # Created lazily so they bind to the loop that runs the sends
+        if channel not in self._semaphores:
+            self._semaphores[channel] = asyncio.Semaphore(self._limits[channel])
+        return self._semaphores[channel]
+
+    async def deliver(self, message):
+        """Deliver one message and return its status"""
+        transport = self.transports.get(message['channel'])
+        if transport is None:
+            logger.warning(f"Unknown channel {message['channel']} for notification {message['id']}")
+            return 'failed'
+
+        async with self._semaphore(message['channel']):
+            try:
+                await transport.send(message)
+            except DeliveryError as e:
+                logger.warning(str(e))
+                return 'failed'
+            except Exception:
+                # A bug or bad payload must not kill the worker and leave the entry unacknowledged
+                logger.exception(f"Unexpected error delivering {message['channel']} notification {message['id']}")
+                return 'failed'
+        return 'sent'
+
+    async def deliver_many(self, messages):
+        """Deliver messages concurrently, returning statuses in input order"""
+        return await asyncio.gather(*(self.deliver(message) for message in messages))
+
+    async def close(self):
+        for transport in self.transports.values():
+            await transport.close()
+
+
+def default_registry():
+    """Build transports from the environment"""
+    if SMTP_HOST:
+        email = SmtpTransport(SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, SMTP_USE_TLS)
+    else:
+        email = LogTransport('email')
+
+    sms = HttpSmsTransport(SMS_API_URL, SMS_API_TOKEN) if SMS_API_URL else LogTransport('sms')
+    push = HttpPushTransport(PUSH_API_URL, PUSH_API_TOKEN) if PUSH_API_URL else LogTransport('push')
+
+    return TransportRegistry({'email': email, 'sms': sms, 'push': push, 'webhook': WebhookTransport()})
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Notification worker: delivers queued notifications and persists results in batches"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+import psycopg2
+import redis
+
+from app import DB_CONFIG, REDIS_HOST, REDIS_PORT, get_db_connection, templates
+from booking_events import BookingEventConsumer
+from notification_queue import (CONSUMER_GROUP, MAX_ATTEMPTS, STREAM_KEY, build_digest,
+                                ensure_consumer_group, parse_entries, persist_batch, promote_due,
+                                record_job_progress, release_coalesced, schedule_retries,
+                                take_coalesced)
+from transports import default_registry
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', 2))
+BATCH_SIZE = int(os.getenv('WORKER_BATCH_SIZE', 500))
+BLOCK_MS = int(os.getenv('WORKER_BLOCK_MS', 1000))
+# Pending entries of crashed consumers are reclaimed after this idle time
+CLAIM_IDLE_MS = int(os.getenv('WORKER_CLAIM_IDLE_MS', 60000))
+CLAIM_INTERVAL = 30
+
+
+class NotificationWorker:
+    """Consumes the notification stream as one member of the consumer group.
+
+    Deliveries run on an event loop owned by the worker, so transport
+    connection pools survive from one batch to the next.
+    """
+
+    def __init__(self, redis_client, consumer_name, connection_factory=get_db_connection,
+                 batch_size=BATCH_SIZE, block_ms=BLOCK_MS, transports=None, max_attempts=MAX_ATTEMPTS):
+        self.redis = redis_client
+        self.consumer_name = consumer_name
+        self.connection_factory = connection_factory
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.max_attempts = max_attempts
+        self.loop = asyncio.new_event_loop()
+        self.transports = transports or default_registry()
+        self._conn = None
+        self._claimed_at = 0
+
+    def connection(self):
+        """Long-lived database connection, reopened after failures"""
+        if self._conn is None or self._conn.closed:
+            self._conn = self.connection_factory()
+        return self._conn
+
+    def run(self):
+        ensure_consumer_group(self.redis)
+        logger.info(f"Notification worker {self.consumer_name} started")
+        while True:
+            try:
+                self.process_once()
+            except (redis.RedisError, psycopg2.Error) as e:
+                logger.error(f"Notification worker error: {str(e)}")
+                if self._conn is not None:
+                    self._conn.close()
+                time.sleep(1)
+
+    def read_batch(self):
+        """Read new entries, and periodically reclaim entries stuck with dead consumers"""
+        # Retries that are due go back on the stream, at most one batch per poll
+        promote_due(self.redis, self.batch_size)
+
+        now = time.monotonic()
+        if now - self._claimed_at >= CLAIM_INTERVAL:
+            self._claimed_at = now
+            claimed = self.redis.xautoclaim(STREAM_KEY, CONSUMER_GROUP, self.consumer_name,
+                                            min_idle_time=CLAIM_IDLE_MS, count=self.batch_size)
+            if claimed[1]:
+                return parse_entries(claimed[1])
+
+        response = self.redis.xreadgroup(CONSUMER_GROUP, self.consumer_name, {STREAM_KEY: '>'},
+                                         count=self.batch_size, block=self.block_ms)
+        if not response:
+            return []
+        return parse_entries(response[0][1])
+
+    def expand_digests(self, messages):
+        """Replace digest markers with the messages buffered for their recipient.
+
+        Returns the messages to deliver, the buffered messages merged into a
+        digest and the markers whose buffers were taken.
+        """
+        expanded = []
+        coalesced = []
+        markers = []
+        for message in messages:
+            if not message.get('digest'):
+                expanded.append(message)
+                continue
+            markers.append(message)
+            buffered = take_coalesced(self.redis, message)
+            if len(buffered) == 1:
+                expanded.append(buffered[0])
+            elif buffered:
+                expanded.append(build_digest(message, buffered))
+                coalesced.extend(buffered)
+        return expanded, coalesced, markers
+
+    def process_once(self):
+        """Deliver one batch, persist it in one transaction and acknowledge it.
+
+        Failed messages are rescheduled with backoff until they run out of
+        attempts, then stored as dead letters with status 'failed'.
+        """
+        entries = self.read_batch()
+        if not entries:
+            return 0
+
+        messages = [message for _, message in entries if message is not None]
+        messages, coalesced, markers = self.expand_digests(messages)
+        statuses = self.loop.run_until_complete(self.transports.deliver_many(messages))
+
+        rows = []
+        results = []
+        retries = []
+        dead_letters = []
+        for message, status in zip(messages, statuses):
+            message = dict(message, attempts=message.get('attempts', 0) + 1)
+            if status == 'failed':
+                if message['attempts'] < self.max_attempts:
+                    status = 'retrying'
+                    retries.append(message)
+                else:
+                    dead_letters.append(message)
+            results.append((message, status))
+            rows.append((message['id'], message['booking_id'], message['channel'],
+                         message['recipient'], message['message'], status, message['attempts'],
+                         message['created_at']))
+        # Messages merged into a digest are recorded once, under their own ids
+        rows.extend(
+            (message['id'], message['booking_id'], message['channel'],
+             message['recipient'], message['message'], 'coalesced', 0, message['created_at'])
+            for message in coalesced
+        )
+        persist_batch(self.connection(), rows, dead_letters)
+        schedule_retries(self.redis, retries)
+        record_job_progress(self.redis, results)
+
+        # Acknowledge only after the results are committed and retries scheduled
+        self.redis.xack(STREAM_KEY, CONSUMER_GROUP, *[entry_id for entry_id, _ in entries])
+        release_coalesced(self.redis, markers)
+        return len(messages)
+
+
+def run_worker(index):
+    redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+    consumer_name = f"{socket.gethostname()}-{index}"
+    NotificationWorker(redis_client, consumer_name).run()
+
+
+def run_event_consumer():
+    redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+    consumer_name = f"{socket.gethostname()}-events"
+    BookingEventConsumer(redis_client, consumer_name, get_db_connection, templates).run()
+
+
+if __name__ == '__main__':
+    logger.info(f"Starting {WORKER_PROCESSES} notification worker processes for {DB_CONFIG['database']}")
+    processes = [multiprocessing.Process(target=run_worker, args=(index,)) for index in range(WORKER_PROCESSES)]
+    processes.append(multiprocessing.Process(target=run_event_consumer))
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
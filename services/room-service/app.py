@@ -271,6 +271,42 @@ def get_extra_services():
         logger.error(f"Error getting extra services: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/pricing/lowest', methods=['POST'])
+def get_lowest_prices():
+    """Get the lowest nightly price for several room types in one pass"""
+    try:
+        data = request.get_json()
+        room_types = data.get('room_types', [])
+
+        if not isinstance(room_types, list):
+            return jsonify({'error': 'room_types must be a list'}), 400
+
+        if not room_types:
+            return jsonify({'prices': {}}), 200
+
+        conn = get_db_connection()
+        cur = conn.cursor()
+
+        cur.execute(
+            '''SELECT rt.room_type, rt.base_price * MIN(pr.multiplier) AS nightly_price
+               FROM room_types rt CROSS JOIN pricing_rules pr
+               WHERE rt.room_type = ANY(%s)
+               GROUP BY rt.room_type, rt.base_price''',
+            (room_types,)
+        )
+        rows = cur.fetchall()
+
+        cur.close()
+        conn.close()
+
+        prices = {row['room_type']: round(float(row['nightly_price']), 2) for row in rows}
+
+        return jsonify({'prices': prices}), 200
+
+    except Exception as e:
+        logger.error(f"Error getting lowest prices: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/pricing/calculate', methods=['POST'])
 def calculate_price():
     """Calculate total price based on room type, tariff, days, and extras"""
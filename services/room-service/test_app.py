@@ -122,6 +122,29 @@ class TestRoomService(unittest.TestCase):
         self.assertEqual(data['extra_services'][1]['service_code'], 'breakfast')
 
 
+    @patch('app.get_db_connection')
+    def test_get_lowest_prices(self, mock_db):
+        """Test lowest nightly prices for several room types in one query"""
+        mock_conn = MagicMock()
+        mock_cur = MagicMock()
+        mock_cur.fetchall.return_value = [
+            {'room_type': 'Standard', 'nightly_price': 90.0},
+            {'room_type': 'Luxury', 'nightly_price': 225.0}
+        ]
+        mock_conn.cursor.return_value = mock_cur
+        mock_db.return_value = mock_conn
+
+        response = self.app.post(
+            '/api/pricing/lowest',
+            data=json.dumps({'room_types': ['Standard', 'Luxury']}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['prices'], {'Standard': 90.0, 'Luxury': 225.0})
+        self.assertEqual(mock_cur.execute.call_count, 1)
+
+
 if __name__ == '__main__':
     unittest.main()
 